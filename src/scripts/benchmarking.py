@@ -0,0 +1,84 @@
+### Shared by the benchmark scripts
+# They run talesbot in a scratch directory with its own config/ and database,
+# so that they are safe to run from a checkout with a live config/.
+
+import os
+import resource
+import subprocess
+import tempfile
+
+
+def enter_scratch_directory(workdir: str | None, prefix: str) -> str:
+    """Makes `workdir` (or a new temporary directory) the working directory
+    and points talesbot's config at it. talesbot reads its config when it
+    is imported, so this must be called before importing it."""
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix=prefix)
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    database = os.path.join(workdir, "talesbot.sqlite")
+    for name, value in {
+        "DISCORD_TOKEN": "fake-token",
+        "APPLICATION_ID": "1",
+        "DATABASE_URI": f"sqlite+aiosqlite:///{database}",
+        "GUILD_NAME": "Tales 0",
+        "GM_ROLE_NAME": "gm",
+        "MAIN_SHOP_NAME": "trinity_taskbar",
+        "FILE_LOGGING": "true",
+        "LOOP_LAG_THRESHOLD": "0",
+    }.items():
+        os.environ.setdefault(name, value)
+    return workdir
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest rank percentile of sorted `values`"""
+    if len(values) == 0:
+        return 0
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def storage_totals() -> dict[str, dict[str, float]]:
+    """Conf file reads and writes so far, per file family"""
+    from talesbot import metrics
+
+    return {
+        name: {labels[0]: value for labels, value in counter.values.items()}
+        for name, counter in [
+            ("reads", metrics.storage_reads),
+            ("read_bytes", metrics.storage_read_bytes),
+            ("writes", metrics.storage_writes),
+            ("written_bytes", metrics.storage_written_bytes),
+        ]
+    }
+
+
+def storage_diff(before, after) -> dict[str, dict[str, float]]:
+    return {
+        name: {
+            family: value - before[name].get(family, 0)
+            for family, value in sorted(families.items())
+            if value != before[name].get(family, 0)
+        }
+        for name, families in after.items()
+    }
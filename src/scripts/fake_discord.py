@@ -0,0 +1,1359 @@
+### Module fake_discord.py
+# An in-process stand-in for Discord, so that the whole bot can run without a
+# network or a live guild: for benchmarks, replays and regression tests.
+#
+# Discord is faked at the wire level. Every REST request discord.py makes is
+# answered from in-memory state, and changes are sent back as gateway events
+# through discord.py's own parsers. The bot therefore runs against real
+# discord.py objects and caches; isinstance checks, fetch_* and history all
+# behave as they do live. Requests get configurable artificial latency and
+# per-route rate limits, and are counted in the metrics like real ones.
+#
+# Typical use:
+#
+#   fake = FakeDiscord(latency=0.05)
+#   guild_id = fake.add_guild("Tales")
+#   alice = fake.add_member(guild_id, "alice")
+#   bot = await fake.start_bot()  # runs on_ready with every init phase
+#   await fake.send_message(alice, channel_id, "hello")
+#   response = await fake.run_command(alice, channel_id, "balance")
+
+import asyncio
+import datetime
+import functools
+import logging
+import random
+import re
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import unquote
+
+import discord
+import simplejson
+from discord.http import Route
+from discord.webhook.async_ import AsyncWebhookAdapter, async_context
+
+from talesbot import metrics
+from talesbot.bot import TalesBot
+
+logger = logging.getLogger(__name__)
+
+discord_epoch = 1420070400000
+ephemeral_flag = 1 << 6
+administrator_permissions = str(discord.Permissions.all().value)
+everyone_permissions = str(discord.Permissions.general().value)
+# Discord gives up on interactions that are not acknowledged within this time
+interaction_deadline = 3
+
+
+class ChannelType:
+    text = 0
+    voice = 2
+    category = 4
+
+
+class CallbackType:
+    message = 4
+    deferred_message = 5
+    deferred_update = 6
+    update_message = 7
+    modal = 9
+
+
+@dataclass
+class RateLimit:
+    limit: int
+    per: float
+
+
+# Roughly what Discord enforces for the routes the bot uses the most
+default_rate_limits = {
+    "POST /channels/{channel_id}/messages": RateLimit(5, 5),
+    "PATCH /channels/{channel_id}/messages/{message_id}": RateLimit(5, 5),
+    "DELETE /channels/{channel_id}/messages/{message_id}": RateLimit(5, 1),
+    "PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me": (
+        RateLimit(1, 0.25)
+    ),
+    "POST /guilds/{guild_id}/channels": RateLimit(5, 5),
+    "PATCH /guilds/{guild_id}/members/{user_id}": RateLimit(10, 10),
+}
+default_global_rate_limit = RateLimit(50, 1)
+
+
+class FakeResponse:
+    """What discord.HTTPException needs to know about a response"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+def not_found(what: str, code: int) -> discord.NotFound:
+    return discord.NotFound(
+        FakeResponse(404, "Not Found"), {"code": code, "message": f"Unknown {what}"}
+    )
+
+
+def bad_request(message: str, code: int = 50035) -> discord.HTTPException:
+    return discord.HTTPException(
+        FakeResponse(400, "Bad Request"), {"code": code, "message": message}
+    )
+
+
+@dataclass
+class FakeGuild:
+    id: int
+    name: str
+    owner_id: int
+    roles: dict[int, dict[str, Any]] = field(default_factory=dict)
+    channel_ids: list[int] = field(default_factory=list)
+    members: dict[int, dict[str, Any]] = field(default_factory=dict)
+    commands: list[dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class InteractionLog:
+    """Everything the bot answered to one interaction"""
+
+    id: int
+    token: str
+    channel_id: int
+    start: float
+    # Seconds from the interaction being sent until the bot responded or deferred
+    acked_after: float | None = None
+    response_type: int | None = None
+    original_id: int | None = None
+    messages: dict[int, dict[str, Any]] = field(default_factory=dict)
+    modal: dict[str, Any] | None = None
+
+    @property
+    def deferred(self) -> bool:
+        return self.response_type in (
+            CallbackType.deferred_message,
+            CallbackType.deferred_update,
+        )
+
+    @property
+    def content(self) -> str:
+        return "\n".join(m.get("content") or "" for m in self.messages.values())
+
+
+@dataclass
+class Delivery:
+    """One gateway event and everything the bot did because of it. Tasks and
+    requests are attributed through `current_delivery`, which the handler
+    tasks inherit from the task that sent the event."""
+
+    event: str = ""
+    # Seconds from the event being sent until all its handlers were done
+    elapsed: float | None = None
+    rest_calls: int = 0
+    rate_limited: int = 0
+
+
+current_delivery: ContextVar[Delivery | None] = ContextVar(
+    "current_delivery", default=None
+)
+
+
+type Handler = Callable[..., Any]
+routes: dict[tuple[str, str], Handler] = {}
+
+
+def route(method: str, path: str):
+    def decorator(func: Handler) -> Handler:
+        routes[(method, path)] = func
+        return func
+
+    return decorator
+
+
+@functools.cache
+def _path_pattern(path: str) -> re.Pattern:
+    pattern = re.sub(r"\\\{(\w+)\\\}", r"(?P<\1>[^/]+)", re.escape(path))
+    return re.compile(pattern + "$")
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.UTC).isoformat()
+
+
+def _request_body(
+    json: Any = None, form: list[dict[str, Any]] | None = None
+) -> dict[str, Any]:
+    if json is not None:
+        return json
+    for part in form or []:
+        if part.get("name") == "payload_json":
+            return simplejson.loads(part["value"])
+    return {}
+
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    """Interaction responses and followups go through discord.py's webhook
+    adapter instead of the bot's HTTP client; this sends them to the fake"""
+
+    def __init__(self, fake: "FakeDiscord"):
+        super().__init__()
+        self.fake = fake
+
+    async def request(
+        self,
+        route: Route,
+        session,
+        *,
+        payload=None,
+        multipart=None,
+        files=None,
+        params=None,
+        **kwargs,
+    ):
+        return await self.fake.request(
+            route, json=payload, form=multipart, params=params
+        )
+
+
+class FakeDiscord:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limits: dict[str, RateLimit] | None = None,
+        global_rate_limit: RateLimit | None = default_global_rate_limit,
+        gateway_latency: float = 0.0,
+        seed: int | None = None,
+    ):
+        """`latency` (plus up to `jitter`) seconds are added to every REST
+        request, and `gateway_latency` to every event sent to the bot. Rate
+        limits are per route and major parameter, like Discord's buckets;
+        a limited request is counted as a 429 and then waits for its turn,
+        as discord.py would."""
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = default_rate_limits if rate_limits is None else rate_limits
+        self.global_rate_limit = global_rate_limit
+        self.gateway_latency = gateway_latency
+        self.random = random.Random(seed)
+
+        self._last_snowflake = 0
+        self.users: dict[int, dict[str, Any]] = {}
+        self.guilds: dict[int, FakeGuild] = {}
+        self.channels: dict[int, dict[str, Any]] = {}
+        self.messages: dict[int, dict[int, dict[str, Any]]] = defaultdict(dict)
+        # (message ID, emoji) -> IDs of the users that reacted
+        self.reactions: dict[tuple[int, str], list[int]] = {}
+        self.interactions: dict[str, InteractionLog] = {}
+        self._buckets: dict[str, deque[float]] = defaultdict(deque)
+
+        self.requests: dict[str, int] = defaultdict(int)
+        self.rate_limited = 0
+
+        self.bot: TalesBot | None = None
+        self.connected = False
+        self.token = "fake-token"
+        self.bot_user = self.add_user("TalesBot", bot=True)
+        self.application_id = self.bot_user
+
+    ### Snowflakes and payloads
+
+    def snowflake(self) -> int:
+        now = (int(time.time() * 1000) - discord_epoch) << 22
+        self._last_snowflake = max(now, self._last_snowflake + 1)
+        return self._last_snowflake
+
+    def add_user(self, name: str, bot: bool = False, user_id: int | None = None) -> int:
+        if user_id is None:
+            user_id = self.snowflake()
+        self.users[user_id] = {
+            "id": str(user_id),
+            "username": name,
+            "global_name": name,
+            "discriminator": "0",
+            "avatar": None,
+            "bot": bot,
+        }
+        return user_id
+
+    def _role_payload(self, role_id: int, name: str, **fields) -> dict[str, Any]:
+        return {
+            "id": str(role_id),
+            "name": name,
+            "color": 0,
+            "hoist": False,
+            "icon": None,
+            "unicode_emoji": None,
+            "position": 0,
+            "permissions": "0",
+            "managed": False,
+            "mentionable": False,
+            "flags": 0,
+            **fields,
+        }
+
+    def _member_payload(self, guild: FakeGuild, user_id: int) -> dict[str, Any]:
+        return {**guild.members[user_id], "user": self.users[user_id]}
+
+    def _guild_payload(self, guild: FakeGuild) -> dict[str, Any]:
+        return {
+            "id": str(guild.id),
+            "name": guild.name,
+            "icon": None,
+            "splash": None,
+            "discovery_splash": None,
+            "owner_id": str(guild.owner_id),
+            "afk_channel_id": None,
+            "afk_timeout": 300,
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "nsfw_level": 0,
+            "premium_tier": 0,
+            "system_channel_id": None,
+            "system_channel_flags": 0,
+            "rules_channel_id": None,
+            "public_updates_channel_id": None,
+            "preferred_locale": "en-US",
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "roles": list(guild.roles.values()),
+            "channels": [self.channels[c] for c in guild.channel_ids],
+            "threads": [],
+            "members": [self._member_payload(guild, m) for m in guild.members],
+            "member_count": len(guild.members),
+            "presences": [],
+            "voice_states": [],
+            "stage_instances": [],
+            "guild_scheduled_events": [],
+            "soundboard_sounds": [],
+            "joined_at": _now_iso(),
+            "large": False,
+            "unavailable": False,
+        }
+
+    def _message_payload(self, message: dict[str, Any]) -> dict[str, Any]:
+        message_id = int(message["id"])
+        reactions = []
+        for emoji in message["_reaction_order"]:
+            users = self.reactions.get((message_id, emoji), [])
+            if len(users) == 0:
+                continue
+            reactions.append(
+                {
+                    "emoji": {"id": None, "name": emoji},
+                    "count": len(users),
+                    "count_details": {"burst": 0, "normal": len(users)},
+                    "me": self.bot_user in users,
+                    "me_burst": False,
+                    "burst_colors": [],
+                    "burst_count": 0,
+                }
+            )
+        payload = {k: v for k, v in message.items() if not k.startswith("_")}
+        payload["reactions"] = reactions
+        return payload
+
+    ### Setting up the fake world
+
+    def add_guild(self, name: str, with_bot: bool = True) -> int:
+        owner_id = self.add_user(f"{name} owner")
+        guild_id = self.snowflake()
+        guild = FakeGuild(guild_id, name, owner_id)
+        guild.roles[guild_id] = self._role_payload(
+            guild_id, "@everyone", permissions=everyone_permissions
+        )
+        self.guilds[guild_id] = guild
+        self._join(guild, owner_id)
+        if with_bot:
+            bot_role = self.snowflake()
+            guild.roles[bot_role] = self._role_payload(
+                bot_role,
+                "TalesBot",
+                position=1,
+                managed=True,
+                permissions=administrator_permissions,
+            )
+            self._join(guild, self.bot_user, roles=[bot_role])
+        return guild_id
+
+    def _join(self, guild: FakeGuild, user_id: int, roles: list[int] | None = None):
+        guild.members[user_id] = {
+            "nick": None,
+            "avatar": None,
+            "roles": [str(r) for r in roles or []],
+            "joined_at": _now_iso(),
+            "premium_since": None,
+            "deaf": False,
+            "mute": False,
+            "pending": False,
+            "flags": 0,
+        }
+
+    def add_member(self, guild_id: int, name: str, user_id: int | None = None) -> int:
+        """Adds a user to the guild. Pass the ID of an existing user to have the
+        same person in several guilds. Once the bot is connected, it is told
+        about the new member like Discord would."""
+        if user_id is None:
+            user_id = self.add_user(name)
+        guild = self.guilds[guild_id]
+        self._join(guild, user_id)
+        if self.connected:
+            self._parse(
+                "GUILD_MEMBER_ADD",
+                {**self._member_payload(guild, user_id), "guild_id": str(guild_id)},
+            )
+        return user_id
+
+    def add_channel(
+        self,
+        guild_id: int,
+        name: str,
+        channel_type: int = ChannelType.text,
+        parent_id: int | None = None,
+    ) -> int:
+        return int(
+            self._create_channel(
+                self.guilds[guild_id],
+                {"name": name, "type": channel_type, "parent_id": parent_id},
+            )["id"]
+        )
+
+    def find_channel(self, guild_id: int, name: str) -> int | None:
+        for channel_id in self.guilds[guild_id].channel_ids:
+            if self.channels[channel_id]["name"] == name:
+                return channel_id
+        return None
+
+    def channel_messages(self, channel_id: int) -> list[dict[str, Any]]:
+        return [self._message_payload(m) for m in self.messages[channel_id].values()]
+
+    ### Connecting the bot
+
+    def attach(self, bot: TalesBot):
+        """Routes all of the bot's Discord traffic to this fake"""
+        self.bot = bot
+        bot.http.request = self.request  # type: ignore[method-assign]
+        # Interaction responses are sent through the adapter in this context
+        # variable; tasks created from here on inherit it
+        async_context.set(FakeWebhookAdapter(self))
+
+    async def connect(self, bot: TalesBot):
+        """Logs the bot in and sends it READY and a GUILD_CREATE per guild,
+        then waits until on_ready and every other handler this set off are
+        done. The bot should have a short guild_ready_timeout, or discord.py
+        waits that long for more guilds before it is ready."""
+        self.attach(bot)
+        await bot.login(self.token)
+        self.connected = True
+        delivery = Delivery("READY")
+        token = current_delivery.set(delivery)
+        try:
+            self._parse(
+                "READY",
+                {
+                    "v": 10,
+                    "user": self.users[self.bot_user],
+                    "guilds": [
+                        {"id": str(g), "unavailable": True} for g in self.guilds
+                    ],
+                    "session_id": "fake-session",
+                    "resume_gateway_url": "wss://gateway.invalid",
+                    "application": {"id": str(self.application_id), "flags": 0},
+                },
+            )
+            for guild in self.guilds.values():
+                self._parse("GUILD_CREATE", self._guild_payload(guild))
+        finally:
+            current_delivery.reset(token)
+        await self._wait_for_handlers(delivery)
+
+    async def start_bot(self, **options) -> TalesBot:
+        """Creates the bot the same way as in production and connects it"""
+        from talesbot import create_bot
+
+        options.setdefault("guild_ready_timeout", 0.01)
+        bot = create_bot(**options)
+        await self.connect(bot)
+        return bot
+
+    def _parse(self, event: str, data: dict[str, Any]):
+        if not self.connected or self.bot is None:
+            return
+        self.bot._connection.parsers[event](data)
+
+    @staticmethod
+    def _is_handler_task(task: asyncio.Task) -> bool:
+        name = task.get_name()
+        if name.startswith(("discord.py: ", "discord-ui-")) or (
+            name == "CommandTree-invoker"
+        ):
+            return True
+        # Sends the ready event once all guilds are in
+        # (get_coro can also be e.g. an async generator's aclose)
+        qualname = getattr(task.get_coro(), "__qualname__", "")
+        return qualname.endswith("_delay_ready")
+
+    async def _wait_for_handlers(self, delivery: Delivery):
+        """Waits for the event handlers started for `delivery`, including
+        those started by the handlers themselves, e.g. for the bot's own
+        messages"""
+        current = asyncio.current_task()
+        while True:
+            pending = [
+                t
+                for t in asyncio.all_tasks()
+                if t is not current
+                and not t.done()
+                and self._is_handler_task(t)
+                and t.get_context().get(current_delivery) is delivery
+            ]
+            if len(pending) == 0:
+                return
+            await asyncio.wait(pending)
+
+    @contextmanager
+    def track(self) -> Iterator[Delivery]:
+        """Collects what the bot does for the events sent from the current
+        task in the block, so that concurrent events are told apart:
+
+        with fake.track() as delivery:
+            await fake.send_message(alice, channel_id, "hello")
+        print(delivery.elapsed, delivery.rest_calls)"""
+        delivery = Delivery()
+        token = current_delivery.set(delivery)
+        try:
+            yield delivery
+        finally:
+            current_delivery.reset(token)
+
+    async def deliver(self, event: str, data: dict[str, Any]) -> Delivery:
+        """Sends a gateway event to the bot and waits until it is handled"""
+        delivery = current_delivery.get() or Delivery()
+        delivery.event = event
+        start = time.perf_counter()
+        if self.gateway_latency > 0:
+            await asyncio.sleep(self.gateway_latency)
+        token = current_delivery.set(delivery)
+        try:
+            self._parse(event, data)
+        finally:
+            current_delivery.reset(token)
+        await self._wait_for_handlers(delivery)
+        delivery.elapsed = time.perf_counter() - start
+        return delivery
+
+    ### Users acting on the guild
+
+    async def join_guild(
+        self, guild_id: int, name: str, user_id: int | None = None
+    ) -> int:
+        """Like add_member, but also waits for the bot to handle the new member"""
+        if user_id is None:
+            user_id = self.add_user(name)
+        guild = self.guilds[guild_id]
+        self._join(guild, user_id)
+        await self.deliver(
+            "GUILD_MEMBER_ADD",
+            {**self._member_payload(guild, user_id), "guild_id": str(guild_id)},
+        )
+        return user_id
+
+    async def send_message(
+        self, user_id: int, channel_id: int, content: str
+    ) -> dict[str, Any]:
+        message = self._create_message(channel_id, user_id, {"content": content})
+        await self.deliver("MESSAGE_CREATE", self._gateway_message(message))
+        return self._message_payload(message)
+
+    async def add_reaction(
+        self, user_id: int, channel_id: int, message_id: int, emoji: str
+    ):
+        message = self._get_message(channel_id, message_id)
+        self._add_reaction(message, user_id, emoji)
+        channel = self.channels[channel_id]
+        guild = self.guilds[int(channel["guild_id"])]
+        await self.deliver(
+            "MESSAGE_REACTION_ADD",
+            {
+                "user_id": str(user_id),
+                "channel_id": str(channel_id),
+                "message_id": str(message_id),
+                "guild_id": str(guild.id),
+                "member": self._member_payload(guild, user_id),
+                "emoji": {"id": None, "name": emoji},
+                "burst": False,
+                "type": 0,
+            },
+        )
+
+    async def run_command(
+        self, user_id: int, channel_id: int, command: str, **options: Any
+    ) -> InteractionLog:
+        """Runs an app command as `user_id`. Subcommands are given with spaces,
+        e.g. "gm chat_search"; options are passed by keyword."""
+        names = command.split()
+        command_options = [self._option(k, v) for k, v in options.items()]
+        # The subcommand gets the options, and is itself wrapped in its group
+        subcommands = names[1:]
+        for depth, name in reversed(list(enumerate(subcommands))):
+            option_type = 1 if depth == len(subcommands) - 1 else 2
+            command_options = [
+                {"name": name, "type": option_type, "options": command_options}
+            ]
+        data = {
+            "id": str(self._command_id(names[0])),
+            "name": names[0],
+            "type": 1,
+            "options": command_options,
+        }
+        return await self._interact(user_id, channel_id, 2, data)
+
+    async def click_button(
+        self, user_id: int, channel_id: int, message_id: int, custom_id: str
+    ) -> InteractionLog:
+        message = self._get_message(channel_id, message_id)
+        data = {"custom_id": custom_id, "component_type": 2}
+        return await self._interact(
+            user_id, channel_id, 3, data, message=self._message_payload(message)
+        )
+
+    def _command_id(self, name: str) -> int:
+        for guild in self.guilds.values():
+            for command in guild.commands:
+                if command["name"] == name:
+                    return int(command["id"])
+        return 0
+
+    @staticmethod
+    def _option(name: str, value: Any) -> dict[str, Any]:
+        match value:
+            case bool():
+                option_type = 5
+            case int():
+                option_type = 4
+            case float():
+                option_type = 10
+            case _:
+                option_type = 3
+                value = str(value)
+        return {"name": name, "type": option_type, "value": value}
+
+    async def _interact(
+        self,
+        user_id: int,
+        channel_id: int,
+        interaction_type: int,
+        data: dict[str, Any],
+        message: dict[str, Any] | None = None,
+    ) -> InteractionLog:
+        channel = self.channels[channel_id]
+        guild = self.guilds[int(channel["guild_id"])]
+        interaction_id = self.snowflake()
+        token = f"interaction-{interaction_id}"
+        log = InteractionLog(interaction_id, token, channel_id, time.perf_counter())
+        self.interactions[token] = log
+        payload = {
+            "id": str(interaction_id),
+            "application_id": str(self.application_id),
+            "type": interaction_type,
+            "data": data,
+            "guild_id": str(guild.id),
+            "channel_id": str(channel_id),
+            "channel": channel,
+            "member": {
+                **self._member_payload(guild, user_id),
+                "permissions": self._member_permissions(guild, user_id),
+            },
+            "token": token,
+            "version": 1,
+            "locale": "en-US",
+            "guild_locale": "en-US",
+            "app_permissions": administrator_permissions,
+            "entitlements": [],
+            "authorizing_integration_owners": {"0": str(guild.id)},
+            "context": 0,
+            "attachment_size_limit": 10 * 1024 * 1024,
+        }
+        if message is not None:
+            payload["message"] = message
+        await self.deliver("INTERACTION_CREATE", payload)
+        return log
+
+    def _member_permissions(self, guild: FakeGuild, user_id: int) -> str:
+        value = int(guild.roles[guild.id]["permissions"])
+        for role_id in guild.members[user_id]["roles"]:
+            value |= int(guild.roles[int(role_id)]["permissions"])
+        return str(value)
+
+    ### REST
+
+    async def request(
+        self,
+        route: Route,
+        *,
+        json: Any = None,
+        form: list[dict[str, Any]] | None = None,
+        params: dict[str, Any] | None = None,
+        files=None,
+        **kwargs,
+    ) -> Any:
+        key = f"{route.method} {route.path}"
+        handler = routes.get((route.method, route.path))
+        if handler is None:
+            raise NotImplementedError(f"The fake Discord does not implement {key}")
+        path = route.url[len(Route.BASE) :].split("?", 1)[0]
+        match = _path_pattern(route.path).match(path)
+        assert match is not None, f"{path} does not match {route.path}"
+        values = {k: unquote(v) for k, v in match.groupdict().items()}
+
+        await self._wait_for_rate_limits(route, key)
+        if self.latency > 0 or self.jitter > 0:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        self.requests[key] += 1
+        delivery = current_delivery.get()
+        if delivery is not None:
+            delivery.rest_calls += 1
+
+        try:
+            result = handler(self, values, _request_body(json, form), params or {})
+        except discord.HTTPException as e:
+            metrics.record_discord_request(route.method, path, e.status)
+            raise
+        metrics.record_discord_request(route.method, path, 200)
+        return result
+
+    async def _wait_for_rate_limits(self, route: Route, key: str):
+        limits = []
+        if self.global_rate_limit is not None and not route.path.startswith(
+            "/interactions/"
+        ):
+            # Interaction responses do not count against the global limit
+            limits.append(("global", "global", self.global_rate_limit))
+        if key in self.rate_limits:
+            bucket = f"{key}:{route.major_parameters}"
+            limits.append((bucket, "user", self.rate_limits[key]))
+
+        for bucket, scope, limit in limits:
+            sent = self._buckets[bucket]
+            while True:
+                now = time.monotonic()
+                while sent and now - sent[0] >= limit.per:
+                    sent.popleft()
+                if len(sent) < limit.limit:
+                    sent.append(now)
+                    break
+                self.rate_limited += 1
+                delivery = current_delivery.get()
+                if delivery is not None:
+                    delivery.rate_limited += 1
+                metrics.record_discord_request(route.method, route.path, 429, scope)
+                await asyncio.sleep(limit.per - (now - sent[0]))
+
+    ### Users and applications
+
+    @route("GET", "/users/@me")
+    def get_me(self, params, body, query):
+        return self.users[self.bot_user]
+
+    @route("GET", "/users/{user_id}")
+    def get_user(self, params, body, query):
+        try:
+            return self.users[int(params["user_id"])]
+        except KeyError:
+            raise not_found("User", 10013) from None
+
+    @route("GET", "/oauth2/applications/@me")
+    def get_application(self, params, body, query):
+        return {
+            "id": str(self.application_id),
+            "name": "TalesBot",
+            "icon": None,
+            "description": "",
+            "bot_public": False,
+            "bot_require_code_grant": False,
+            "owner": next(iter(self.users.values())),
+            "verify_key": "",
+            "flags": 0,
+        }
+
+    @route("PUT", "/applications/{application_id}/guilds/{guild_id}/commands")
+    def put_guild_commands(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        guild.commands = [
+            {
+                **command,
+                "id": str(self.snowflake()),
+                "application_id": str(self.application_id),
+                "guild_id": str(guild.id),
+                "version": str(self.snowflake()),
+            }
+            for command in body
+        ]
+        return guild.commands
+
+    @route("GET", "/applications/{application_id}/guilds/{guild_id}/commands")
+    def get_guild_commands(self, params, body, query):
+        return self._get_guild(params["guild_id"]).commands
+
+    @route("PUT", "/applications/{application_id}/commands")
+    def put_global_commands(self, params, body, query):
+        return [
+            {
+                **c,
+                "id": str(self.snowflake()),
+                "application_id": str(self.application_id),
+            }
+            for c in body
+        ]
+
+    ### Guilds, roles and members
+
+    def _get_guild(self, guild_id: str) -> FakeGuild:
+        try:
+            return self.guilds[int(guild_id)]
+        except KeyError:
+            raise not_found("Guild", 10004) from None
+
+    def _get_member(self, guild: FakeGuild, user_id: str) -> dict[str, Any]:
+        try:
+            return guild.members[int(user_id)]
+        except KeyError:
+            raise not_found("Member", 10007) from None
+
+    @route("GET", "/guilds/{guild_id}/roles")
+    def get_roles(self, params, body, query):
+        return list(self._get_guild(params["guild_id"]).roles.values())
+
+    @route("POST", "/guilds/{guild_id}/roles")
+    def create_role(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        role_id = self.snowflake()
+        body = {k: v for k, v in body.items() if v is not None}
+        role = self._role_payload(
+            role_id, body.pop("name", "new role"), position=len(guild.roles), **body
+        )
+        guild.roles[role_id] = role
+        self._parse("GUILD_ROLE_CREATE", {"guild_id": str(guild.id), "role": role})
+        return role
+
+    @route("PATCH", "/guilds/{guild_id}/roles/{role_id}")
+    def edit_role(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        role = guild.roles.get(int(params["role_id"]))
+        if role is None:
+            raise not_found("Role", 10011)
+        role.update(body)
+        self._parse("GUILD_ROLE_UPDATE", {"guild_id": str(guild.id), "role": role})
+        return role
+
+    @route("DELETE", "/guilds/{guild_id}/roles/{role_id}")
+    def delete_role(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        if guild.roles.pop(int(params["role_id"]), None) is None:
+            raise not_found("Role", 10011)
+        for member in guild.members.values():
+            if params["role_id"] in member["roles"]:
+                member["roles"].remove(params["role_id"])
+        self._parse(
+            "GUILD_ROLE_DELETE",
+            {"guild_id": str(guild.id), "role_id": params["role_id"]},
+        )
+
+    @route("GET", "/guilds/{guild_id}/members/{user_id}")
+    def get_member(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        self._get_member(guild, params["user_id"])
+        return self._member_payload(guild, int(params["user_id"]))
+
+    @route("GET", "/guilds/{guild_id}/members")
+    def get_members(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        after = int(query.get("after", 0))
+        limit = int(query.get("limit", 1))
+        user_ids = sorted(u for u in guild.members if u > after)[:limit]
+        return [self._member_payload(guild, u) for u in user_ids]
+
+    def _member_updated(self, guild: FakeGuild, user_id: int):
+        payload = self._member_payload(guild, user_id)
+        self._parse("GUILD_MEMBER_UPDATE", {**payload, "guild_id": str(guild.id)})
+        return payload
+
+    @route("PATCH", "/guilds/{guild_id}/members/{user_id}")
+    def edit_member(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        member = self._get_member(guild, params["user_id"])
+        if "roles" in body:
+            member["roles"] = [str(r) for r in body["roles"]]
+        if "nick" in body:
+            member["nick"] = body["nick"]
+        return self._member_updated(guild, int(params["user_id"]))
+
+    @route("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+    def add_member_role(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        member = self._get_member(guild, params["user_id"])
+        if params["role_id"] not in member["roles"]:
+            member["roles"].append(params["role_id"])
+        self._member_updated(guild, int(params["user_id"]))
+
+    @route("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+    def remove_member_role(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        member = self._get_member(guild, params["user_id"])
+        if params["role_id"] in member["roles"]:
+            member["roles"].remove(params["role_id"])
+        self._member_updated(guild, int(params["user_id"]))
+
+    ### Channels
+
+    def _get_channel(self, channel_id: str) -> dict[str, Any]:
+        try:
+            return self.channels[int(channel_id)]
+        except KeyError:
+            raise not_found("Channel", 10003) from None
+
+    def _create_channel(self, guild: FakeGuild, body: dict[str, Any]):
+        channel_id = self.snowflake()
+        channel = {
+            "id": str(channel_id),
+            "type": body.get("type", ChannelType.text),
+            "guild_id": str(guild.id),
+            "name": body["name"],
+            "position": body.get("position") or len(guild.channel_ids),
+            "permission_overwrites": [
+                {**o, "id": str(o["id"])} for o in body.get("permission_overwrites", [])
+            ],
+            "parent_id": str(body["parent_id"]) if body.get("parent_id") else None,
+            "topic": body.get("topic"),
+            "nsfw": body.get("nsfw", False),
+            "rate_limit_per_user": body.get("rate_limit_per_user", 0),
+            "last_message_id": None,
+            "flags": 0,
+        }
+        self.channels[channel_id] = channel
+        guild.channel_ids.append(channel_id)
+        self._parse("CHANNEL_CREATE", channel)
+        return channel
+
+    @route("GET", "/guilds/{guild_id}/channels")
+    def get_channels(self, params, body, query):
+        guild = self._get_guild(params["guild_id"])
+        return [self.channels[c] for c in guild.channel_ids]
+
+    @route("POST", "/guilds/{guild_id}/channels")
+    def create_channel(self, params, body, query):
+        return self._create_channel(self._get_guild(params["guild_id"]), body)
+
+    @route("GET", "/channels/{channel_id}")
+    def get_channel(self, params, body, query):
+        return self._get_channel(params["channel_id"])
+
+    @route("PATCH", "/channels/{channel_id}")
+    def edit_channel(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        for key, value in body.items():
+            if key == "permission_overwrites":
+                value = [{**o, "id": str(o["id"])} for o in value]
+            elif key == "parent_id" and value is not None:
+                value = str(value)
+            channel[key] = value
+        self._parse("CHANNEL_UPDATE", channel)
+        return channel
+
+    @route("DELETE", "/channels/{channel_id}")
+    def delete_channel(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        channel_id = int(channel["id"])
+        del self.channels[channel_id]
+        self.guilds[int(channel["guild_id"])].channel_ids.remove(channel_id)
+        self.messages.pop(channel_id, None)
+        self._parse("CHANNEL_DELETE", channel)
+        return channel
+
+    @route("PUT", "/channels/{channel_id}/permissions/{target}")
+    def set_permissions(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        overwrites = [
+            o for o in channel["permission_overwrites"] if o["id"] != params["target"]
+        ]
+        overwrites.append(
+            {
+                "id": params["target"],
+                "type": body.get("type", 0),
+                "allow": str(body.get("allow", 0)),
+                "deny": str(body.get("deny", 0)),
+            }
+        )
+        channel["permission_overwrites"] = overwrites
+        self._parse("CHANNEL_UPDATE", channel)
+
+    @route("DELETE", "/channels/{channel_id}/permissions/{target}")
+    def delete_permissions(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        channel["permission_overwrites"] = [
+            o for o in channel["permission_overwrites"] if o["id"] != params["target"]
+        ]
+        self._parse("CHANNEL_UPDATE", channel)
+
+    ### Messages
+
+    def _create_message(
+        self,
+        channel_id: int,
+        author_id: int,
+        body: dict[str, Any],
+        interaction: InteractionLog | None = None,
+    ) -> dict[str, Any]:
+        channel = self.channels[channel_id]
+        message_id = self.snowflake()
+        message = {
+            "id": str(message_id),
+            "channel_id": str(channel_id),
+            "guild_id": channel["guild_id"],
+            "author": self.users[author_id],
+            "content": body.get("content") or "",
+            "timestamp": _now_iso(),
+            "edited_timestamp": None,
+            "tts": bool(body.get("tts", False)),
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": body.get("embeds") or [],
+            "components": body.get("components") or [],
+            "pinned": False,
+            "type": 0,
+            "flags": body.get("flags") or 0,
+            "_reaction_order": [],
+        }
+        if interaction is not None:
+            message["interaction_metadata"] = {
+                "id": str(interaction.id),
+                "type": 2,
+                "user": self.users[author_id],
+                "authorizing_integration_owners": {},
+            }
+        if not message["flags"] & ephemeral_flag:
+            self.messages[channel_id][message_id] = message
+            channel["last_message_id"] = str(message_id)
+        return message
+
+    def _gateway_message(self, message: dict[str, Any]) -> dict[str, Any]:
+        payload = self._message_payload(message)
+        guild = self.guilds[int(message["guild_id"])]
+        author_id = int(message["author"]["id"])
+        if author_id in guild.members:
+            member = self._member_payload(guild, author_id)
+            del member["user"]
+            payload["member"] = member
+        return payload
+
+    def _get_message(self, channel_id: int | str, message_id: int | str):
+        self._get_channel(str(channel_id))
+        try:
+            return self.messages[int(channel_id)][int(message_id)]
+        except KeyError:
+            raise not_found("Message", 10008) from None
+
+    def _delete_message(self, channel_id: int, message_id: int):
+        message = self.messages[channel_id].pop(message_id)
+        for emoji in message["_reaction_order"]:
+            self.reactions.pop((message_id, emoji), None)
+
+    @route("POST", "/channels/{channel_id}/messages")
+    def send_message_route(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        message = self._create_message(int(channel["id"]), self.bot_user, body)
+        self._parse("MESSAGE_CREATE", self._gateway_message(message))
+        return self._message_payload(message)
+
+    @route("GET", "/channels/{channel_id}/messages/{message_id}")
+    def get_message(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        return self._message_payload(message)
+
+    @route("GET", "/channels/{channel_id}/messages")
+    def get_messages(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        limit = int(query.get("limit", 50))
+        message_ids = sorted(self.messages[int(channel["id"])])
+        if "before" in query:
+            message_ids = [m for m in message_ids if m < int(query["before"])][-limit:]
+        elif "after" in query:
+            message_ids = [m for m in message_ids if m > int(query["after"])][:limit]
+        elif "around" in query:
+            around = int(query["around"])
+            older = [m for m in message_ids if m <= around][-(limit // 2 + 1) :]
+            newer = [m for m in message_ids if m > around][: limit - len(older)]
+            message_ids = older + newer
+        else:
+            message_ids = message_ids[-limit:]
+        # Newest first, like Discord
+        messages = self.messages[int(channel["id"])]
+        return [self._message_payload(messages[m]) for m in reversed(message_ids)]
+
+    @route("PATCH", "/channels/{channel_id}/messages/{message_id}")
+    def edit_message(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        self._edit_message(message, body)
+        self._parse("MESSAGE_UPDATE", self._gateway_message(message))
+        return self._message_payload(message)
+
+    @staticmethod
+    def _edit_message(message: dict[str, Any], body: dict[str, Any]):
+        for key in ("content", "embeds", "components", "flags"):
+            if key in body:
+                message[key] = body[key] if body[key] is not None else message[key]
+        message["edited_timestamp"] = _now_iso()
+
+    @route("DELETE", "/channels/{channel_id}/messages/{message_id}")
+    def delete_message(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        self._delete_message(int(params["channel_id"]), int(message["id"]))
+        self._parse(
+            "MESSAGE_DELETE",
+            {
+                "id": message["id"],
+                "channel_id": message["channel_id"],
+                "guild_id": message["guild_id"],
+            },
+        )
+
+    @route("POST", "/channels/{channel_id}/messages/bulk-delete")
+    def bulk_delete_messages(self, params, body, query):
+        channel = self._get_channel(params["channel_id"])
+        channel_id = int(channel["id"])
+        deleted = []
+        for message_id in body["messages"]:
+            if int(message_id) in self.messages[channel_id]:
+                self._delete_message(channel_id, int(message_id))
+                deleted.append(str(message_id))
+        self._parse(
+            "MESSAGE_DELETE_BULK",
+            {
+                "ids": deleted,
+                "channel_id": channel["id"],
+                "guild_id": channel["guild_id"],
+            },
+        )
+
+    ### Reactions
+
+    def _add_reaction(self, message: dict[str, Any], user_id: int, emoji: str):
+        users = self.reactions.setdefault((int(message["id"]), emoji), [])
+        if emoji not in message["_reaction_order"]:
+            message["_reaction_order"].append(emoji)
+        if user_id not in users:
+            users.append(user_id)
+
+    def _reaction_event(
+        self, event: str, message: dict[str, Any], user_id: int, emoji: str
+    ):
+        self._parse(
+            event,
+            {
+                "user_id": str(user_id),
+                "channel_id": message["channel_id"],
+                "message_id": message["id"],
+                "guild_id": message["guild_id"],
+                "emoji": {"id": None, "name": emoji},
+                "burst": False,
+                "type": 0,
+            },
+        )
+
+    @route("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+    def add_own_reaction(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        self._add_reaction(message, self.bot_user, params["emoji"])
+        self._reaction_event(
+            "MESSAGE_REACTION_ADD", message, self.bot_user, params["emoji"]
+        )
+
+    def _remove_reaction(self, params, user_id: int):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        users = self.reactions.get((int(message["id"]), params["emoji"]), [])
+        if user_id in users:
+            users.remove(user_id)
+            self._reaction_event(
+                "MESSAGE_REACTION_REMOVE", message, user_id, params["emoji"]
+            )
+
+    @route(
+        "DELETE", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me"
+    )
+    def remove_own_reaction(self, params, body, query):
+        self._remove_reaction(params, self.bot_user)
+
+    @route(
+        "DELETE",
+        "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{member_id}",
+    )
+    def remove_reaction(self, params, body, query):
+        self._remove_reaction(params, int(params["member_id"]))
+
+    @route("GET", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}")
+    def get_reaction_users(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        users = self.reactions.get((int(message["id"]), params["emoji"]), [])
+        after = int(query.get("after", 0))
+        limit = int(query.get("limit", 25))
+        return [self.users[u] for u in sorted(u for u in users if u > after)[:limit]]
+
+    @route("DELETE", "/channels/{channel_id}/messages/{message_id}/reactions")
+    def clear_reactions(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        for emoji in message["_reaction_order"]:
+            self.reactions.pop((int(message["id"]), emoji), None)
+        message["_reaction_order"] = []
+        self._parse(
+            "MESSAGE_REACTION_REMOVE_ALL",
+            {
+                "channel_id": message["channel_id"],
+                "message_id": message["id"],
+                "guild_id": message["guild_id"],
+            },
+        )
+
+    @route("DELETE", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}")
+    def clear_reaction(self, params, body, query):
+        message = self._get_message(params["channel_id"], params["message_id"])
+        self.reactions.pop((int(message["id"]), params["emoji"]), None)
+        if params["emoji"] in message["_reaction_order"]:
+            message["_reaction_order"].remove(params["emoji"])
+        self._parse(
+            "MESSAGE_REACTION_REMOVE_EMOJI",
+            {
+                "channel_id": message["channel_id"],
+                "message_id": message["id"],
+                "guild_id": message["guild_id"],
+                "emoji": {"id": None, "name": params["emoji"]},
+            },
+        )
+
+    ### Interactions
+
+    def _get_interaction(self, token: str) -> InteractionLog:
+        try:
+            return self.interactions[token]
+        except KeyError:
+            raise not_found("interaction", 10062) from None
+
+    def _interaction_message(
+        self, log: InteractionLog, body: dict[str, Any]
+    ) -> dict[str, Any]:
+        message = self._create_message(
+            log.channel_id, self.bot_user, body, interaction=log
+        )
+        log.messages[int(message["id"])] = message
+        if not message["flags"] & ephemeral_flag:
+            self._parse("MESSAGE_CREATE", self._gateway_message(message))
+        return message
+
+    @route("POST", "/interactions/{webhook_id}/{webhook_token}/callback")
+    def interaction_callback(self, params, body, query):
+        log = self._get_interaction(params["webhook_token"])
+        if log.response_type is not None:
+            raise bad_request("Interaction has already been acknowledged.", 40060)
+        elapsed = time.perf_counter() - log.start
+        if elapsed > interaction_deadline:
+            # Too late, Discord has already shown the user an error
+            raise not_found("interaction", 10062)
+        log.acked_after = elapsed
+        log.response_type = response_type = body["type"]
+        data = body.get("data") or {}
+
+        message = None
+        if response_type == CallbackType.message:
+            message = self._interaction_message(log, data)
+            log.original_id = int(message["id"])
+        elif response_type == CallbackType.update_message:
+            log.original_id = None
+        elif response_type == CallbackType.modal:
+            log.modal = data
+
+        return {
+            "interaction": {
+                "id": str(log.id),
+                "type": 2,
+                "response_message_id": message["id"] if message else None,
+                "response_message_loading": response_type
+                == CallbackType.deferred_message,
+                "response_message_ephemeral": bool(
+                    (data.get("flags") or 0) & ephemeral_flag
+                ),
+            },
+            "resource": {
+                "type": response_type,
+                **({"message": self._message_payload(message)} if message else {}),
+            },
+        }
+
+    @route("POST", "/webhooks/{webhook_id}/{webhook_token}")
+    def followup(self, params, body, query):
+        log = self._get_interaction(params["webhook_token"])
+        message = self._interaction_message(log, body)
+        if (
+            log.original_id is None
+            and log.response_type == CallbackType.deferred_message
+        ):
+            # The first followup after "thinking..." is the original response
+            log.original_id = int(message["id"])
+        return self._message_payload(message)
+
+    def _interaction_message_by_id(self, params) -> tuple[InteractionLog, dict]:
+        log = self._get_interaction(params["webhook_token"])
+        message_id = params.get("message_id", "@original")
+        if message_id == "@original":
+            if log.original_id is None:
+                raise not_found("Message", 10008)
+            message_id = log.original_id
+        message = log.messages.get(int(message_id))
+        if message is None:
+            raise not_found("Message", 10008)
+        return log, message
+
+    @route("GET", "/webhooks/{webhook_id}/{webhook_token}/messages/@original")
+    @route("GET", "/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}")
+    def get_interaction_message(self, params, body, query):
+        _log, message = self._interaction_message_by_id(params)
+        return self._message_payload(message)
+
+    @route("PATCH", "/webhooks/{webhook_id}/{webhook_token}/messages/@original")
+    @route("PATCH", "/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}")
+    def edit_interaction_message(self, params, body, query):
+        log = self._get_interaction(params["webhook_token"])
+        original = params.get("message_id", "@original") == "@original"
+        if original and log.original_id is None:
+            # Editing the original response after a defer creates it
+            message = self._interaction_message(log, body)
+            log.original_id = int(message["id"])
+            return self._message_payload(message)
+        _log, message = self._interaction_message_by_id(params)
+        self._edit_message(message, body)
+        if not message["flags"] & ephemeral_flag:
+            self._parse("MESSAGE_UPDATE", self._gateway_message(message))
+        return self._message_payload(message)
+
+    @route("DELETE", "/webhooks/{webhook_id}/{webhook_token}/messages/@original")
+    @route("DELETE", "/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}")
+    def delete_interaction_message(self, params, body, query):
+        log, message = self._interaction_message_by_id(params)
+        message_id = int(message["id"])
+        del log.messages[message_id]
+        if message_id in self.messages[log.channel_id]:
+            self._delete_message(log.channel_id, message_id)
+            self._parse(
+                "MESSAGE_DELETE",
+                {
+                    "id": message["id"],
+                    "channel_id": message["channel_id"],
+                    "guild_id": message["guild_id"],
+                },
+            )
@@ -0,0 +1,427 @@
+### Load test
+# Runs the whole bot against scripts.fake_discord with a simulated game:
+# players in the main guild, mirrored guilds, open chats and shops. Events
+# are sent at a target rate regardless of how fast the bot handles them, and
+# the results are written as JSON so that runs can be compared over time.
+
+import asyncio
+import csv
+import datetime
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+import click
+import uvloop
+from tabulate import tabulate
+
+from scripts.benchmarking import (
+    enter_scratch_directory,
+    git_revision,
+    peak_rss_mb,
+    percentile,
+    storage_diff,
+    storage_totals,
+)
+
+default_mix = "chat=40,public=20,reaction=15,balance=10,pay=10,order=5"
+tip_emoji = "💴"
+known_handles_header = [
+    "Spelare",
+    "Rollnamn",
+    "Main handle",
+    "Pengar på main:",
+    "Alternativa handles",
+    "Pengar på övriga:",
+    "Grupper:",
+    "Tacoma",
+    "u-nummer",
+    "Server",
+    "Category",
+]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = (v.strip() for v in part.split("="))
+        if name not in event_types:
+            raise click.BadParameter(
+                f"Unknown event type {name}, expected one of {', '.join(event_types)}"
+            )
+        weights[name] = float(weight)
+    return weights
+
+
+@dataclass
+class Player:
+    user_id: int
+    handle: str
+    cmd_line: int | None = None
+
+
+@dataclass
+class Results:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    rest_calls: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    rate_limited: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    # How late events were sent compared to the schedule, i.e. the driver
+    # itself falling behind
+    send_lag: list[float] = field(default_factory=list)
+
+
+class Game:
+    """The simulated game: who is in it and where they can post"""
+
+    def __init__(self, fake, rng: random.Random):
+        self.fake = fake
+        self.rng = rng
+        self.main_guild = 0
+        self.players: list[Player] = []
+        # (user ID, channel ID) for each side of each open chat
+        self.chat_sides: list[tuple[int, int]] = []
+        self.public_channel = 0
+        # Reposts in the public channel: (message ID, poster's user ID)
+        self.posts: deque[tuple[int, int]] = deque(maxlen=50)
+        self.products: list[tuple[str, str]] = []
+
+    def other_player(self, player: Player) -> Player:
+        while True:
+            other = self.rng.choice(self.players)
+            if other is not player:
+                return other
+
+    async def chat(self):
+        user_id, channel_id = self.rng.choice(self.chat_sides)
+        await self.fake.send_message(
+            user_id, channel_id, f"chat message {self.rng.randrange(10**6)}"
+        )
+
+    async def public(self):
+        player = self.rng.choice(self.players)
+        before = next(reversed(self.fake.messages[self.public_channel]), None)
+        await self.fake.send_message(
+            player.user_id,
+            self.public_channel,
+            f"public post {self.rng.randrange(10**6)}",
+        )
+        latest = next(reversed(self.fake.messages[self.public_channel]), None)
+        if latest is not None and latest != before:
+            self.posts.append((latest, player.user_id))
+
+    async def reaction(self):
+        if len(self.posts) == 0:
+            await self.public()
+            return
+        message_id, poster = self.rng.choice(self.posts)
+        reactor = self.rng.choice([p for p in self.players if p.user_id != poster])
+        await self.fake.add_reaction(
+            reactor.user_id, self.public_channel, message_id, tip_emoji
+        )
+
+    async def command(self, player: Player, command: str, **options) -> bool:
+        channel_id = player.cmd_line
+        assert channel_id is not None
+        log = await self.fake.run_command(
+            player.user_id, channel_id, command, **options
+        )
+        return log.response_type is not None
+
+    async def balance(self):
+        return await self.command(self.rng.choice(self.players), "balance")
+
+    async def pay(self):
+        player = self.rng.choice(self.players)
+        other = self.other_player(player)
+        return await self.command(player, "pay", target_handle=other.handle, amount=1)
+
+    async def order(self):
+        if len(self.products) == 0:
+            return await self.balance()
+        shop_name, product_name = self.rng.choice(self.products)
+        return await self.command(
+            self.rng.choice(self.players),
+            "order",
+            product_name=product_name,
+            shop_name=shop_name,
+        )
+
+
+event_types = {
+    "chat": Game.chat,
+    "public": Game.public,
+    "reaction": Game.reaction,
+    "balance": Game.balance,
+    "pay": Game.pay,
+    "order": Game.order,
+}
+
+
+def write_known_handles(path: str, players: int, balance: int):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(known_handles_header)
+        for i in range(players):
+            name = [f"Player {i}", f"Role {i}", f"p{i:03d}", balance]
+            writer.writerow(name + [""] * (len(known_handles_header) - len(name)))
+
+
+async def set_up_game(fake, game: Game, players: int, chats: int, shops: int):
+    from talesbot import handles
+    from talesbot import players as players_module
+    from talesbot import shops as shops_module
+
+    bot = await fake.start_bot()
+    game.main_guild = next(iter(fake.guilds))
+    landing_page = fake.find_channel(game.main_guild, "landing_page")
+    game.public_channel = fake.find_channel(game.main_guild, "open_channel")
+
+    for i in range(players):
+        handle = f"p{i:03d}"
+        user_id = await fake.join_guild(game.main_guild, f"user{i}")
+        await fake.run_command(user_id, landing_page, "join", handle=handle)
+        player_id = players_module.get_player_id(str(user_id))
+        cmd_line = players_module.get_cmd_line_channel(player_id)
+        game.players.append(Player(user_id, handle, cmd_line.id))
+
+    pairs = set()
+    while len(pairs) < min(chats, players * (players - 1) // 2):
+        a, b = game.rng.sample(game.players, 2)
+        if (b.handle, a.handle) not in pairs:
+            pairs.add((a.handle, b.handle))
+    by_handle = {p.handle: p for p in game.players}
+    for a, b in sorted(pairs):
+        await game.command(by_handle[a], "chat", handle=b)
+        # The partner's side of the chat is only created with the first message
+        channel_id = fake.find_channel(game.main_guild, f"{a}_to_{b}")
+        if channel_id is None:
+            # The chat stays closed if a already has too many chats open
+            continue
+        await fake.send_message(by_handle[a].user_id, channel_id, "hello")
+        game.chat_sides.append((by_handle[a].user_id, channel_id))
+        partner_channel = fake.find_channel(game.main_guild, f"{b}_to_{a}")
+        if partner_channel is not None:
+            game.chat_sides.append((by_handle[b].user_id, partner_channel))
+
+    for i in range(min(shops, players)):
+        shop_name = f"shop{i}"
+        owner = game.players[i]
+        async with handles.semaphore():
+            await shops_module.create_shop(shop_name, owner.handle, is_owner=True)
+        for product in ("coffee", "noodles", "ammo"):
+            await shops_module.add_product(
+                str(owner.user_id), product, None, 1, None, shop_name
+            )
+            game.products.append((shop_name, product))
+        await shops_module.update_storefront(str(owner.user_id), shop_name)
+    return bot
+
+
+async def drive(
+    fake, game: Game, rate: float, duration: float, mix: dict[str, float]
+) -> Results:
+    results = Results()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    async def run_event(name: str):
+        with fake.track() as delivery:
+            try:
+                ok = await event_types[name](game)
+            except Exception:
+                logging.exception(f"Load test event {name} failed")
+                ok = False
+        if ok is False or delivery.elapsed is None:
+            results.errors[name] += 1
+        if delivery.elapsed is not None:
+            results.latencies[name].append(delivery.elapsed)
+        results.rest_calls[name] += delivery.rest_calls
+        results.rate_limited[name] += delivery.rate_limited
+
+    tasks = set()
+    start = time.perf_counter()
+    # Open loop: a Poisson process at `rate`, however slowly the bot keeps up
+    next_at = start
+    while next_at - start < duration:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        results.send_lag.append(max(0, time.perf_counter() - next_at))
+        task = asyncio.create_task(run_event(game.rng.choices(names, weights)[0]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_at += game.rng.expovariate(rate)
+    if tasks:
+        await asyncio.wait(tasks)
+    return results
+
+
+def summarize(results: Results, elapsed: float) -> dict[str, Any]:
+    events = {}
+    for name, latencies in sorted(results.latencies.items()):
+        latencies.sort()
+        count = len(latencies)
+        events[name] = {
+            "count": count,
+            "errors": results.errors[name],
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / count,
+            "max": latencies[-1],
+            "rest_calls_per_event": results.rest_calls[name] / count,
+            "rate_limited_per_event": results.rate_limited[name] / count,
+        }
+    total = sum(len(v) for v in results.latencies.values())
+    results.send_lag.sort()
+    return {
+        "events": events,
+        "total_events": total,
+        "achieved_rate": total / elapsed if elapsed > 0 else 0,
+        "send_lag_p99": percentile(results.send_lag, 99),
+    }
+
+
+async def run(options: dict[str, Any]) -> dict[str, Any]:
+    # Only importable once the scratch directory is set up
+    from scripts.fake_discord import FakeDiscord
+    from talesbot import config_folders
+    from talesbot.database import create_tables
+    from talesbot.logger import init_loggers
+
+    started = datetime.datetime.now(datetime.UTC).isoformat()
+    for folder in config_folders:
+        os.makedirs(os.path.join("config", folder), exist_ok=True)
+    write_known_handles(
+        os.path.join("config", "known_handles.csv"),
+        options["players"],
+        options["balance"],
+    )
+    init_loggers(console_level="WARNING")
+    await create_tables()
+
+    rng = random.Random(options["seed"])
+    fake = FakeDiscord(
+        latency=options["latency"],
+        jitter=options["jitter"],
+        gateway_latency=options["gateway_latency"],
+        seed=options["seed"],
+    )
+    for i in range(options["guilds"]):
+        fake.add_guild(f"Tales {i}")
+    game = Game(fake, rng)
+
+    # Setting up is not what is measured, so it is done without latency or
+    # rate limits
+    rate_limits, global_rate_limit = fake.rate_limits, fake.global_rate_limit
+    fake.rate_limits, fake.global_rate_limit = {}, None
+    latency, fake.latency = fake.latency, 0
+    setup_start = time.perf_counter()
+    bot = await set_up_game(
+        fake,
+        game,
+        options["players"],
+        options["chats"],
+        options["shops"],
+    )
+    setup_seconds = time.perf_counter() - setup_start
+    setup_rss = peak_rss_mb()
+    fake.latency = latency
+    if options["rate_limits"]:
+        fake.rate_limits, fake.global_rate_limit = rate_limits, global_rate_limit
+
+    storage_before = storage_totals()
+    requests_before = dict(fake.requests)
+    start = time.perf_counter()
+    try:
+        results = await drive(
+            fake, game, options["rate"], options["duration"], parse_mix(options["mix"])
+        )
+    finally:
+        await bot.close()
+    elapsed = time.perf_counter() - start
+
+    requests = {
+        key: count - requests_before.get(key, 0)
+        for key, count in sorted(fake.requests.items(), key=lambda kv: -kv[1])
+        if count != requests_before.get(key, 0)
+    }
+    return {
+        "started": started,
+        "revision": git_revision(),
+        "options": options,
+        "setup_seconds": setup_seconds,
+        "elapsed": elapsed,
+        **summarize(results, elapsed),
+        "rest_requests": requests,
+        "storage": storage_diff(storage_before, storage_totals()),
+        "peak_rss_mb": {"setup": setup_rss, "total": peak_rss_mb()},
+    }
+
+
+def print_report(report: dict[str, Any]):
+    rows = [
+        [
+            name,
+            e["count"],
+            e["errors"],
+            f"{e['p50'] * 1000:.1f}",
+            f"{e['p95'] * 1000:.1f}",
+            f"{e['p99'] * 1000:.1f}",
+            f"{e['rest_calls_per_event']:.1f}",
+        ]
+        for name, e in report["events"].items()
+    ]
+    headers = ["event", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "REST/event"]
+    print(tabulate(rows, headers=headers))
+    written = sum(report["storage"]["written_bytes"].values())
+    print(
+        f"\n{report['total_events']} events at {report['achieved_rate']:.1f}/s, "
+        + f"{written / 1024:.0f} KiB written to storage, "
+        + f"peak RSS {report['peak_rss_mb']['total']:.0f} MB"
+    )
+
+
+@click.command()
+@click.option("--players", default=40, show_default=True)
+@click.option("--guilds", default=2, show_default=True, help="Main guild + mirrors")
+@click.option("--chats", default=20, show_default=True, help="Open chats")
+@click.option("--shops", default=2, show_default=True)
+@click.option("--rate", default=10.0, show_default=True, help="Events per second")
+@click.option("--duration", default=30.0, show_default=True, help="Seconds")
+@click.option("--mix", default=default_mix, show_default=True, help="Event weights")
+@click.option("--latency", default=0.05, show_default=True, help="REST latency")
+@click.option("--jitter", default=0.02, show_default=True)
+@click.option("--gateway-latency", default=0.02, show_default=True)
+@click.option("--rate-limits/--no-rate-limits", default=True, show_default=True)
+@click.option("--balance", default=10000, show_default=True, help="Per player")
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False),
+    help="Where to put config/ (default: a new temporary directory)",
+)
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False), default="loadtest.json"
+)
+def main(output: str, workdir: str | None, **options):
+    output = os.path.abspath(output)
+    workdir = enter_scratch_directory(workdir, "talesbot-loadtest-")
+    parse_mix(options["mix"])
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    report = asyncio.run(run(options))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"Results written to {output}, config/ left in {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+### Replay
+# Plays a game's messages.log back through the bot, via the fake Discord, to
+# reproduce real traffic for profiling and capacity planning. Messages are
+# sent at their logged times, optionally sped up, and the report has the
+# same form as the load test's.
+#
+# The game is set up again from the snapshot's known_handles.csv: every
+# author in the log joins with their handle, and chats are opened the first
+# time someone writes in them. The rest of a config/ snapshot refers to
+# Discord channels, roles and members by ID, which a fake guild cannot
+# bring back.
+
+import asyncio
+import csv
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import IO, Any
+
+import click
+import uvloop
+
+from scripts.benchmarking import (
+    enter_scratch_directory,
+    git_revision,
+    peak_rss_mb,
+    storage_diff,
+    storage_totals,
+)
+from scripts.loadtest import Results, known_handles_header, print_report, summarize
+
+# As written by the talesbot.messages logger. Older logs have no timestamp.
+line_pattern = re.compile(
+    r"^(?:(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) : )?"
+    r"(?P<author>\d+) : (?P<player>\S+) : (?P<channel>\S+) : (?P<content>.*)$"
+)
+chat_channel_pattern = re.compile(r"^(?P<handle>.+)_to_(?P<partner>.+)$")
+
+
+@dataclass
+class LoggedMessage:
+    time: datetime.datetime | None
+    author_id: int
+    player_id: str | None
+    channel: str
+    content: str
+
+
+def parse_log(lines: Iterable[str]) -> Iterator[LoggedMessage]:
+    message = None
+    for line in lines:
+        line = line.rstrip("\n")
+        match = line_pattern.match(line)
+        if match is None:
+            # The rest of a message with line breaks in it
+            if message is not None:
+                message.content += "\n" + line
+            continue
+        if message is not None:
+            yield message
+        time_str = match.group("time")
+        player_id = match.group("player")
+        message = LoggedMessage(
+            datetime.datetime.fromisoformat(time_str) if time_str else None,
+            int(match.group("author")),
+            None if player_id == "None" else player_id,
+            match.group("channel"),
+            match.group("content"),
+        )
+    if message is not None:
+        yield message
+
+
+def schedule(
+    messages: list[LoggedMessage],
+    speed: float,
+    interval: float,
+    max_gap: float | None,
+) -> list[float]:
+    """Seconds from the start of the replay at which to send each message.
+    Messages without a time are sent `interval` seconds after the previous."""
+    offsets = []
+    offset = 0.0
+    previous: datetime.datetime | None = None
+    for message in messages:
+        if len(offsets) > 0:
+            if message.time is not None and previous is not None:
+                gap = (message.time - previous).total_seconds()
+            else:
+                gap = interval
+            gap = max(gap, 0) / speed
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap
+        offsets.append(offset)
+        if message.time is not None:
+            previous = message.time
+    return offsets
+
+
+def starting_handles(
+    messages: list[LoggedMessage], known_handles: list[dict[str, str]]
+) -> dict[int, str]:
+    """A handle for every author to join with: the one known for their player
+    ID, else the one they wrote chats as, else a made up one"""
+    by_player = {
+        row["u-nummer"].strip(): row["Main handle"].strip()
+        for row in known_handles
+        if row.get("u-nummer", "").strip() != ""
+    }
+    result: dict[int, str] = {}
+    for message in messages:
+        if message.author_id in result:
+            continue
+        if message.player_id in by_player:
+            result[message.author_id] = by_player[message.player_id]
+            continue
+        match = chat_channel_pattern.match(message.channel)
+        if match is not None:
+            result[message.author_id] = match.group("handle")
+    for message in messages:
+        if message.author_id not in result:
+            result[message.author_id] = f"replay{len(result)}"
+    return result
+
+
+def write_known_handles(
+    path: str, known_handles: list[dict[str, str]], handles: Iterable[str], balance
+):
+    known = {row["Main handle"].strip() for row in known_handles}
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=known_handles_header)
+        writer.writeheader()
+        for row in known_handles:
+            writer.writerow({k: row.get(k, "") for k in known_handles_header})
+        for handle in handles:
+            if handle not in known:
+                writer.writerow(
+                    {
+                        "Spelare": handle,
+                        "Main handle": handle,
+                        "Pengar på main:": balance,
+                    }
+                )
+
+
+class Replay:
+    def __init__(self, fake, handles: dict[int, str]):
+        self.fake = fake
+        self.handles = handles
+        self.main_guild = 0
+        self.skipped: dict[str, int] = {}
+
+    async def set_up(self):
+        from talesbot import players
+
+        bot = await self.fake.start_bot()
+        self.main_guild = next(iter(self.fake.guilds))
+        landing_page = self.fake.find_channel(self.main_guild, "landing_page")
+        for user_id, handle in self.handles.items():
+            self.fake.add_user(handle, user_id=user_id)
+            await self.fake.join_guild(self.main_guild, handle, user_id=user_id)
+            await self.fake.run_command(user_id, landing_page, "join", handle=handle)
+            if players.get_player_id(str(user_id), expect_to_find=False) is None:
+                logging.warning(f"Replayed user {user_id} could not join as {handle}")
+        return bot
+
+    def personal_channel(self, user_id: int, kind: str) -> int | None:
+        from talesbot import actors, players
+
+        player_id = players.get_player_id(str(user_id), expect_to_find=False)
+        if player_id is None:
+            return None
+        if kind == "cmd_line":
+            channel = players.get_cmd_line_channel(player_id)
+            return None if channel is None else channel.id
+        actor = actors.read_actor(player_id)
+        return None if actor is None else int(actor.chat_channel_id)
+
+    async def chat_channel(self, message: LoggedMessage) -> int | None:
+        channel_id = self.fake.find_channel(self.main_guild, message.channel)
+        if channel_id is not None:
+            return channel_id
+        # Open it the way the author once did
+        match = chat_channel_pattern.match(message.channel)
+        cmd_line = self.personal_channel(message.author_id, "cmd_line")
+        if match is None or cmd_line is None:
+            return None
+        await self.fake.run_command(
+            message.author_id, cmd_line, "chat", handle=match.group("partner")
+        )
+        return self.fake.find_channel(self.main_guild, message.channel)
+
+    async def channel_for(self, message: LoggedMessage) -> tuple[str, int | None]:
+        from talesbot import channels
+
+        if channels.is_cmd_line(message.channel):
+            kind = "cmd_line"
+            return kind, self.personal_channel(message.author_id, kind)
+        if channels.is_chat_hub(message.channel):
+            kind = "chat_hub"
+            return kind, self.personal_channel(message.author_id, kind)
+        if chat_channel_pattern.match(message.channel) is not None:
+            return "chat", await self.chat_channel(message)
+        return message.channel, self.fake.find_channel(self.main_guild, message.channel)
+
+    async def send(self, message: LoggedMessage, results: Results):
+        with self.fake.track() as delivery:
+            kind, channel_id = await self.channel_for(message)
+            if channel_id is None:
+                self.skipped[message.channel] = self.skipped.get(message.channel, 0) + 1
+                return
+            # Only the message itself is measured, not opening its chat
+            delivery.rest_calls = delivery.rate_limited = 0
+            try:
+                await self.fake.send_message(
+                    message.author_id, channel_id, message.content
+                )
+            except Exception:
+                logging.exception(f"Replaying message in {message.channel} failed")
+                results.errors[kind] += 1
+        if delivery.elapsed is not None:
+            results.latencies[kind].append(delivery.elapsed)
+        results.rest_calls[kind] += delivery.rest_calls
+        results.rate_limited[kind] += delivery.rate_limited
+
+    async def run(self, messages: list[LoggedMessage], offsets: list[float]):
+        results = Results()
+        tasks = set()
+        start = time.perf_counter()
+        for message, offset in zip(messages, offsets, strict=True):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            results.send_lag.append(max(0, -delay))
+            task = asyncio.create_task(self.send(message, results))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        return results
+
+
+async def run(
+    messages: list[LoggedMessage],
+    offsets: list[float],
+    handles: dict[int, str],
+    known_handles: list[dict[str, str]],
+    options: dict[str, Any],
+) -> dict[str, Any]:
+    # Only importable once the scratch directory is set up
+    from scripts.fake_discord import FakeDiscord
+    from talesbot import config_folders
+    from talesbot.database import create_tables
+    from talesbot.logger import init_loggers
+
+    started = datetime.datetime.now(datetime.UTC).isoformat()
+    shutil.rmtree("config", ignore_errors=True)
+    for folder in config_folders:
+        os.makedirs(os.path.join("config", folder), exist_ok=True)
+    write_known_handles(
+        os.path.join("config", "known_handles.csv"),
+        known_handles,
+        handles.values(),
+        options["balance"],
+    )
+    init_loggers(console_level="WARNING")
+    await create_tables()
+
+    fake = FakeDiscord(
+        latency=options["latency"],
+        jitter=options["jitter"],
+        gateway_latency=options["gateway_latency"],
+        seed=0,
+    )
+    for i in range(options["guilds"]):
+        fake.add_guild(f"Tales {i}")
+    replay = Replay(fake, handles)
+
+    rate_limits, global_rate_limit = fake.rate_limits, fake.global_rate_limit
+    fake.rate_limits, fake.global_rate_limit = {}, None
+    latency, fake.latency = fake.latency, 0
+    setup_start = time.perf_counter()
+    bot = await replay.set_up()
+    setup_seconds = time.perf_counter() - setup_start
+    setup_rss = peak_rss_mb()
+    fake.latency = latency
+    if options["rate_limits"]:
+        fake.rate_limits, fake.global_rate_limit = rate_limits, global_rate_limit
+
+    storage_before = storage_totals()
+    requests_before = dict(fake.requests)
+    start = time.perf_counter()
+    try:
+        results = await replay.run(messages, offsets)
+    finally:
+        await bot.close()
+    elapsed = time.perf_counter() - start
+
+    requests = {
+        key: count - requests_before.get(key, 0)
+        for key, count in sorted(fake.requests.items(), key=lambda kv: -kv[1])
+        if count != requests_before.get(key, 0)
+    }
+    return {
+        "started": started,
+        "revision": git_revision(),
+        "options": options,
+        "messages": len(messages),
+        "authors": len(handles),
+        "log_seconds": offsets[-1] * options["speed"] if offsets else 0,
+        "skipped": replay.skipped,
+        "setup_seconds": setup_seconds,
+        "elapsed": elapsed,
+        **summarize(results, elapsed),
+        "rest_requests": requests,
+        "storage": storage_diff(storage_before, storage_totals()),
+        "peak_rss_mb": {"setup": setup_rss, "total": peak_rss_mb()},
+    }
+
+
+@click.command()
+@click.argument("log", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--snapshot",
+    type=click.Path(file_okay=False, exists=True),
+    help="A config/ directory to take known_handles.csv from",
+)
+@click.option("--speed", default=1.0, show_default=True, help="Time compression")
+@click.option(
+    "--interval",
+    default=1.0,
+    show_default=True,
+    help="Seconds between messages that have no time in the log",
+)
+@click.option("--max-gap", type=float, help="Longest pause, in replay seconds")
+@click.option("--limit", type=int, help="Only replay this many messages")
+@click.option("--guilds", default=1, show_default=True, help="Main guild + mirrors")
+@click.option("--latency", default=0.05, show_default=True, help="REST latency")
+@click.option("--jitter", default=0.02, show_default=True)
+@click.option("--gateway-latency", default=0.02, show_default=True)
+@click.option("--rate-limits/--no-rate-limits", default=True, show_default=True)
+@click.option("--balance", default=10000, show_default=True, help="For new handles")
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False),
+    help="Where to put config/ (default: a new temporary directory)",
+)
+@click.option("-o", "--output", type=click.Path(dir_okay=False), default="replay.json")
+def main(
+    log: IO,
+    snapshot: str | None,
+    limit: int | None,
+    output: str,
+    workdir: str | None,
+    **options,
+):
+    messages = list(parse_log(log))[:limit]
+    if len(messages) == 0:
+        raise click.UsageError("No messages found in the log")
+    known_handles = []
+    if snapshot is not None:
+        path = os.path.join(snapshot, "known_handles.csv")
+        if os.path.exists(path):
+            with open(path, newline="") as f:
+                known_handles = list(csv.DictReader(f))
+    handles = starting_handles(messages, known_handles)
+    offsets = schedule(
+        messages, options["speed"], options["interval"], options["max_gap"]
+    )
+
+    output = os.path.abspath(output)
+    workdir = enter_scratch_directory(workdir, "talesbot-replay-")
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    report = asyncio.run(run(messages, offsets, handles, known_handles, options))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    if report["skipped"]:
+        skipped = sum(report["skipped"].values())
+        print(f"{skipped} messages skipped, in channels the replay could not find")
+    print(f"Results written to {output}, config/ left in {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+### Storage benchmark
+# Builds synthetic config/ trees at a few sizes and times the primitive
+# storage operations on them, to see how they scale with the size of the
+# game. The operations are called through their public functions, so the
+# same numbers can be taken for any other storage engine behind them.
+#
+# The trees are written directly in the layout the modules use, since
+# building 50k chat lines one write_new_chat_log_entry at a time would take
+# longer than the benchmark itself.
+
+import datetime
+import json
+import os
+import random
+import shutil
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import click
+import configobj
+from tabulate import tabulate
+
+from scripts.benchmarking import (
+    enter_scratch_directory,
+    git_revision,
+    percentile,
+    storage_diff,
+    storage_totals,
+)
+
+
+@dataclass
+class Size:
+    actors: int
+    handles_per_actor: int
+    # Records in the finance file of the handle that gets a new one; the
+    # others get a hundredth of that
+    finance_records: int
+    # Lines in the chat that gets a new one, and how many other chats there are
+    chat_lines: int
+    chats: int
+    active_orders: int
+
+
+sizes = {
+    "small": Size(
+        actors=20,
+        handles_per_actor=2,
+        finance_records=100,
+        chat_lines=500,
+        chats=10,
+        active_orders=10,
+    ),
+    "realistic": Size(
+        actors=80,
+        handles_per_actor=3,
+        finance_records=1000,
+        chat_lines=5000,
+        chats=100,
+        active_orders=100,
+    ),
+    "stress": Size(
+        actors=500,
+        handles_per_actor=3,
+        finance_records=10000,
+        chat_lines=50000,
+        chats=1000,
+        active_orders=1000,
+    ),
+}
+
+
+def write_conf(path: str, content: dict[str, Any]):
+    conf = configobj.ConfigObj(path)
+    conf.update(content)
+    conf.write()
+
+
+class Tree:
+    """Writes a synthetic config/ tree, and remembers what is in it"""
+
+    def __init__(self, size: Size, rng: random.Random):
+        self.size = size
+        self.rng = rng
+        self.actor_ids = [f"u{2000 + i}" for i in range(size.actors)]
+        self.handles = {
+            actor_id: [f"{actor_id}_{j}" for j in range(size.handles_per_actor)]
+            for actor_id in self.actor_ids
+        }
+        self.busy_handle = self.handles[self.actor_ids[0]][0]
+        self.busy_chat = self.chat_name(0)
+        self.shop_id = "trinity_taskbar"
+
+    def chat_name(self, i: int) -> str:
+        a = self.handles[self.actor_ids[i % len(self.actor_ids)]][0]
+        b = self.handles[self.actor_ids[(i + 1) % len(self.actor_ids)]][0]
+        return f"{a}--{b}"
+
+    def build(self):
+        from talesbot import config_folders
+        from talesbot.config import config_dir
+
+        shutil.rmtree(config_dir, ignore_errors=True)
+        for folder in config_folders:
+            os.makedirs(config_dir / folder, exist_ok=True)
+        self.build_actors()
+        self.build_handles()
+        self.build_finances()
+        self.build_chats()
+        self.build_shops()
+
+    def build_actors(self):
+        from talesbot import actors
+        from talesbot.config import config_dir
+        from talesbot.custom_types import Actor
+
+        content: dict[str, Any] = {actors.finance_channel_mapping_index: {}}
+        for i, actor_id in enumerate(self.actor_ids):
+            actor = Actor(str(2000 + i), actor_id, 1, 10000 + i, 20000 + i, 30000 + i)
+            content[actor_id] = actor.to_string()
+            content[actors.finance_channel_mapping_index][str(10000 + i)] = actor_id
+        write_conf(str(config_dir / actors.actors_conf_dir / "__actors.conf"), content)
+
+    def build_handles(self):
+        from talesbot import handles
+        from talesbot.config import config_dir
+        from talesbot.custom_types import Handle, HandleTypes
+
+        directory = config_dir / handles.handles_conf_dir
+        write_conf(
+            str(directory / "__handles.conf"),
+            {
+                handles.handles_to_actors: {
+                    handle_id: actor_id
+                    for actor_id, handle_ids in self.handles.items()
+                    for handle_id in handle_ids
+                },
+                handles.actors_index: {actor_id: {} for actor_id in self.actor_ids},
+            },
+        )
+        for actor_id, handle_ids in self.handles.items():
+            write_conf(
+                str(directory / f"{actor_id}.conf"),
+                {
+                    handles.handles_index: {
+                        handle_id: Handle(
+                            handle_id, HandleTypes.Regular, actor_id
+                        ).to_string()
+                        for handle_id in handle_ids
+                    },
+                    handles.active_index: handle_ids[0],
+                    handles.last_regular_index: handle_ids[0],
+                },
+            )
+
+    def finance_record(self) -> str:
+        from talesbot.custom_types import PostTimestamp, TransTypes
+        from talesbot.finances import InternalTransRecord
+
+        actor_id = self.rng.choice(self.actor_ids)
+        return InternalTransRecord(
+            self.handles[actor_id][0],
+            actor_id,
+            self.rng.randint(-500, 500),
+            cause=self.rng.choice(list(TransTypes)),
+            timestamp=PostTimestamp(self.rng.randrange(24), self.rng.randrange(60)),
+        ).to_string()
+
+    def build_finances(self):
+        from talesbot import finances
+        from talesbot.config import config_dir
+
+        for handle_ids in self.handles.values():
+            for handle_id in handle_ids:
+                count = self.size.finance_records
+                if handle_id != self.busy_handle:
+                    count //= 100
+                records = {str(i): self.finance_record() for i in range(1, count + 1)}
+                write_conf(
+                    str(config_dir / finances.finances_conf_dir / f"{handle_id}.conf"),
+                    {
+                        finances.balance_index: str(self.rng.randrange(10000)),
+                        finances.transactions_index: {
+                            finances.highest_transaction_index: str(count),
+                            **records,
+                        },
+                    },
+                )
+
+    def chat_message(self) -> str:
+        words = self.rng.randint(3, 30)
+        return " ".join(
+            self.rng.choice(("hoi", "chummer", "nuyen", "run", "the", "drek"))
+            for _ in range(words)
+        )
+
+    def build_chats(self):
+        from talesbot import chats
+        from talesbot.chats import ChatLogEntry
+        from talesbot.config import config_dir
+
+        lengths = {}
+        for i in range(self.size.chats):
+            chat_name = self.chat_name(i)
+            if chat_name in lengths:
+                continue
+            count = self.size.chat_lines if i == 0 else self.size.chat_lines // 100
+            lengths[chat_name] = str(count)
+            write_conf(
+                str(config_dir / chats.chats_dir / f"{chat_name}.conf"),
+                {
+                    chats.chat_participants_index: {},
+                    chats.chat_content_index: {
+                        str(j): ChatLogEntry(
+                            f"**{chat_name.split('--')[j % 2]}**: {self.chat_message()}"
+                        ).to_string()
+                        for j in range(count)
+                    },
+                },
+            )
+        write_conf(
+            str(config_dir / chats.chats_dir / "chats.conf"),
+            {
+                chats.chat_channel_data_index: {},
+                chats.chat_hub_msg_data_index: {},
+                chats.chats_with_logs_index: lengths,
+            },
+        )
+
+    def order(self, i: int):
+        from talesbot.custom_types import PostTimestamp
+        from talesbot.shops import Order
+
+        now = PostTimestamp(self.rng.randrange(24), self.rng.randrange(60))
+        order = Order(str(i), f"d{i}", 10, 10, str(50000 + i), now)
+        order.items_ordered = {"coffee": 1, "noodles": self.rng.randint(1, 3)}
+        return order
+
+    def build_shops(self):
+        from talesbot import shops
+        from talesbot.config import config_dir
+        from talesbot.shops import MsgOrderMapping, OrderStatus, Shop
+
+        shops_conf = shops.get_shops_configobj()
+        shop = Shop("Trinity Taskbar", self.shop_id, {"1": "40000"}, "40001")
+        shops_conf[shops.shop_data_index][self.shop_id] = shop.to_string()
+        shops_conf.write()
+
+        orders = [self.order(i) for i in range(self.size.active_orders)]
+        write_conf(
+            str(
+                config_dir
+                / shops.shops_conf_dir
+                / f"{self.shop_id}{shops.order_data_suffix}"
+            ),
+            {
+                shops.active_orders_index: {
+                    o.delivery_id: o.to_string() for o in orders
+                },
+                shops.locked_orders_index: {},
+                shops.msg_to_order_mapping_index: {
+                    o.order_flow_msg_id: MsgOrderMapping(
+                        o.delivery_id, OrderStatus.Active
+                    ).to_string()
+                    for o in orders
+                },
+            },
+        )
+
+    def tree_bytes(self) -> dict[str, int]:
+        from talesbot.config import config_dir
+        from talesbot.storage import file_family
+
+        totals: dict[str, int] = {}
+        for directory, _, files in os.walk(config_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                family = file_family(path)
+                totals[family] = totals.get(family, 0) + os.path.getsize(path)
+        return dict(sorted(totals.items()))
+
+
+def operations(tree: Tree) -> dict[str, Callable[[int], Any]]:
+    """The operations to time, each called with the repetition number"""
+    from talesbot import actors, chats, finances, handles, shops
+    from talesbot.chats import ChatLogEntry
+    from talesbot.finances import InternalTransRecord
+
+    last_actor = tree.actor_ids[-1]
+    last_handle = tree.handles[last_actor][-1]
+    return {
+        "handles.get_handle": lambda i: handles.get_handle(last_handle),
+        "handles.get_handle (unused)": lambda i: handles.get_handle(f"nobody{i}"),
+        "finances.add_internal_record": lambda i: finances.add_internal_record(
+            tree.busy_handle, InternalTransRecord.from_string(tree.finance_record())
+        ),
+        "chats.write_new_chat_log_entry": lambda i: chats.write_new_chat_log_entry(
+            tree.busy_chat, ChatLogEntry(tree.chat_message())
+        ),
+        "shops.store_active_order": lambda i: shops.store_active_order(
+            tree.shop_id, tree.order(tree.size.active_orders + i)
+        ),
+        "actors.read_actor": lambda i: actors.read_actor(last_actor),
+    }
+
+
+def time_operation(
+    operation: Callable[[int], Any], repeats: int, budget: float
+) -> dict[str, float]:
+    """Calls `operation` `repeats` times, or fewer (but at least three) if that
+    would take longer than `budget` seconds"""
+    durations = []
+    storage_before = storage_totals()
+    for i in range(repeats):
+        start = time.perf_counter()
+        operation(i)
+        durations.append(time.perf_counter() - start)
+        if i >= 2 and sum(durations) > budget:
+            break
+    calls = len(durations)
+    storage = storage_diff(storage_before, storage_totals())
+    durations.sort()
+    return {
+        "calls": calls,
+        "mean": sum(durations) / calls,
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+        "min": durations[0],
+        "max": durations[-1],
+        **{
+            f"{name}_per_call": sum(families.values()) / calls
+            for name, families in storage.items()
+        },
+    }
+
+
+def run_size(size: Size, repeats: int, budget: float, seed: int) -> dict[str, Any]:
+    tree = Tree(size, random.Random(seed))
+    start = time.perf_counter()
+    tree.build()
+    build_seconds = time.perf_counter() - start
+    return {
+        "size": asdict(size),
+        "build_seconds": build_seconds,
+        "tree_bytes": tree.tree_bytes(),
+        "operations": {
+            operation_name: time_operation(operation, repeats, budget)
+            for operation_name, operation in operations(tree).items()
+        },
+    }
+
+
+def print_report(report: dict[str, Any]):
+    size_names = list(report["sizes"])
+    operation_names = list(report["sizes"][size_names[0]]["operations"])
+    largest = report["sizes"][size_names[-1]]["operations"]
+    rows = [
+        [operation_name]
+        + [
+            f"{report['sizes'][s]['operations'][operation_name]['p50'] * 1000:.2f}"
+            for s in size_names
+        ]
+        + [f"{largest[operation_name]['read_bytes_per_call'] / 1024:.0f}"]
+        for operation_name in operation_names
+    ]
+    headers = ["operation"] + [f"{s} p50 ms" for s in size_names]
+    headers.append(f"{size_names[-1]} KiB read/call")
+    print(tabulate(rows, headers=headers))
+
+
+@click.command()
+@click.option(
+    "--size",
+    "size_names",
+    type=click.Choice(list(sizes)),
+    multiple=True,
+    default=list(sizes),
+    show_default=True,
+    help="Tree sizes to run, smallest first",
+)
+@click.option("--repeats", default=20, show_default=True, help="Calls per operation")
+@click.option(
+    "--budget",
+    default=30.0,
+    show_default=True,
+    help="Stop repeating an operation after this many seconds",
+)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False),
+    help="Where to put config/ (default: a new temporary directory)",
+)
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False), default="storage_bench.json"
+)
+def main(
+    output: str,
+    workdir: str | None,
+    size_names: list[str],
+    repeats: int,
+    budget: float,
+    seed: int,
+):
+    output = os.path.abspath(output)
+    workdir = enter_scratch_directory(workdir, "talesbot-storage-bench-")
+
+    report = {
+        "started": datetime.datetime.now(datetime.UTC).isoformat(),
+        "revision": git_revision(),
+        "options": {"repeats": repeats, "budget": budget, "seed": seed},
+        "sizes": {
+            name: run_size(sizes[name], repeats, budget, seed) for name in size_names
+        },
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"Results written to {output}, last config/ left in {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import asyncio
 import contextlib
+import logging
 import os
+import sys
 
 import discord
 import uvicorn
@@ -8,14 +10,19 @@ import uvloop
 from discord.ext import commands
 from dotenv import load_dotenv
 
-from .api import app
+from . import ipc
+from .api import app, ipc_handlers, ipc_stream_handlers, metrics_app
 from .bot import TalesBot
 from .config import config, config_dir
 from .database import create_tables
 from .logger import init_loggers
+from .loop_monitor import LoopMonitor
+
+logger = logging.getLogger(__name__)
 
 config_folders = [
     "actors",
+    "archive",
     "artifacts",
     "chats",
     "finances",
@@ -28,30 +35,42 @@ config_folders = [
 ]
 
 
-async def start_bot():
-    TOKEN = config.DISCORD_TOKEN
-    exts = [
-        "talesbot.handles",
-        "talesbot.finances",
-        "talesbot.ext.admin",
-        "talesbot.ext.register",
-        "talesbot.chats",
-        "talesbot.shops",
-        "talesbot.ext.gm",
-        "talesbot.ext.artifacts",
-    ]
+extensions = [
+    "talesbot.ext.handles",
+    "talesbot.ext.finances",
+    "talesbot.ext.admin",
+    "talesbot.ext.register",
+    "talesbot.ext.chats",
+    "talesbot.ext.shops",
+    "talesbot.ext.gm",
+    "talesbot.ext.artifacts",
+]
+
 
+def create_bot(**options) -> TalesBot:
     intents = discord.Intents.default()
     intents.message_content = True
     intents.members = True
 
-    async with TalesBot(
-        commands.when_mentioned, intents=intents, inital_extensions=exts
-    ) as bot:
+    return TalesBot(
+        commands.when_mentioned,
+        intents=intents,
+        inital_extensions=extensions,
+        **options,
+    )
+
+
+async def start_bot():
+    TOKEN = config.DISCORD_TOKEN
+    async with create_bot() as bot:
         await bot.start(TOKEN)
 
 
 async def start_api():
+    if config.API_WORKERS > 0:
+        await start_api_workers()
+        return
+
     host = config.HOST
     port = config.PORT
     conf = uvicorn.Config(app=app, host=host, port=port, log_level="info")
@@ -59,6 +78,45 @@ async def start_api():
     await server.serve()
 
 
+async def start_api_workers():
+    # Keep HTTP traffic off the bot's event loop: uvicorn runs the API in its
+    # own processes and only transfers are sent back to us
+    ipc_server = await ipc.serve(config.API_SOCKET, ipc_handlers, ipc_stream_handlers)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "talesbot.api:app",
+        "--host",
+        config.HOST,
+        "--port",
+        str(config.PORT),
+        "--workers",
+        str(config.API_WORKERS),
+        env={**os.environ, "API_WORKER": "true"},
+    )
+    metrics_server = None
+    if config.METRICS_PORT > 0:
+        conf = uvicorn.Config(
+            app=metrics_app, host=config.HOST, port=config.METRICS_PORT
+        )
+        metrics_server = uvicorn.Server(conf)
+        metrics_task = asyncio.create_task(metrics_server.serve())
+    # The workers keep their connections open, and the server only closes
+    # once they are gone, so they are stopped before leaving it
+    async with ipc_server:
+        try:
+            returncode = await process.wait()
+            logger.error(f"API worker processes exited with code {returncode}")
+        finally:
+            if metrics_server is not None:
+                metrics_server.should_exit = True
+                await metrics_task
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+
+
 async def start() -> int:
     load_dotenv()
 
@@ -70,6 +128,8 @@ async def start() -> int:
     async with asyncio.TaskGroup() as tg:
         tg.create_task(start_bot())
         tg.create_task(start_api())
+        if config.LOOP_LAG_THRESHOLD > 0:
+            tg.create_task(LoopMonitor(threshold=config.LOOP_LAG_THRESHOLD).run())
     return 0
 
 
@@ -5,12 +5,12 @@ import logging
 from typing import cast
 
 import discord
-from configobj import ConfigObj
 
 from . import channels, common, finances, handles, players, server, shops
 from .common import emoji_cancel, emoji_open
 from .config import config_dir
 from .custom_types import Actor, Transaction, TransTypes
+from .storage import ConfigObj
 
 actors_conf_dir = "actors"
 finance_channel_mapping_index = "___finance_channels"
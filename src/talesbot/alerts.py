@@ -0,0 +1,172 @@
+### Module alerts.py
+# Phrases that the GMs want to hear about: when a player writes one of them
+# anywhere, the message is copied to the GM channels of the rule. The rules
+# are read from config/alerts.conf, one section per rule:
+#
+#   [tree_of_light]
+#   phrases = welcome the tree of light, the light is coming
+#   channels = gm_alerts,
+#   cooldown = 300
+#
+# All phrases of all rules go into one Aho-Corasick automaton, which finds
+# every phrase in a message in a single pass over its characters, however many
+# phrases and rules there are. Matching ignores case. Each rule alerts at most
+# once per `cooldown` seconds for the same player.
+
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from configobj import ConfigObjError
+
+from .common import gm_announcements_name
+from .config import config, config_dir
+from .errors import ReportError
+from .storage import ConfigObj
+
+logger = logging.getLogger(__name__)
+
+alerts_conf_file = str(config_dir / "alerts.conf")
+
+
+@dataclass
+class AlertRule:
+    name: str
+    phrases: list[str]
+    channels: list[str] = field(default_factory=lambda: [gm_announcements_name])
+    cooldown: float = field(default_factory=lambda: config.ALERT_COOLDOWN)
+
+    def __post_init__(self):
+        self.phrases = [phrase.casefold() for phrase in self.phrases if phrase.strip()]
+
+
+# Used when there is no alerts.conf
+default_rules = [AlertRule("tree_of_light", ["welcome the tree of light"])]
+
+
+class PhraseAutomaton:
+    """Aho-Corasick automaton over a set of phrases"""
+
+    def __init__(self, phrases: set[str]):
+        # State 0 is the root. Each state is a prefix of one or more phrases.
+        self.transitions: list[dict[str, int]] = [{}]
+        self.fallbacks: list[int] = [0]
+        # Phrases that end at each state, including those that end at its
+        # fallbacks: a phrase can be the end of another one
+        self.outputs: list[frozenset[str]] = [frozenset()]
+        for phrase in phrases:
+            state = 0
+            for char in phrase:
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.fallbacks.append(0)
+                    self.outputs.append(frozenset())
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.outputs[state] |= {phrase}
+
+        # The fallback of a state is the longest suffix of its prefix that is
+        # also a state, so breadth first the shorter ones are already known
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                fallback = self.fallbacks[state]
+                while fallback != 0 and char not in self.transitions[fallback]:
+                    fallback = self.fallbacks[fallback]
+                fallback = self.transitions[fallback].get(char, 0)
+                self.fallbacks[next_state] = fallback
+                self.outputs[next_state] |= self.outputs[fallback]
+                queue.append(next_state)
+
+    def find(self, text: str) -> set[str]:
+        """The phrases that occur in `text`"""
+        found: set[str] = set()
+        state = 0
+        for char in text:
+            while state != 0 and char not in self.transitions[state]:
+                state = self.fallbacks[state]
+            state = self.transitions[state].get(char, 0)
+            if self.outputs[state]:
+                found |= self.outputs[state]
+        return found
+
+
+class AlertMatcher:
+    def __init__(self, rules: list[AlertRule]):
+        self.rules = rules
+        self.automaton = PhraseAutomaton(
+            {phrase for rule in rules for phrase in rule.phrases}
+        )
+        # (rule name, player) -> when the rule may alert for the player again
+        self.cooldowns: dict[tuple[str, str], float] = {}
+
+    def find(self, text: str) -> list[AlertRule]:
+        """The rules with a phrase in `text`"""
+        found = self.automaton.find(text.casefold())
+        if len(found) == 0:
+            return []
+        return [rule for rule in self.rules if not found.isdisjoint(rule.phrases)]
+
+    def take_cooldown(self, rule: AlertRule, player_id: str) -> bool:
+        """False if the rule has already alerted for the player within its
+        cooldown, otherwise starts the cooldown"""
+        now = time.monotonic()
+        key = (rule.name, player_id)
+        if self.cooldowns.get(key, now) > now:
+            return False
+        self.cooldowns = {k: end for k, end in self.cooldowns.items() if end > now}
+        self.cooldowns[key] = now + rule.cooldown
+        return True
+
+
+matcher = AlertMatcher(default_rules)
+
+
+def as_list(value) -> list[str]:
+    # ConfigObj gives a string for a single value without a trailing comma
+    return [value] if isinstance(value, str) else list(value)
+
+
+def read_rules(file_name: str = alerts_conf_file) -> list[AlertRule]:
+    try:
+        conf = ConfigObj(file_name)
+    except ConfigObjError as e:
+        raise ReportError(f"Could not read {os.path.basename(file_name)}: {e}") from e
+    rules = []
+    for name in conf.sections:
+        section = conf[name]
+        try:
+            rule = AlertRule(name, as_list(section.get("phrases", [])))
+            if "channels" in section:
+                rule.channels = as_list(section["channels"])
+            if "cooldown" in section:
+                rule.cooldown = float(section["cooldown"])
+        except ValueError:
+            logger.warning(f"Alert rule {name} has an invalid cooldown, skipping it")
+            continue
+        if len(rule.phrases) == 0 or len(rule.channels) == 0:
+            logger.warning(f"Alert rule {name} needs phrases and channels, skipping it")
+            continue
+        rules.append(rule)
+    return rules
+
+
+def load() -> list[AlertRule]:
+    """Reads the alert rules and starts using them. If alerts.conf cannot be
+    read, raises ReportError and keeps the current rules."""
+    global matcher
+    rules = read_rules() if os.path.exists(alerts_conf_file) else default_rules
+    matcher = AlertMatcher(rules)
+    phrases = sum(len(rule.phrases) for rule in rules)
+    logger.info(f"Loaded {len(rules)} alert rules with {phrases} phrases")
+    return rules
+
+
+def init():
+    try:
+        load()
+    except ReportError as e:
+        logger.error(f"{e.report}, keeping the current alert rules")
@@ -1,30 +1,156 @@
+import asyncio
+import contextlib
+import dataclasses
+import hashlib
 import logging
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
 
-from fastapi import FastAPI
+import simplejson
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from talesbot import finances, utils
+from talesbot import archive, events, finances, ipc, metrics, utils
+from talesbot.config import config
+from talesbot.custom_types import Transaction
+from talesbot.errors import BatchTransferError, ReportError
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 
+class IdempotencyStore:
+    """Remembers the response for each idempotency key for a limited time.
+
+    The request is run as a task that is stored before it starts, so a retry
+    that arrives while the original is still running waits for the same result
+    instead of moving money a second time. Only successful responses are kept,
+    so a retry after a failed transfer runs again. Reusing a key for a
+    different request is rejected.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (created, request fingerprint, task)
+        self.entries: OrderedDict[str, tuple[float, str, asyncio.Task]] = OrderedDict()
+
+    def _evict(self, now: float):
+        while self.entries:
+            created, _fingerprint, _task = next(iter(self.entries.values()))
+            if now - created < self.ttl and len(self.entries) <= self.max_size:
+                break
+            self.entries.popitem(last=False)
+
+    def _forget_if_failed(self, key: str, task: asyncio.Task):
+        if (
+            task.cancelled()
+            or task.exception() is not None
+            or task.result().get("status") != "ok"
+        ):
+            # Nothing to replay, let a retry run again
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is task:
+                del self.entries[key]
+
+    async def run(
+        self,
+        key: str | None,
+        fingerprint: str,
+        request: Callable[[], Awaitable[dict[str, Any]]],
+    ):
+        if key is None:
+            return await request()
+
+        now = time.monotonic()
+        self._evict(now)
+        if key in self.entries:
+            _created, stored_fingerprint, task = self.entries[key]
+            if stored_fingerprint != fingerprint:
+                raise HTTPException(
+                    422, "The idempotency key was already used for another request"
+                )
+            logger.info(f"Replaying response for idempotency key {key}")
+        else:
+            task = asyncio.ensure_future(request())
+            task.add_done_callback(lambda t: self._forget_if_failed(key, t))
+            self.entries[key] = (now, fingerprint, task)
+            self._evict(now)
+        # Shielded so that a dropped connection does not abort a started transfer
+        return await asyncio.shield(task)
+
+
+idempotency_store = IdempotencyStore()
+
+
+def request_fingerprint(data: BaseModel) -> str:
+    """Hash of a request body, apart from its idempotency key"""
+    body = simplejson.dumps(
+        data.model_dump(exclude={"idempotency_key"}), sort_keys=True
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+# Used by the API worker processes, see ipc_handlers
+bot_process = ipc.Client(config.API_SOCKET)
+
+
+async def forward(op: str, args: dict[str, Any]) -> Any:
+    """Runs the request in the bot process, keeping its HTTP errors"""
+    try:
+        return await bot_process.call(op, args)
+    except ipc.IpcError as e:
+        if e.status_code is None:
+            raise
+        raise HTTPException(e.status_code, str(e)) from e
+
+
 @app.get("/api/balance/{handle}")
 async def balance(handle: str):
-    amount = finances.get_current_balance_handle_id(handle)
+    if config.API_WORKER:
+        amount = finances.read_balance_handle_id(handle)
+    else:
+        amount = finances.get_current_balance_handle_id(handle)
     return {"amount": amount}
 
 
+@app.get("/api/balances")
+async def balances(handles: str):
+    """Balances for a comma separated list of handles, null for unknown handles"""
+    handle_ids = [h.strip() for h in handles.split(",") if h.strip() != ""]
+    balances = finances.get_current_balances(handle_ids, cached=not config.API_WORKER)
+    return {"balances": balances}
+
+
 class Transfer(BaseModel):
     sender: str | None = None
     receiver: str | None = None
     amount: int
     allow_partial: bool = False
+    idempotency_key: str | None = None
+
+
+class TransferBatch(BaseModel):
+    transfers: list[Transfer]
+    atomic: bool = False
+    idempotency_key: str | None = None
 
 
 @app.post("/api/transfer")
 async def transfer(data: Transfer):
+    if config.API_WORKER:
+        return await forward("transfer", data.model_dump())
+    key = f"transfer:{data.idempotency_key}" if data.idempotency_key else None
+    return await idempotency_store.run(
+        key, request_fingerprint(data), lambda: _transfer(data)
+    )
+
+
+async def _transfer(data: Transfer):
     logger.info(
         f"Transfering {utils.fmt_money(data.amount)} from "
         f"{utils.fmt_handle(data.sender)} to {utils.fmt_handle(data.receiver)}"
@@ -45,3 +171,130 @@ async def transfer(data: Transfer):
             f"{utils.fmt_handle(data.sender)} to {utils.fmt_handle(data.sender)}"
         )
         return {"status": "error", "msg": str(e)}
+
+
+def _transfer_result(result: Transaction | Exception):
+    if isinstance(result, Exception):
+        return {"status": "error", "msg": str(result)}
+    return {"status": "ok", "message": result.report, "amount": result.amount}
+
+
+@app.post("/api/transfers")
+async def transfers(data: TransferBatch):
+    if config.API_WORKER:
+        return await forward("transfers", data.model_dump())
+    key = f"transfers:{data.idempotency_key}" if data.idempotency_key else None
+    return await idempotency_store.run(
+        key, request_fingerprint(data), lambda: _transfers(data)
+    )
+
+
+async def _transfers(data: TransferBatch):
+    logger.info(
+        f"Transfering batch of {len(data.transfers)} "
+        f"({'atomic' if data.atomic else 'per item'})"
+    )
+    try:
+        results = await finances.transfer_funds_batch(
+            [(t.sender, t.receiver, t.amount, t.allow_partial) for t in data.transfers],
+            atomic=data.atomic,
+        )
+    except BatchTransferError as e:
+        logger.warning(f"Batch transfer failed at index {e.index}: {e.__cause__}")
+        return {"status": "error", "msg": str(e.__cause__), "index": e.index}
+    except Exception as e:
+        logger.exception("Failed batch transfer")
+        return {"status": "error", "msg": str(e)}
+
+    # A batch where some of the items failed is not cached as a success
+    failed = any(isinstance(r, Exception) for r in results)
+    return {
+        "status": "partial" if failed else "ok",
+        "results": [_transfer_result(r) for r in results],
+    }
+
+
+def _parse_event_types(types: str | None) -> set[str] | None:
+    if types is None:
+        return None
+    return {t.strip() for t in types.split(",") if t.strip() != ""}
+
+
+async def _event_source(types: str | None) -> AsyncIterator[dict[str, Any] | None]:
+    if config.API_WORKER:
+        return ipc.stream(config.API_SOCKET, "stream", {"types": types})
+    return events.listen(_parse_event_types(types))
+
+
+@app.get("/api/stream")
+async def stream(types: str | None = None):
+    """Server-sent events for transactions, orders, chat sessions and network
+    state, optionally filtered by a comma separated list of event types"""
+    source = await _event_source(types)
+
+    async def body():
+        async with contextlib.aclosing(source):
+            async for event in source:
+                if event is None:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {simplejson.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/archive")
+async def archived_messages(
+    start: str,
+    end: str | None = None,
+    handle: str | None = None,
+    player: str | None = None,
+    channel: str | None = None,
+):
+    """Archived messages between `start` and `end` (ISO times, local unless
+    they have an offset) from the given handle, player and/or channel"""
+    try:
+        start_time = archive.parse_time(start)
+        end_time = archive.parse_time(end) if end is not None else time.time()
+    except ReportError as e:
+        return {"status": "error", "msg": e.report}
+    found = await asyncio.to_thread(
+        archive.search,
+        start_time,
+        end_time,
+        handle=handle.lower() if handle is not None else None,
+        player=player,
+        channel=channel,
+    )
+    return {"status": "ok", "messages": [dataclasses.asdict(m) for m in found]}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics of this process. With API workers, the bot process serves its
+    own on config.METRICS_PORT."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Only serves the bot process's metrics, when the API runs in worker processes
+metrics_app = FastAPI()
+metrics_app.add_api_route("/metrics", get_metrics, response_class=PlainTextResponse)
+
+
+# When the API is served by separate worker processes (config.API_WORKERS > 0),
+# the workers read balances and the archive from the files themselves, and
+# forward transfers to the bot process, which runs them here. Balance changes,
+# idempotency keys and finance records then all stay in one place.
+ipc_handlers: dict[str, ipc.Handler] = {
+    "transfer": lambda args: transfer(Transfer.model_validate(args)),
+    "transfers": lambda args: transfers(TransferBatch.model_validate(args)),
+}
+
+ipc_stream_handlers: dict[str, ipc.StreamHandler] = {
+    "stream": lambda args: events.listen(_parse_event_types(args["types"])),
+}
@@ -0,0 +1,271 @@
+### Archive of everything players write
+# The talesbot.messages logger also goes to an ArchiveHandler, which writes the
+# messages to one segment per hour under config/archive. A finished segment is
+# gzipped and gets a small index file with the line numbers of the messages
+# by each player, handle and channel. A search only reads the segments that
+# overlap its time range and have something for the handle (or player or
+# channel) it is looking for.
+
+import datetime
+import gzip
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Any
+
+import simplejson
+
+from .config import config_dir
+from .errors import ReportError
+
+archive_dir = config_dir / "archive"
+
+# An index is {"start": <time>, "end": <time>, "count": <lines>,
+# <key>: {<value>: [<line number>, ...]}} for each of the keys
+index_keys = ["player", "handle", "channel"]
+segment_length = datetime.timedelta(hours=1)
+segment_format = "%Y-%m-%dT%H"
+
+
+@dataclass
+class ArchivedMessage:
+    time: float
+    author_id: str
+    player: str | None
+    handle: str | None
+    channel: str
+    content: str
+
+    def to_string(self) -> str:
+        time = datetime.datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S")
+        who = self.handle if self.handle is not None else self.player
+        return f"{time} #{self.channel} {who}: {self.content}"
+
+
+def parse_time(text: str) -> float:
+    """ISO date and time, in local time unless it has an offset"""
+    try:
+        return datetime.datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError as e:
+        raise ReportError(
+            f'Could not read the time "{text}", write it like 2024-05-18 20:30'
+        ) from e
+
+
+def archive_fields(
+    author_id: int, player: str | None, handle: str | None, channel: str, content: str
+) -> dict[str, Any]:
+    """`extra` for a talesbot.messages log record that should be archived"""
+    return {
+        "archive": {
+            "author_id": str(author_id),
+            "player": player,
+            "handle": handle,
+            "channel": channel,
+            "content": content,
+        }
+    }
+
+
+def segment_name(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.UTC).strftime(
+        segment_format
+    )
+
+
+def segment_start(name: str) -> float:
+    return (
+        datetime.datetime.strptime(name, segment_format)
+        .replace(tzinfo=datetime.UTC)
+        .timestamp()
+    )
+
+
+def segment_path(directory: str, name: str, suffix: str) -> str:
+    return os.path.join(directory, f"{name}{suffix}")
+
+
+def new_index() -> dict[str, Any]:
+    return {"start": None, "end": None, "count": 0} | {key: {} for key in index_keys}
+
+
+def add_to_index(index: dict[str, Any], entry: dict[str, Any]):
+    line = index["count"]
+    index["count"] += 1
+    index["start"] = min(entry["time"], index["start"] or entry["time"])
+    index["end"] = max(entry["time"], index["end"] or entry["time"])
+    for key in index_keys:
+        if entry[key] is not None:
+            index[key].setdefault(entry[key], []).append(line)
+
+
+def read_segment_lines(path: str) -> list[str]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        # A segment that is still being written can end in half a line
+        return [line for line in f.read().split("\n") if line != ""]
+
+
+def index_segment_file(path: str) -> dict[str, Any]:
+    index = new_index()
+    for line in read_segment_lines(path):
+        try:
+            add_to_index(index, simplejson.loads(line))
+        except ValueError:
+            break
+    return index
+
+
+def seal_segment(directory: str, name: str, index: dict[str, Any] | None = None):
+    """Gzips a finished segment and writes its index"""
+    path = segment_path(directory, name, ".jsonl")
+    if index is None:
+        index = index_segment_file(path)
+    with open(path, "rb") as f_in, gzip.open(f"{path}.gz", "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    with open(segment_path(directory, name, ".index.json"), "w") as f:
+        simplejson.dump(index, f)
+    os.remove(path)
+
+
+class ArchiveHandler(logging.Handler):
+    """Archives log records that have the fields from archive_fields.
+
+    Runs on the logging listener thread, so the writing and compressing
+    happens off the event loop."""
+
+    def __init__(self, directory: str = str(archive_dir), level=logging.NOTSET):
+        super().__init__(level)
+        self.directory = directory
+        self.segment: str | None = None
+        self.index = new_index()
+        self.stream = None
+        os.makedirs(directory, exist_ok=True)
+        # Segments left open when the bot stopped, except the current one
+        current = segment_name(datetime.datetime.now(datetime.UTC).timestamp())
+        for file_name in sorted(os.listdir(directory)):
+            name, suffix = os.path.splitext(file_name)
+            if suffix == ".jsonl" and name < current:
+                seal_segment(directory, name)
+
+    def emit(self, record: logging.LogRecord):
+        fields = getattr(record, "archive", None)
+        if fields is None:
+            return
+        try:
+            entry = {"time": record.created} | fields
+            # Late records go in the open segment, the indexes have the times
+            name = segment_name(record.created)
+            if self.segment is None or name > self.segment:
+                self.open_segment(name)
+            assert self.stream is not None
+            self.stream.write(simplejson.dumps(entry) + "\n")
+            self.stream.flush()
+            add_to_index(self.index, entry)
+        except Exception:
+            self.handleError(record)
+
+    def open_segment(self, name: str):
+        self.close_segment()
+        path = segment_path(self.directory, name, ".jsonl")
+        # When restarting in the middle of a segment
+        self.index = index_segment_file(path) if os.path.exists(path) else new_index()
+        self.segment = name
+        self.stream = open(path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def close_segment(self):
+        if self.stream is None or self.segment is None:
+            return
+        self.stream.close()
+        self.stream = None
+        seal_segment(self.directory, self.segment, self.index)
+        self.segment = None
+
+    def open_index(self) -> tuple[str | None, dict[str, Any]]:
+        """The open segment and a copy of its index"""
+        with self.lock:
+            return self.segment, simplejson.loads(simplejson.dumps(self.index))
+
+    def close(self):
+        with self.lock:
+            # Left as it is to be continued after a restart
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+                self.segment = None
+        super().close()
+
+
+def get_archive_handler() -> ArchiveHandler | None:
+    handler = logging.getHandlerByName("archive")
+    return handler if isinstance(handler, ArchiveHandler) else None
+
+
+def segment_names(directory: str) -> list[str]:
+    names = set()
+    for file_name in os.listdir(directory):
+        if file_name.endswith((".jsonl", ".jsonl.gz")):
+            names.add(file_name.split(".")[0])
+    return sorted(names)
+
+
+def search(
+    start: float,
+    end: float,
+    handle: str | None = None,
+    player: str | None = None,
+    channel: str | None = None,
+    directory: str = str(archive_dir),
+) -> list[ArchivedMessage]:
+    """Archived messages from between `start` and `end` (inclusive) that match
+    all of the given handle, player and channel. Reads files, so run it in a
+    thread."""
+    filters = {"handle": handle, "player": player, "channel": channel}
+    filters = {key: value for key, value in filters.items() if value is not None}
+    handler = get_archive_handler()
+    open_segment, open_index = (
+        handler.open_index() if handler is not None else (None, None)
+    )
+
+    found = []
+    if not os.path.isdir(directory):
+        return found
+    for name in segment_names(directory):
+        # Every message in a segment is from before its end
+        if segment_start(name) + segment_length.total_seconds() <= start:
+            continue
+        index_path = segment_path(directory, name, ".index.json")
+        if name == open_segment and open_index is not None:
+            index = open_index
+            path = segment_path(directory, name, ".jsonl")
+        elif os.path.exists(index_path):
+            with open(index_path) as f:
+                index = simplejson.load(f)
+            path = segment_path(directory, name, ".jsonl.gz")
+        else:
+            path = segment_path(directory, name, ".jsonl")
+            index = index_segment_file(path)
+        if index["count"] == 0 or index["start"] > end or index["end"] < start:
+            continue
+
+        wanted: set[int] | None = None
+        for key, value in filters.items():
+            lines = set(index[key].get(value, []))
+            wanted = lines if wanted is None else wanted & lines
+        if wanted is not None and len(wanted) == 0:
+            continue
+
+        if not os.path.exists(path):
+            # The open segment was sealed since the index was copied
+            path = segment_path(directory, name, ".jsonl.gz")
+        for number, line in enumerate(read_segment_lines(path)):
+            if number >= index["count"]:
+                break
+            if wanted is not None and number not in wanted:
+                continue
+            entry = simplejson.loads(line)
+            if start <= entry["time"] <= end:
+                found.append(ArchivedMessage(**entry))
+    found.sort(key=lambda m: m.time)
+    return found
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import re
+import time
 from typing import cast
 
 import discord
@@ -11,21 +12,26 @@ from discord.ext import commands
 
 from talesbot import (
     actors,
+    archive,
     channels,
     chats,
+    dispatch,
     finances,
     game,
     gm,
     groups,
     handles,
+    metrics,
     players,
     posting,
     reactions,
     server,
     shops,
 )
+from talesbot.channels import ChannelKind
 from talesbot.config import config
 from talesbot.errors import ReportError
+from talesbot.ui.chat_history import LoadEarlierButton
 from talesbot.ui.register import RegisterView
 
 clear_all = config.CLEAR_ALL
@@ -33,9 +39,27 @@ destroy_all = config.DESTROY_ALL
 
 logger = logging.getLogger(__name__)
 cmd_logger = logging.getLogger("talesbot.messages")
+slow_cmd_logger = logging.getLogger("talesbot.slow_commands")
+
+# Discord drops interactions that are not responded to or deferred in time
+interaction_deadline = 3
 
 
 class TalesCommandTree(discord.app_commands.CommandTree):
+    async def _call(self, interaction: discord.Interaction[discord.Client]) -> None:
+        # Wraps the whole dispatch (checks, command and error handling), so that
+        # the REST calls and storage ops made on the way count for the command
+        if interaction.type is not discord.InteractionType.application_command:
+            await super()._call(interaction)
+            return
+        stats = metrics.CommandStats()
+        token = metrics.current_command.set(stats)
+        try:
+            await super()._call(interaction)
+        finally:
+            metrics.current_command.reset(token)
+            record_command_stats(interaction, stats)
+
     async def on_error(
         self, interaction: discord.Interaction[discord.Client], error: Exception
     ) -> None:
@@ -86,13 +110,55 @@ class TalesCommandTree(discord.app_commands.CommandTree):
                 await super().on_error(interaction, error)
 
 
+def record_command_stats(
+    interaction: discord.Interaction[discord.Client], stats: metrics.CommandStats
+):
+    command = interaction.command
+    name = command.qualified_name if command is not None else "unknown"
+    wall_time = time.perf_counter() - stats.start
+    metrics.command_seconds.observe(wall_time, name)
+    if stats.acked is not None:
+        metrics.command_ack_seconds.observe(stats.acked, name)
+    metrics.command_rest_calls.inc(name, amount=stats.rest_calls)
+    metrics.command_storage_ops.inc(name, "read", amount=stats.storage_reads)
+    metrics.command_storage_ops.inc(name, "write", amount=stats.storage_writes)
+
+    # A 404 on the callback means Discord had already given up on the interaction
+    time_to_ack = stats.acked if stats.acked is not None else wall_time
+    missed_deadline = time_to_ack >= interaction_deadline or stats.ack_status == 404
+    if missed_deadline:
+        metrics.command_missed_deadline.inc(name)
+        logger.warning(
+            f"/{name} did not acknowledge the interaction within "
+            f"{interaction_deadline}s, it should defer"
+        )
+
+    if wall_time >= config.SLOW_COMMAND_THRESHOLD or missed_deadline:
+        # Only the argument names and types, the values can be private
+        args = ", ".join(
+            f"{arg}=<{type(value).__name__}>" for arg, value in interaction.namespace
+        )
+        acked = f"{stats.acked:.3f}s" if stats.acked is not None else "never"
+        slow_cmd_logger.warning(
+            f"/{name}({args}) took {wall_time:.3f}s, acknowledged after {acked}, "
+            f"{stats.rest_calls} REST calls, {stats.storage_reads} conf reads, "
+            f"{stats.storage_writes} conf writes"
+        )
+
+
 class TalesBot(commands.Bot):
     def __init__(self, *args, inital_extensions: list[str], **kwargs):
-        super().__init__(*args, tree_cls=TalesCommandTree, **kwargs)
+        super().__init__(
+            *args,
+            tree_cls=TalesCommandTree,
+            http_trace=metrics.discord_trace_config(),
+            **kwargs,
+        )
         self.inital_extensions = inital_extensions
 
     async def setup_hook(self) -> None:
         self.add_view(RegisterView())
+        self.add_dynamic_items(LoadEarlierButton)
 
         for ext in self.inital_extensions:
             await self.load_extension(ext)
@@ -127,6 +193,7 @@ class TalesBot(commands.Bot):
         logger.debug("Initialization complete.")
         game.start_game()
 
+    @metrics.timed("bot.on_message")
     async def on_message(self, message: discord.Message) -> None:
         if message.author.bot:
             # Never react to bot's own message to avoid loops
@@ -136,15 +203,35 @@ class TalesBot(commands.Bot):
         if not isinstance(channel, GuildChannel):
             return
 
-        if channels.is_offline_channel(channel):
+        kind = channels.get_channel_kind(channel)
+        if kind == ChannelKind.Offline:
             # No bot shenanigans in the off channel
             return
 
+        chat_connection = (
+            chats.read_chat_connection_from_channel(channel.guild.id, str(channel.id))
+            if kind == ChannelKind.Chat
+            else None
+        )
+
         try:
             player_name = players.get_player_id(str(message.author.id), False)
+            # The handle is only looked up when there is an archive to put it in
+            extra = (
+                archive.archive_fields(
+                    message.author.id,
+                    player_name,
+                    get_posting_handle(kind, chat_connection, player_name),
+                    channel.name,
+                    message.content,
+                )
+                if archive.get_archive_handler() is not None
+                else None
+            )
             cmd_logger.info(
                 f"{message.author.id} : {player_name} : "
-                f"{channel.name} : {message.content}"
+                f"{channel.name} : {message.content}",
+                extra=extra,
             )
         except Exception:
             logger.exception("Failed to log command to file")
@@ -154,14 +241,14 @@ class TalesBot(commands.Bot):
         # await server.swallow(message, alert=False)
         # return
 
-        if channels.is_cmd_line(channel.name):
+        if kind == ChannelKind.CmdLine:
             if only_off_messages and not has_chat_command(message):
                 await server.swallow(message, alert=False)
                 return
             await self.process_commands(message)
             return
 
-        if channels.is_chat_hub(channel.name) or channels.is_landing_page(channel.name):
+        if kind in (ChannelKind.ChatHub, ChannelKind.LandingPage):
             if only_off_messages and not has_chat_command(message):
                 await server.swallow(message, alert=False)
                 return
@@ -170,7 +257,7 @@ class TalesBot(commands.Bot):
             # so we must check for it specifically since
             # we want it to work in cmd_line but not in chat_hub
             if has_help_command(message):
-                should_alert = not channels.is_landing_page(channel.name)
+                should_alert = kind != ChannelKind.LandingPage
                 await server.swallow(message, alert=should_alert)
             else:
                 # All our commands know if they are usable in chat hub or not,
@@ -186,18 +273,17 @@ class TalesBot(commands.Bot):
 
         if only_off_messages:
             # Only chats with certain handles are okay
-            allowed = channels.is_chat_channel(
+            allowed = kind == ChannelKind.Chat and game.is_out_of_game_chat(
                 message.channel
-            ) and game.is_out_of_game_chat(message.channel)
+            )
             if not allowed:
                 await server.swallow(message, alert=False)
                 return
 
-        alert_checking = asyncio.create_task(
-            game.check_alerts(message.content, message.channel, str(message.author.id))
+        key, key_kind = get_dispatch_key(channel, chat_connection)
+        await dispatch.dispatcher.run(
+            key, lambda: handle_message(message, kind, chat_connection), key_kind
         )
-        processing = asyncio.create_task(process_message(message))
-        await asyncio.gather(alert_checking, processing)
 
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         assert self.user is not None
@@ -206,7 +292,7 @@ class TalesBot(commands.Bot):
             return
 
         channel = await self.fetch_channel(payload.channel_id)
-        if channels.is_offline_channel(channel):
+        if channels.get_channel_kind(channel) == ChannelKind.Offline:
             # No bot shenanigans in the off channels
             return
 
@@ -214,6 +300,15 @@ class TalesBot(commands.Bot):
             payload.message_id, payload.user_id, channel, payload.emoji
         )
 
+    async def on_guild_channel_update(self, before: GuildChannel, after: GuildChannel):
+        channels.forget_channel_kind(after.id)
+        if isinstance(after, discord.CategoryChannel):
+            for channel in after.channels:
+                channels.forget_channel_kind(channel.id)
+
+    async def on_guild_channel_delete(self, channel: GuildChannel):
+        channels.forget_channel_kind(channel.id)
+
     async def on_member_join(self, member: discord.Member):
         await server.set_user_as_new_player(member)
 
@@ -257,31 +352,64 @@ class TalesBot(commands.Bot):
                     await role.delete()
 
 
-async def process_message(message):
-    if channels.is_anonymous_channel(message.channel):
-        await posting.process_open_message(message, True)
-        return
+def get_dispatch_key(
+    channel: GuildChannel, chat_connection: chats.ChatConnectionMapping | None
+) -> tuple[str, str]:
+    """What messages in `channel` are kept in order with, and the kind of key"""
+    if chat_connection is not None:
+        # All participants' channels together, they share the post headers
+        return f"chat:{chat_connection.chat_name}", "chat"
+    # Mirrored channels share their post headers by name
+    return f"channel:{channel.name}", "channel"
+
 
-    if channels.is_pseudonymous_channel(message.channel):
+async def handle_message(
+    message, kind: ChannelKind, chat_connection: chats.ChatConnectionMapping | None
+):
+    alert_checking = asyncio.create_task(
+        game.check_alerts(message.content, message.channel, str(message.author.id))
+    )
+    processing = asyncio.create_task(process_message(message, kind, chat_connection))
+    await asyncio.gather(alert_checking, processing)
+
+
+async def process_message(
+    message, kind: ChannelKind, chat_connection: chats.ChatConnectionMapping | None
+):
+    if kind == ChannelKind.Anonymous:
+        await posting.process_open_message(message, True)
+    elif kind == ChannelKind.Pseudonymous:
         await posting.process_open_message(message)
+    elif kind == ChannelKind.Chat:
+        await chats.process_message(message, chat_connection)
+
+
+def get_posting_handle(
+    kind: ChannelKind,
+    chat_connection: chats.ChatConnectionMapping | None,
+    player_id: str | None,
+) -> str | None:
+    """The handle that a message from `player_id` in a channel of `kind` is
+    posted as"""
+    if kind == ChannelKind.Chat:
+        return chat_connection.handle if chat_connection is not None else None
+    if player_id is None or kind == ChannelKind.Anonymous:
+        return None
+    return handles.get_active_handle_id(player_id)
+
 
-    if channels.is_chat_channel(message.channel):
-        await chats.process_message(message)
+any_command_regex = re.compile(r"\.[a-z]+")
+help_command_regex = re.compile(r"\.help")
+chat_command_regex = re.compile(r"\.(chat|gm_chat)")
 
 
 def has_any_command(message):
-    matches = re.search(r"^\.[a-z]+", message.content)
-    return matches is not None
+    return any_command_regex.match(message.content) is not None
 
 
 def has_help_command(message):
-    matches = re.search(r"^\.help", message.content)
-    return matches is not None
+    return help_command_regex.match(message.content) is not None
 
 
 def has_chat_command(message):
-    matches = re.search(r"^\.chat", message.content)
-    if matches is not None:
-        return True
-    matches = re.search(r"^\.gm_chat", message.content)
-    return matches is not None
+    return chat_command_regex.match(message.content) is not None
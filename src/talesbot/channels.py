@@ -1,11 +1,16 @@
 import asyncio
+import atexit
+import contextlib
+import contextvars
 import datetime
 import logging
 import os
+import time
+from dataclasses import dataclass
+from enum import StrEnum
 from typing import Optional
 
 import discord
-from configobj import ConfigObj
 from discord.ext import commands
 
 from . import players, server
@@ -25,6 +30,7 @@ from .common import (
 )
 from .config import config, config_dir
 from .custom_types import PostTimestamp
+from .storage import ConfigObj
 from .ui.register import RegisterView
 
 ### Module channels.py
@@ -39,6 +45,7 @@ post_counter_index = "___post_counter"
 slowmode_delay: int = 2
 
 # Channel state: this is the state of the channel, independent of the handles used in it.
+# It is kept in post_header_states, and channel_states.conf is a snapshot of it.
 
 channel_states = ConfigObj(str(config_dir / "channel_states.conf"))
 logger = logging.getLogger(__name__)
@@ -133,6 +140,55 @@ def is_anonymous_channel(discord_channel):
     return discord_channel.name == public_anon_channel_name
 
 
+class ChannelKind(StrEnum):
+    """What on_message does with messages in a channel"""
+
+    Offline = "offline"
+    CmdLine = "cmd_line"
+    ChatHub = "chat_hub"
+    LandingPage = "landing_page"
+    Anonymous = "anonymous"
+    Pseudonymous = "pseudonymous"
+    Chat = "chat"
+    Other = "other"
+
+
+# Channel ID -> kind. A kind only depends on the channel's name and category,
+# so it is worked out once, and forgotten when the channel is changed.
+channel_kinds: dict[int, ChannelKind] = {}
+
+
+def classify_channel(discord_channel) -> ChannelKind:
+    # In the order on_message checks them
+    if is_offline_channel(discord_channel):
+        return ChannelKind.Offline
+    if is_cmd_line(discord_channel.name):
+        return ChannelKind.CmdLine
+    if is_chat_hub(discord_channel.name):
+        return ChannelKind.ChatHub
+    if is_landing_page(discord_channel.name):
+        return ChannelKind.LandingPage
+    if is_anonymous_channel(discord_channel):
+        return ChannelKind.Anonymous
+    if is_pseudonymous_channel(discord_channel):
+        return ChannelKind.Pseudonymous
+    if is_chat_channel(discord_channel):
+        return ChannelKind.Chat
+    return ChannelKind.Other
+
+
+def get_channel_kind(discord_channel) -> ChannelKind:
+    kind = channel_kinds.get(discord_channel.id)
+    if kind is None:
+        kind = classify_channel(discord_channel)
+        channel_kinds[discord_channel.id] = kind
+    return kind
+
+
+def forget_channel_kind(channel_id: int):
+    channel_kinds.pop(channel_id, None)
+
+
 def get_discord_channels_from_name(channel_name: str):
     return [
         ch
@@ -167,6 +223,7 @@ async def delete_discord_channel(channel_id: str, guild_id: Optional[int] = None
 
 
 async def init(bot: commands.Bot):
+    post_header_states.clear()
     for elem in channel_states:
         del channel_states[elem]
     channel_states.write()
@@ -252,10 +309,8 @@ async def _verify_channel_exists(category: discord.CategoryChannel, channel_name
 async def _init_channel_state(discord_channel: GuildChannel):
     await discord_channel.edit(slowmode_delay=slowmode_delay)
     channel_name = discord_channel.name
-    channel_states[
-        channel_name
-    ] = {}  # TODO: How does this work with guilds joining on-the-fly?
-    channel_states.write()
+    # TODO: How does this work with guilds joining on-the-fly?
+    _clear_post_header_state(channel_name)
 
 
 async def _set_base_permissions(
@@ -336,67 +391,102 @@ def get_public_anon_channels():
 ### Utilities related to pseudonymous channels, i.e. ones where all messages are reposted using handle
 
 
-def _init_pseudonymous_channel(channel_name: str):
-    _set_last_poster(channel_name, "")
-    timestamp: PostTimestamp = PostTimestamp.from_datetime(datetime.datetime.today())
-    _set_last_full_post(channel_name, timestamp)
-    _reset_post_counter(channel_name)
+# Whether a post gets a header (poster and time) depends on who posted last, the
+# minute of the last header and how many posts have gone without one. That is
+# checked for every message, so it is only kept in memory, and written to
+# channel_states.conf at most every snapshot_interval seconds and on exit.
+# All of it runs on the event loop without awaiting, so it needs no locks.
+full_post_limit = 10
+snapshot_interval = 60
 
 
-def _set_last_poster(channel_name: str, poster_id: str):
-    channel_states[channel_name][last_poster_index] = poster_id
-    channel_states.write()
+@dataclass(slots=True)
+class PostHeaderState:
+    last_poster: str = ""
+    # Hour and minute of the last post with a header
+    last_full_post: tuple[int, int] = (0, 0)
+    post_counter: int = 0
 
 
-def _get_last_poster(channel_name: str):
-    if last_poster_index not in channel_states[channel_name]:
-        return ""
-    else:
-        return channel_states[channel_name][last_poster_index]
+post_header_states: dict[str, PostHeaderState] = {}
+# Only processes that have changed anything write a snapshot, so that an API
+# worker exiting does not overwrite the bot's
+post_headers_changed = False
+last_snapshot = time.monotonic()
 
 
-def _get_last_post_time(channel_name: str):
-    return PostTimestamp.from_string(channel_states[channel_name][last_full_post_index])
-
-
-def _set_last_full_post(channel_name: str, timestamp: PostTimestamp):
-    channel_states[channel_name][last_full_post_index] = timestamp.to_string()
-    channel_states.write()
-
-
-def _time_has_passed_since_last_full_post(channel_name: str, timestamp):
-    post_time = PostTimestamp(timestamp.hour, timestamp.minute)
-    old_time = _get_last_post_time(channel_name)
-    return post_time != old_time
+def _init_pseudonymous_channel(channel_name: str):
+    global post_headers_changed
+    post_headers_changed = True
+    timestamp: PostTimestamp = PostTimestamp.from_datetime(datetime.datetime.today())
+    post_header_states[channel_name] = PostHeaderState(
+        last_full_post=(timestamp.hour, timestamp.minute)
+    )
 
 
-def _increment_post_counter(channel_name: str):
-    count = int(channel_states[channel_name][post_counter_index])
-    count += 1
-    channel_states[channel_name][post_counter_index] = str(count)
+def _clear_post_header_state(channel_name: str):
+    global post_headers_changed
+    post_headers_changed = True
+    post_header_states.pop(channel_name, None)
+    channel_states.pop(channel_name, None)
+
+
+def _get_post_header_state(channel_name: str) -> PostHeaderState:
+    state = post_header_states.get(channel_name)
+    if state is None:
+        # Left by an earlier run (when channels are not re-initialized)
+        section = channel_states.get(channel_name, {})
+        state = PostHeaderState()
+        state.last_poster = section.get(last_poster_index, "")
+        if last_full_post_index in section:
+            timestamp = PostTimestamp.from_string(section[last_full_post_index])
+            state.last_full_post = (timestamp.hour, timestamp.minute)
+        state.post_counter = int(section.get(post_counter_index, 0))
+        post_header_states[channel_name] = state
+    return state
+
+
+def snapshot_post_header_states():
+    global last_snapshot, post_headers_changed
+    last_snapshot = time.monotonic()
+    if not post_headers_changed:
+        return
+    post_headers_changed = False
+    for channel_name, state in post_header_states.items():
+        hour, minute = state.last_full_post
+        channel_states[channel_name] = {
+            last_poster_index: state.last_poster,
+            last_full_post_index: PostTimestamp(hour, minute).to_string(),
+            post_counter_index: str(state.post_counter),
+        }
     channel_states.write()
-    return count >= 10
 
 
-def _reset_post_counter(channel_name: str):
-    channel_states[channel_name][post_counter_index] = str(0)
-    channel_states.write()
+atexit.register(snapshot_post_header_states)
 
 
 # Returns True if the new post should be a full post (with sender and timestamp header)
 # Returns False if the new post should only include the content itself
 def record_new_post(channel_name: str, poster_id: str, timestamp: PostTimestamp):
-    last_poster = _get_last_poster(channel_name)
-    time_has_passed = _time_has_passed_since_last_full_post(channel_name, timestamp)
-    counter_has_passed_limit = _increment_post_counter(channel_name)
-
-    if last_poster != poster_id or time_has_passed or counter_has_passed_limit:
-        _set_last_poster(channel_name, poster_id)
-        _set_last_full_post(channel_name, timestamp)
-        _reset_post_counter(channel_name)
-        return True
+    global post_headers_changed
+    post_headers_changed = True
+    state = _get_post_header_state(channel_name)
+    post_time = (timestamp.hour, timestamp.minute)
+    state.post_counter += 1
+
+    full_post = (
+        state.last_poster != poster_id
+        or state.last_full_post != post_time
+        or state.post_counter >= full_post_limit
+    )
+    if full_post:
+        state.last_poster = poster_id
+        state.last_full_post = post_time
+        state.post_counter = 0
 
-    return False
+    if time.monotonic() - last_snapshot >= snapshot_interval:
+        snapshot_post_header_states()
+    return full_post
 
 
 ### Private channels:
@@ -545,14 +635,18 @@ async def get_all_groups_channels(channel_suffix: str = None):
 
 
 def init_chat_channel(channel_name: str):
-    channel_states[channel_name] = {}
-    channel_states.write()
     _init_pseudonymous_channel(channel_name)
 
 
 async def create_chat_session_channel_no_role(
     guild, discord_channel_name: str, read_only: bool = False, category_index: int = 0
 ):
+    if not read_only:
+        channel = await claim_pooled_chat_channel(
+            guild, discord_channel_name, category_index
+        )
+        if channel is not None:
+            return channel
     base_overwrites = server.generate_base_overwrites(
         guild, private=True, read_only=read_only
     )
@@ -565,6 +659,7 @@ async def create_chat_session_channel_no_role(
 
 
 async def delete_all_chats():
+    chat_channel_pools.clear()
     channel_list = await get_all_chat_channels()
     task_list = (asyncio.create_task(c.delete()) for c in channel_list)
     await asyncio.gather(*task_list)
@@ -575,6 +670,153 @@ async def get_all_chat_channels():
     return [c for c in channel_list if is_chat_channel(c)]
 
 
+### Pool of chat session channels
+# Creating a channel for a chat session takes a few requests, so each chats
+# category keeps config.CHAT_CHANNEL_POOL_SIZE hidden channels ready. Opening a
+# session renames one of them, and closing a session hides the channel again
+# and puts it back in the pool.
+
+pooled_chat_channel_name = "unused_chat"
+# Discord only allows renaming a channel twice in ten minutes
+rename_limit = 2
+rename_period = 600
+# Channels with longer histories than this are deleted instead of recycled
+recycle_purge_limit = 100
+
+# (guild ID, category index) -> channel IDs
+chat_channel_pools: dict[tuple[int, int], list[int]] = {}
+chat_channel_renames: dict[int, list[float]] = {}
+filling_pools: set[tuple[int, int]] = set()
+pool_tasks: set[asyncio.Task] = set()
+
+
+def _run_in_background(coro):
+    # In a fresh context, so that the requests it makes are not counted against
+    # the command that happened to start it
+    task = asyncio.create_task(coro, context=contextvars.Context())
+    pool_tasks.add(task)
+    task.add_done_callback(pool_tasks.discard)
+
+
+def _chats_category_index(discord_channel) -> int | None:
+    if discord_channel.category is None:
+        return None
+    suffix = discord_channel.category.name.removeprefix(chats_category_base)
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _can_rename(channel_id: int) -> bool:
+    now = time.monotonic()
+    renames = [
+        t for t in chat_channel_renames.get(channel_id, []) if now - t < rename_period
+    ]
+    chat_channel_renames[channel_id] = renames
+    return len(renames) < rename_limit
+
+
+def warm_chat_channel_pools(guilds: list[discord.Guild]):
+    """Fills the pools of all chats categories in the background"""
+    for guild in guilds:
+        for category in guild.categories:
+            suffix = category.name.removeprefix(chats_category_base)
+            if category.name.startswith(chats_category_base) and suffix.isdigit():
+                _run_in_background(fill_chat_channel_pool(guild, int(suffix)))
+
+
+async def fill_chat_channel_pool(guild: discord.Guild, category_index: int):
+    key = (guild.id, category_index)
+    if key in filling_pools:
+        return
+    filling_pools.add(key)
+    try:
+        category = discord.utils.find(
+            lambda cat: cat.name == f"{chats_category_base}{category_index}",
+            guild.categories,
+        )
+        pool = chat_channel_pools.setdefault(key, [])
+        while len(pool) < config.CHAT_CHANNEL_POOL_SIZE:
+            channel = await guild.create_text_channel(
+                pooled_chat_channel_name,
+                overwrites=server.generate_base_overwrites(
+                    guild, private=True, read_only=False
+                ),
+                category=category,
+                slowmode_delay=slowmode_delay,
+            )
+            pool.append(channel.id)
+    except discord.HTTPException:
+        # E.g. when the category is full
+        logger.warning(f"Could not fill the chat channel pool for {key}", exc_info=True)
+    finally:
+        filling_pools.discard(key)
+
+
+async def claim_pooled_chat_channel(
+    guild: discord.Guild, discord_channel_name: str, category_index: int
+):
+    """Takes a hidden channel from the pool and names it, or returns None if
+    there is none that can be renamed right now"""
+    pool = chat_channel_pools.get((guild.id, category_index), [])
+    channel = None
+    for channel_id in list(pool):
+        if not _can_rename(channel_id):
+            continue
+        pool.remove(channel_id)
+        channel = guild.get_channel(channel_id)
+        if channel is not None:
+            break
+    if config.CHAT_CHANNEL_POOL_SIZE > 0:
+        _run_in_background(fill_chat_channel_pool(guild, category_index))
+    if channel is None:
+        return None
+
+    chat_channel_renames[channel.id].append(time.monotonic())
+    await channel.edit(name=discord_channel_name)
+    _clear_post_header_state(discord_channel_name)
+    return channel
+
+
+async def recycle_chat_session_channel(channel_id: str, guild_id: int | None = None):
+    """Hides a chat session channel and empties it to be used again, or
+    deletes it if the pool is full"""
+    channel = get_discord_channel(channel_id, guild_id)
+    if channel is None:
+        return
+    category_index = _chats_category_index(channel)
+    key = (channel.guild.id, category_index)
+    pool = chat_channel_pools.get(key, [])
+    if category_index is None or len(pool) >= config.CHAT_CHANNEL_POOL_SIZE:
+        chat_channel_renames.pop(channel.id, None)
+        await channel.delete()
+        return
+    # Replacing all the overwrites also takes away the actor's access
+    await channel.edit(
+        overwrites=server.generate_base_overwrites(
+            channel.guild, private=True, read_only=False
+        )
+    )
+    _run_in_background(_empty_and_return_to_pool(channel, key))
+
+
+async def _empty_and_return_to_pool(channel, key: tuple[int, int]):
+    try:
+        deleted = await channel.purge(limit=recycle_purge_limit)
+        pool = chat_channel_pools.setdefault(key, [])
+        if len(deleted) >= recycle_purge_limit or len(pool) >= (
+            config.CHAT_CHANNEL_POOL_SIZE
+        ):
+            chat_channel_renames.pop(channel.id, None)
+            await channel.delete()
+        else:
+            pool.append(channel.id)
+    except discord.HTTPException:
+        logger.warning(f"Failed to recycle chat channel {channel.id}", exc_info=True)
+        # Not in the pool, so nothing would ever reuse or remove it
+        chat_channel_renames.pop(channel.id, None)
+        with contextlib.suppress(discord.HTTPException):
+            await channel.delete()
+
+
 ### Shop channels:
 # These are public (open to all players) but read-only
 # The idea is that the channel holds the menu items as messages, and players can react to place their orders
@@ -0,0 +1,140 @@
+### Module chat_search.py
+# In-memory inverted index over the chat logs, for GMs looking for a
+# conversation. Each chat is one document, ranked with BM25. New log entries
+# are only queued when they are written, and tokenized when someone searches,
+# so indexing costs nothing while messages are being delivered. Building and
+# searching are meant to run in a worker thread, one at a time.
+
+import math
+import re
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+token_pattern = re.compile(r"\w+")
+
+# BM25 parameters
+k1 = 1.2
+b = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return token_pattern.findall(text.lower())
+
+
+@dataclass
+class ChatDocument:
+    length: int = 0
+    # Log entries that have been indexed, so that an entry read while
+    # building the index and also queued is only counted once
+    entries: set[int] = field(default_factory=set)
+
+
+@dataclass
+class SearchResult:
+    chat_name: str
+    score: float
+    # Log entries with the most query terms first
+    entries: list[int]
+
+
+class ChatSearchIndex:
+    def __init__(self):
+        # term -> chat name -> log entries with the term (once per occurrence)
+        self.postings: dict[str, dict[str, list[int]]] = {}
+        self.documents: dict[str, ChatDocument] = {}
+        self.total_length = 0
+        self.pending: deque[tuple[str, int, str]] = deque()
+        # Entries are only queued once the index is being built, before that
+        # they are read from the chat logs by the build
+        self.building = False
+        self.built = False
+
+    def clear(self):
+        self.postings = {}
+        self.documents = {}
+        self.total_length = 0
+        self.pending.clear()
+        self.building = False
+        self.built = False
+
+    def add_later(self, chat_name: str, index: int, text: str):
+        """Queues a new log entry. Cheap enough to do while posting."""
+        if self.building or self.built:
+            self.pending.append((chat_name, index, text))
+
+    def add(self, chat_name: str, index: int, text: str):
+        document = self.documents.setdefault(chat_name, ChatDocument())
+        if index in document.entries:
+            return
+        document.entries.add(index)
+        tokens = tokenize(text)
+        document.length += len(tokens)
+        self.total_length += len(tokens)
+        for token in tokens:
+            self.postings.setdefault(token, {}).setdefault(chat_name, []).append(index)
+
+    def index_pending(self):
+        while self.pending:
+            self.add(*self.pending.popleft())
+
+    def search(self, query: str, limit: int = 10) -> list[SearchResult]:
+        self.index_pending()
+        terms = set(tokenize(query))
+        if len(terms) == 0 or len(self.documents) == 0:
+            return []
+
+        average_length = self.total_length / len(self.documents)
+        scores: Counter[str] = Counter()
+        matches: dict[str, Counter[int]] = {}
+        for term in terms:
+            chats = self.postings.get(term, {})
+            if len(chats) == 0:
+                continue
+            idf = math.log(
+                1 + (len(self.documents) - len(chats) + 0.5) / (len(chats) + 0.5)
+            )
+            for chat_name, entries in chats.items():
+                frequency = len(entries)
+                length = self.documents[chat_name].length
+                scores[chat_name] += (
+                    idf
+                    * frequency
+                    * (k1 + 1)
+                    / (frequency + k1 * (1 - b + b * length / average_length))
+                )
+                # Entries count once per term, to find those with the most terms
+                matches.setdefault(chat_name, Counter()).update(set(entries))
+
+        return [
+            SearchResult(
+                chat_name,
+                score,
+                [entry for entry, _count in matches[chat_name].most_common()],
+            )
+            for chat_name, score in scores.most_common(limit)
+        ]
+
+
+def snippet(text: str, query: str, width: int = 120) -> str:
+    """The part of `text` around the first query term, with the terms in bold"""
+    # Drop the bold from post headers, it would get mixed up with ours
+    text = text.replace("**", "")
+    terms = set(tokenize(query))
+    words = list(token_pattern.finditer(text))
+    first = next((w for w in words if w.group().lower() in terms), None)
+    start = 0 if first is None else max(0, first.start() - width // 3)
+    end = min(len(text), start + width)
+    parts = []
+    position = start
+    for word in words:
+        if word.start() < start or word.end() > end:
+            continue
+        if word.group().lower() in terms:
+            parts.append(text[position : word.start()])
+            parts.append(f"**{word.group()}**")
+            position = word.end()
+    parts.append(text[position:end])
+    result = "".join(parts).replace("\n", " ")
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return f"{prefix}{result}{suffix}"
@@ -1,16 +1,25 @@
 import asyncio
 import logging
+from collections import Counter, OrderedDict, deque
+from collections.abc import Iterable
 from enum import Enum
 
 import discord
 import simplejson
-from configobj import ConfigObj
-from discord import Interaction, app_commands
-from discord.ext import commands
-
-from talesbot import checks, gm
-
-from . import actors, channels, game, handles, players, posting
+from discord import Interaction
+
+from . import (
+    actors,
+    channels,
+    chat_search,
+    events,
+    game,
+    handles,
+    metrics,
+    players,
+    posting,
+    server,
+)
 from .common import (
     emoji_cancel,
     emoji_green,
@@ -20,8 +29,10 @@ from .common import (
     emoji_red_book,
     emoji_unread,
 )
-from .config import config_dir
+from .config import config, config_dir
 from .custom_types import Handle, PostTimestamp
+from .storage import ConfigObj
+from .ui.chat_history import LoadEarlierView
 
 ### Module chats.py
 # This module handles chats between handles
@@ -29,171 +40,46 @@ from .custom_types import Handle, PostTimestamp
 logger = logging.getLogger(__name__)
 
 
-class ChatsCog(commands.Cog, name="chats"):
-    """Commands related to chats.
-    These are private conversations between two different handles."""
-
-    def __init__(self, bot):
-        self.bot = bot
-        self._last_member = None
-
-    # TODO: swallow messages (and post alerts) when trying to use commands in chat channel
-
-    # Commands related to chats
-    # These only work in cmd_line channels
-
-    @app_commands.command(
-        name="chat",
-        description="Open a chat session with another user.",
-        # 		help=(
-        # 			'Open a chat session between you (using your current handle) and another user. ' +
-        # 			'If you have never had a chat between those two handles before, one will be created. ' +
-        # 			'All your active chats are shown in your personal chat_hub channel, where you can open and ' +
-        # 			'close the connections as needed.\n' +
-        # 			'You can close a chat and re-open it and all the chat history will be stored, except for file attachments. ' +
-        # 			'Note: you cannot change your handle in an existing chat, so make sure to start the chat from the correct one! ' +
-        # 			'If you switch handles and open a new chat, the other person can see that two handles have tried to contact them, ' +
-        # 			'but they will not see that they belong to the same person.'
-        # 		)
-    )
-    async def chat_command(self, interaction: Interaction, handle: str):
-        if handle is None:
-            response = 'Error: you must say who you want to chat with. Example: "/chat shadow_weaver"'
-            await interaction.response.send_message(response, ephemeral=True)
-        else:
-            await interaction.response.defer(ephemeral=True)
-            handle = handle.lower()
-            response = await create_chat_from_command(str(interaction.user.id), handle)
-            if response is not None:
-                await interaction.followup.send(response, ephemeral=True)
-            else:
-                await interaction.followup.send(
-                    "Unknown error. Contact system admin.", ephemeral=True
-                )
-
-    @app_commands.command(
-        name="chat_other",
-        description="Admin only. Open a chat session for someone else.",
-    )
-    @checks.is_gm
-    async def chat_other_command(
-        self, interaction: Interaction, from_handle: str, to_handle: str
-    ):
-        if from_handle is None:
-            await interaction.response.send_message(
-                "Error: you must give two handles to start a chat.", ephemeral=True
-            )
-            return
-        elif to_handle is None:
-            report = f"Error: you must give the second handle that should chat with {from_handle}."
-            await interaction.response.send_message(report, ephemeral=True)
-            return
-
-        await interaction.response.defer(ephemeral=True)
-        from_handle = from_handle.lower()
-        to_handle = to_handle.lower()
-        report = await create_2party_chat_from_handle_id(from_handle, to_handle)
-        if report is not None:
-            await interaction.followup.send(report, ephemeral=True)
-        else:
-            await interaction.followup.send(
-                "Unknown error. Contact system admin.", ephemeral=True
-            )
-
-    @app_commands.command(
-        name="gm_chat",
-        description="GM only. Open a chat session from the shared GM account.",
-    )
-    @checks.is_gm
-    async def gm_chat_command(self, interaction: Interaction, other_handle: str):
-        if other_handle is None:
-            report = "Error: you must give the handle to chat with."
-            await interaction.response.send_message(report, ephemeral=True)
-            return
-
-        await interaction.response.defer(ephemeral=True)
-        my_handle = gm.get_gm_active_handle()
-        other_handle = other_handle.lower()
-        report = await create_2party_chat_from_handle_id(my_handle, other_handle)
-        if report is not None:
-            await interaction.followup.send(report, ephemeral=True)
-        else:
-            await interaction.followup.send(
-                "Unknown error. Contact system admin.", ephemeral=True
-            )
-
-    @app_commands.command(
-        name="close_chat",
-        description="Close a chat session from your end.",
-        # 		help=(
-        # 			'Close a chat session from your end. This will not affect how the other participant sees the chat. ' +
-        # 			f'You can re-open the chat at any time using \"/chat\", or by clicking the {emoji_open} in your chat_hub.'
-        # 			)
-    )
-    async def close_chat_command(self, interaction: Interaction, handle: str):
-        if handle is None:
-            response = 'Error: you must say which chat you want to close. Example: "/close_chat shadow_weaver"'
-            await interaction.response.send_message(response, ephemeral=True)
-        else:
-            await interaction.response.defer(ephemeral=True)
-            handle = handle.lower()
-            response = await close_chat_session_from_command(
-                interaction.user.id, handle
-            )
-            if response is not None:
-                await interaction.followup.send(response, ephemeral=True)
-            else:
-                await interaction.followup.send(
-                    "Unknown error. Contact system admin.", ephemeral=True
-                )
+chats_dir = "chats"
+chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
 
-    @app_commands.command(
-        name="close_chat_other",
-        description="Admin-only. Close a chat session for someone else.",
-    )
-    @checks.is_gm
-    async def close_chat_other_command(
-        self, interaction: Interaction, my_handle: str, other_handle: str
-    ):
-        await interaction.response.defer(ephemeral=True)
-        my_handle = my_handle.lower()
-        other_handle = other_handle.lower()
-        report = await close_2party_chat_session_from_handle_id(my_handle, other_handle)
-        if report is not None:
-            await interaction.followup.send(report, ephemeral=True)
-        else:
-            await interaction.followup.send(
-                "Unknown error. Contact system admin.", ephemeral=True
-            )
 
-    @app_commands.command(
-        name="clear_all_chats",
-        description="Admin-only. Delete all chats and chat channels for all users.",
-    )
-    @checks.is_gm
-    async def clear_all_chats_command(self, interaction: Interaction):
-        await interaction.response.defer(ephemeral=True)
-        await init(clear_all=True)
-        await interaction.followup.send("Done.", ephemeral=True)
+channel_limit_per_actor = 5
 
+room_chat_prefix = "room-"
 
-chats_dir = "chats"
-chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
+# actor -> (chat name, handle) for the open chat sessions of each actor, with
+# the most recently active session last. An actor with several handles in one
+# chat has a session for each. All sessions are closed on init, so this does
+# not need to be kept on disk.
+active_chats: dict[str, OrderedDict[tuple[str, str], None]] = {}
 
+# Filled in from the chat logs the first time a GM searches
+search_index = chat_search.ChatSearchIndex()
+search_index_lock = asyncio.Lock()
 
-async def setup(bot):
-    global chats
-    await bot.add_cog(ChatsCog(bot))
-    chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
+# Deliveries of messages to the participants of chats run concurrently, at
+# most this many at a time across all chats
+fan_out_limit = 10
+fan_out_semaphore = asyncio.Semaphore(fan_out_limit)
 
+# (chat name, handle) -> held while posting to that participant, so that the
+# messages of a chat reach each participant in order. Only kept while some
+# delivery is using or waiting for it.
+delivery_locks: dict[tuple[str, str], asyncio.Lock] = {}
+delivery_lock_users: Counter[tuple[str, str]] = Counter()
 
-channel_limit_per_actor = 5
+# chat name -> handle -> participant string, so that finding the participants
+# does not mean reading the whole chat log. Written through by store_participant.
+participants_cache: dict[str, dict[str, str]] = {}
 
 handle_index = "___handle"
 chat_channel_data_index = "___chat_channel_data"
 chat_hub_msg_data_index = "___chat_hub_msg_data"
 chat_content_index = "___chat_content"
 chats_with_logs_index = "___chat_log_length"
+# handle -> the chats it has taken part in
+handle_chats_index = "___handle_chats"
 chat_participants_index = "___chat_participants"
 
 session_status_active = "___active"
@@ -311,17 +197,18 @@ class Activation(str, Enum):
 def init_chats_confobj():
     global chats
     chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
-    if chat_channel_data_index not in chats:
-        chats[chat_channel_data_index] = {}
-    if chat_hub_msg_data_index not in chats:
-        chats[chat_hub_msg_data_index] = {}
-    if chats_with_logs_index not in chats:
-        chats[chats_with_logs_index] = {}
-    chats.write()
-
-
-def get_channel_budget():
-    return ConfigObj(str(config_dir / chats_dir / "channel_budget.conf"))
+    indexes = [
+        chat_channel_data_index,
+        chat_hub_msg_data_index,
+        chats_with_logs_index,
+        handle_chats_index,
+    ]
+    # Only written when something was missing, this is read for every message
+    missing = [index for index in indexes if index not in chats]
+    for index in missing:
+        chats[index] = {}
+    if len(missing) > 0:
+        chats.write()
 
 
 def dump():
@@ -333,6 +220,9 @@ def dump():
 
 async def init(clear_all: bool = False):
     init_chats_confobj()
+    search_index.clear()
+    participants_cache.clear()
+    handle_chats: dict[str, list[str]] = {}
     # Loop through all chats that are supposed to exist according to conf files
     for chat_name in chats[chats_with_logs_index]:
         chat_state = get_chat_state(chat_name)
@@ -347,11 +237,15 @@ async def init(clear_all: bool = False):
             if chat_participants_index not in chat_state:
                 init_chat_state(chat_state)
             for participant in get_participants(chat_state):
+                handle_chats.setdefault(participant.handle, []).append(chat_name)
                 # Close all chat sessions. If the discord and config files are still in sync,
                 # this will update all chat hub messages so that chats can be easily re-opened
                 await close_chat_session(participant)
     # Remove all channel mappings
     chats[chat_channel_data_index] = {}
+    chat_connections.clear()
+    # Rebuilt from the participants, in case it has gone out of sync
+    chats[handle_chats_index] = handle_chats
     if clear_all:
         chats[chat_hub_msg_data_index] = {}
         chats[chats_with_logs_index] = {}
@@ -360,11 +254,9 @@ async def init(clear_all: bool = False):
 
     # Any left-over channels after this should be deleted
     await channels.delete_all_chats()
+    channels.warm_chat_channel_pools(server.get_guilds())
 
-    chat_channel_budget = get_channel_budget()
-    for actor_id in chat_channel_budget:
-        del chat_channel_budget[actor_id]
-        chat_channel_budget.write()
+    active_chats.clear()
 
     chats.write()
 
@@ -374,20 +266,28 @@ def create_2party_chat_name(handle1: Handle, handle2: Handle):
     return f"{handles_ordered[0]}_{handles_ordered[1]}"
 
 
+# guild#channel -> chat connection. Looked up for every message in a chat
+# channel, so the connections that have been read are kept in memory, and
+# kept in step with chats.conf when they are stored or cleared.
+chat_connections: dict[str, ChatConnectionMapping] = {}
+
+
 def _get_chat_connection_key(guild_id: int, channel_id: str):
     return f"{guild_id}#{channel_id}"
 
 
 def read_chat_connection_from_channel(guild_id: int, channel_id: str):
-    init_chats_confobj()
-    chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
-
     key = _get_chat_connection_key(guild_id, channel_id)
+    if key in chat_connections:
+        return chat_connections[key]
+
+    init_chats_confobj()
     if key in chats[chat_channel_data_index]:
         string = chats[chat_channel_data_index][key]
         chat_connection: ChatConnectionMapping = ChatConnectionMapping.from_string(
             string
         )
+        chat_connections[key] = chat_connection
         return chat_connection
     else:
         return None
@@ -400,11 +300,13 @@ def store_chat_connection_for_channel(
     key = _get_chat_connection_key(guild_id, channel_id)
     chats[chat_channel_data_index][key] = chat_connection.to_string()
     chats.write()
+    chat_connections[key] = chat_connection
 
 
 def clear_channel_connection_mappings(guild_id: int, channel_id: str):
     init_chats_confobj()
     key = _get_chat_connection_key(guild_id, channel_id)
+    chat_connections.pop(key, None)
     if key in chats[chat_channel_data_index]:
         del chats[chat_channel_data_index][key]
         chats.write()
@@ -448,14 +350,24 @@ def get_chat_state(chat_name: str):
     return ConfigObj(str(config_dir / chats_dir / chat_file_name))
 
 
+def get_chat_names_for_handle(handle_id: str) -> list[str]:
+    if handle_chats_index not in chats:
+        init_chats_confobj()
+    if handle_id not in chats[handle_chats_index]:
+        return []
+    return chats[handle_chats_index].as_list(handle_id)
+
+
+def add_chat_for_handle(handle_id: str, chat_name: str):
+    chat_names = get_chat_names_for_handle(handle_id)
+    if chat_name not in chat_names:
+        chats[handle_chats_index][handle_id] = chat_names + [chat_name]
+        chats.write()
+
+
 def get_chats_for_handle(handle: Handle):
-    init_chats_confobj()
-    for msg_id in chats[chat_hub_msg_data_index]:
-        chat_connection: ChatConnectionMapping = read_chat_connection_from_hub_msg(
-            msg_id
-        )
-        if chat_connection.handle == handle.handle_id:
-            yield (chat_connection.chat_name, get_chat_state(chat_connection.chat_name))
+    for chat_name in get_chat_names_for_handle(handle.handle_id):
+        yield (chat_name, get_chat_state(chat_name))
 
 
 def get_participants(chat_state):
@@ -463,6 +375,25 @@ def get_participants(chat_state):
         yield read_participant(chat_state, participant_id)
 
 
+def get_chat_participants(chat_name: str) -> list[ChatParticipant]:
+    """Like get_participants, but from the cache instead of the chat's file"""
+    if chat_name not in participants_cache:
+        chat_state = get_chat_state(chat_name)
+        participants_cache[chat_name] = dict(
+            chat_state.get(chat_participants_index, {})
+        )
+    return [
+        ChatParticipant.from_string(string)
+        for string in participants_cache[chat_name].values()
+    ]
+
+
+def get_chat_participant(chat_name: str, handle_id: str) -> ChatParticipant | None:
+    get_chat_participants(chat_name)
+    string = participants_cache[chat_name].get(handle_id)
+    return None if string is None else ChatParticipant.from_string(string)
+
+
 def read_participant(chat_state, handle_id: str):
     if handle_id in chat_state[chat_participants_index]:
         string = chat_state[chat_participants_index][handle_id]
@@ -476,6 +407,8 @@ def store_participant(chat_name: str, participant: ChatParticipant):
     chat_state = get_chat_state(chat_name)
     chat_state[chat_participants_index][participant.handle] = participant.to_string()
     chat_state.write()
+    participants_cache[chat_name] = dict(chat_state[chat_participants_index])
+    add_chat_for_handle(participant.handle, chat_name)
 
 
 def get_log_length(chat_name: str):
@@ -483,13 +416,6 @@ def get_log_length(chat_name: str):
     return int(chats[chats_with_logs_index][chat_name])
 
 
-def increment_log_length(chat_name: str):
-    init_chats_confobj()
-    prev_length = int(chats[chats_with_logs_index][chat_name])
-    chats[chats_with_logs_index][chat_name] = str(prev_length + 1)
-    chats.write()
-
-
 # TODO: move the chat log to a separate file, so that writing an entry
 # and opening/closing a sesson don't need to interfere
 
@@ -523,9 +449,54 @@ def remove_entry_from_chat_log(chat_name: str, index: int):
 
 
 def write_new_chat_log_entry(chat_name: str, entry: ChatLogEntry):
-    next_index = get_log_length(chat_name)
+    # One read and write of chats.conf and of the chat's file per entry
+    init_chats_confobj()
+    next_index = int(chats[chats_with_logs_index][chat_name])
     store_chat_log_entry(chat_name, next_index, entry)
-    increment_log_length(chat_name)
+    chats[chats_with_logs_index][chat_name] = str(next_index + 1)
+    chats.write()
+    if entry.message is not None:
+        search_index.add_later(chat_name, next_index, entry.message)
+
+
+def index_chat_log(chat_name: str):
+    """Reads a chat log into the search index. Runs in a worker thread."""
+    chat_state = get_chat_state(chat_name)
+    for index_str, string in chat_state.get(chat_content_index, {}).items():
+        entry = ChatLogEntry.from_string(string)
+        if entry.message is not None:
+            search_index.add(chat_name, int(index_str), entry.message)
+
+
+async def build_search_index():
+    """Reads every chat log into the search index, a chat at a time in a worker
+    thread so that the event loop is not held up by parsing and tokenizing"""
+    init_chats_confobj()
+    # Entries written from now on are queued, in case their chat is already read
+    search_index.building = True
+    for chat_name in list(chats[chats_with_logs_index]):
+        await asyncio.to_thread(index_chat_log, chat_name)
+    search_index.built = True
+
+
+async def search_chat_logs(query: str, limit: int = 10):
+    """The chats that best match `query`, as (chat name, snippet) pairs"""
+    # The index is only changed by one thread at a time
+    async with search_index_lock:
+        if not search_index.built:
+            await build_search_index()
+        results = await asyncio.to_thread(search_index.search, query, limit)
+    found = []
+    for result in results:
+        chat_state = get_chat_state(result.chat_name)
+        content = chat_state.get(chat_content_index, {})
+        # Entries can have been removed from the log since they were indexed
+        entry_index = next((i for i in result.entries if str(i) in content), None)
+        if entry_index is None:
+            continue
+        entry = read_chat_log_entry(chat_state, entry_index)
+        found.append((result.chat_name, chat_search.snippet(entry.message, query)))
+    return found
 
 
 def get_participant_handle_ids(channel):
@@ -533,8 +504,7 @@ def get_participant_handle_ids(channel):
         channel.guild.id, str(channel.id)
     )
     if chat_channel_data is not None:
-        chat_state = get_chat_state(chat_channel_data.chat_name)
-        for participant in get_participants(chat_state):
+        for participant in get_chat_participants(chat_channel_data.chat_name):
             yield participant.handle
 
 
@@ -546,6 +516,7 @@ def init_chat_log(chat_name: str):
         chats.write()
         chat_state = get_chat_state(chat_name)
         init_chat_state(chat_state)
+        participants_cache.pop(chat_name, None)
         return True
     else:
         return False
@@ -570,32 +541,42 @@ def get_chat_log_length(chat_name):
 ### The channel budget
 
 
-def try_to_add_active_chat(actor_id: str):
-    chat_channel_budget = get_channel_budget()
-    if actor_id in chat_channel_budget:
-        prev_number = int(chat_channel_budget[actor_id])
-        if prev_number < channel_limit_per_actor:
-            chat_channel_budget[actor_id] = str(prev_number + 1)
-            chat_channel_budget.write()
-            return True
-        else:
-            return False
-    else:
-        chat_channel_budget[actor_id] = 1
-        chat_channel_budget.write()
+async def try_to_add_active_chat(participant: ChatParticipant):
+    sessions = active_chats.setdefault(participant.actor_id, OrderedDict())
+    session = (participant.chat_name, participant.handle)
+    if session in sessions:
+        sessions.move_to_end(session)
         return True
+    victim = None
+    if len(sessions) >= channel_limit_per_actor:
+        if not config.CHAT_EVICT_LEAST_RECENT:
+            return False
+        # Taken out of the budget right away, so that no one else picks it
+        victim, _ = sessions.popitem(last=False)
+    sessions[session] = None
+    if victim is not None:
+        await close_least_recent_chat(*victim)
+    return True
+
+
+async def close_least_recent_chat(chat_name: str, handle_id: str):
+    logger.debug(f"Closing {chat_name} for {handle_id} to make room for another chat")
+    participant = read_participant(get_chat_state(chat_name), handle_id)
+    if participant is not None:
+        await close_chat_session(participant)
 
 
-def decrease_num_active_chats(actor_id: str):
-    chat_channel_budget = get_channel_budget()
-    if actor_id in chat_channel_budget:
-        prev_number = int(chat_channel_budget[actor_id])
-        if prev_number > 0:
-            chat_channel_budget[actor_id] = str(prev_number - 1)
-            chat_channel_budget.write()
-    else:
-        chat_channel_budget[actor_id] = 0
-        chat_channel_budget.write()
+def mark_chat_activity(participant: ChatParticipant):
+    sessions = active_chats.get(participant.actor_id)
+    session = (participant.chat_name, participant.handle)
+    if sessions is not None and session in sessions:
+        sessions.move_to_end(session)
+
+
+def remove_active_chat(participant: ChatParticipant):
+    sessions = active_chats.get(participant.actor_id)
+    if sessions is not None:
+        sessions.pop((participant.chat_name, participant.handle), None)
 
 
 ### Creating a new chat
@@ -694,6 +675,121 @@ async def create_2party_chat(my_handle: Handle, partner_handle_id: str):
     return report
 
 
+### Chat rooms, with any number of participants
+
+
+def create_room_chat_name(room_name: str):
+    # Handles cannot have dashes, so this can never be the name of a 2-party chat
+    return f"{room_chat_prefix}{room_name}"
+
+
+async def create_chat_room_from_command(
+    user_id: str, room_name: str, handle_ids: list[str]
+):
+    creator_actor_id = players.get_player_id(user_id, expect_to_find=True)
+    creator_handle = handles.get_active_handle(creator_actor_id)
+    if not creator_handle.is_active():
+        return (
+            "Error: tried to open chat room but could not find active handle "
+            f"for initiator {creator_actor_id}."
+        )
+    return await create_chat_room(creator_handle, room_name, handle_ids)
+
+
+async def create_chat_room(my_handle: Handle, room_name: str, handle_ids: list[str]):
+    room_name = room_name.lower()
+    if handles.is_forbidden_handle(room_name) == handles.HandleAllowedResult.Invalid:
+        return (
+            f"Error: cannot use {room_name} as a room name. "
+            "Use only letters, numbers and underscores."
+        )
+    chat_name = create_room_chat_name(room_name)
+
+    participant_ids = [p.handle for p in get_chat_participants(chat_name)]
+    if chat_exists(chat_name) and my_handle.handle_id not in participant_ids:
+        return (
+            f"Error: there is already a room called {room_name}, "
+            f"and {my_handle.handle_id} is not in it."
+        )
+
+    new_handles: list[Handle] = []
+    for handle_id in dict.fromkeys(h.strip(",").lower() for h in handle_ids):
+        if handle_id == my_handle.handle_id or handle_id in participant_ids:
+            continue
+        handle: Handle = handles.get_handle(handle_id)
+        if not handle.is_active():
+            return (
+                f"Error: could not add {handle_id} to {room_name}; "
+                "recipient does not exist."
+            )
+        if not game.is_2party_chat_possible(my_handle.handle_id, handle_id):
+            return (
+                "```[OFF: network unavailable -- right now you can chat with gm "
+                "and similar but not others]```"
+            )
+        new_handles.append(handle)
+    if not chat_exists(chat_name) and len(new_handles) == 0:
+        return (
+            "Error: you must say who should be in the room. "
+            f'Example: "/chat_room {room_name} shadow_weaver neon_fox"'
+        )
+
+    newly_created_chat = init_chat_log(chat_name)
+    if newly_created_chat:
+        channels.init_chat_channel(chat_name)
+    chat_state = get_chat_state(chat_name)
+
+    # Only my own session is activated, the others open on the first message
+    tasks = [
+        add_participant_to_chat(
+            chat_state, chat_name, my_handle, chat_name, activation=Activation.Open
+        )
+    ] + [
+        add_participant_to_chat(chat_state, chat_name, handle, chat_name)
+        for handle in new_handles
+    ]
+    my_ui, *_ = await asyncio.gather(*tasks)
+    if my_ui.channel is None:
+        clickable_chat_hub = channels.clickable_channel_ref(
+            actors.get_chat_hub_channel(my_handle.actor_id)
+        )
+        return (
+            f"The room {room_name} is currently closed since you have too many "
+            "chat sessions open. "
+            f"You can access it from {clickable_chat_hub}, "
+            "if you close another chat first."
+        )
+
+    my_clickable_ref = channels.clickable_channel_ref(my_ui.channel)
+    report = (
+        f"Opened chat room {room_name}: {my_clickable_ref}"
+        if newly_created_chat
+        else f"Re-opened chat room {room_name}: {my_clickable_ref}"
+    )
+    if len(new_handles) > 0:
+        report += f" Added {', '.join(h.handle_id for h in new_handles)}."
+    return report
+
+
+async def close_chat_room_session_from_command(user_id: int, room_name: str):
+    my_actor_id = players.get_player_id(str(user_id))
+    my_handle = handles.get_active_handle(my_actor_id)
+    room_name = room_name.lower()
+    chat_name = create_room_chat_name(room_name)
+    participant = get_chat_participant(chat_name, my_handle.handle_id)
+    if participant is None:
+        return f"Error: {my_handle.handle_id} is not in any room called {room_name}."
+
+    failure_report = await close_chat_session(participant)
+    if failure_report is None:
+        return (
+            f"Closed chat room session {room_name}. "
+            f'To re-open, use "/chat_room {room_name}".'
+        )
+    else:
+        return failure_report
+
+
 ### Common method used both when creating and re-opening chats
 
 
@@ -792,7 +888,7 @@ async def get_chat_ui_for_inactive_session(
         in [session_status_inactive, session_status_unread]
     )
     if valid_activation_reason:
-        can_be_activated = try_to_add_active_chat(participant.actor_id)
+        can_be_activated = await try_to_add_active_chat(participant)
         if can_be_activated:
             if participant.session_status == session_status_closed_archive:
                 participant.session_status = session_status_open_archive
@@ -810,6 +906,9 @@ async def get_chat_ui_for_inactive_session(
                 guild.id, participant.channel_id, chat_connection
             )
             status_change = True
+            events.publish(
+                "chat_open", chat_name=participant.chat_name, handle=participant.handle
+            )
 
     chat_hub_message = await update_chat_hub_message(
         channel, participant, has_changed=status_change
@@ -1095,7 +1194,7 @@ async def close_chat_session(participant: ChatParticipant):
             + "but channel ID is missing. Dump: {participant.to_string()}"
         )
 
-    decrease_num_active_chats(participant.actor_id)
+    remove_active_chat(participant)
     channel_id_to_close = participant.channel_id
     guild_id = actors.get_guild_for_actor(participant.actor_id).id
 
@@ -1104,11 +1203,14 @@ async def close_chat_session(participant: ChatParticipant):
 
     # Remove channel ID -> chat mapping
     clear_channel_connection_mappings(guild_id, channel_id_to_close)
+    events.publish(
+        "chat_close", chat_name=participant.chat_name, handle=participant.handle
+    )
 
     # TODO: we could put the channel closing and the chat hub update in an asyncio.gather if we wanted
 
     # Close the session, i.e. delete the actor's discord channel
-    await channels.delete_discord_channel(channel_id_to_close, guild_id)
+    await channels.recycle_chat_session_channel(channel_id_to_close, guild_id)
 
     chat_hub_message = await update_chat_hub_message(
         None, participant, has_changed=True
@@ -1248,6 +1350,7 @@ async def post_to_participant(
                 f"Failed to reach participant of chat. Dump: {participant.to_string()}"
             )
         else:
+            mark_chat_activity(participant)
             # Send the message to the open channel
             poster_id = poster_id if full_post else None
             await posting.repost_message_to_channel(
@@ -1279,23 +1382,54 @@ async def post_to_participant(
         )
 
 
-def create_reposting_tasks(
+async def fan_out_message(
     chat_name: str, msg_data: posting.MessageData, poster_id: str, full_post: bool
 ):
-    chat_state = get_chat_state(chat_name)
-    for participant in get_participants(chat_state):
-        yield asyncio.create_task(
-            post_to_participant(chat_state, msg_data, participant, poster_id, full_post)
-        )
+    """Posts a message to every participant of the chat, at most fan_out_limit
+    deliveries at a time. Each participant gets the messages of a chat in the
+    order they were sent."""
+    # Only read if someone's channel has to be opened, for the history
+    chat_state = None
+
+    async def deliver(handle_id: str):
+        nonlocal chat_state
+        key = (chat_name, handle_id)
+        lock = delivery_locks.setdefault(key, asyncio.Lock())
+        delivery_lock_users[key] += 1
+        try:
+            # Taken in the order the messages came in, before waiting for a slot
+            async with lock, fan_out_semaphore:
+                # Read again, the previous message may have opened the channel
+                participant = get_chat_participant(chat_name, handle_id)
+                if participant is None:
+                    return
+                if (
+                    participant.session_status != session_status_active
+                    and chat_state is None
+                ):
+                    chat_state = get_chat_state(chat_name)
+                await post_to_participant(
+                    chat_state, msg_data, participant, poster_id, full_post
+                )
+        finally:
+            delivery_lock_users[key] -= 1
+            if delivery_lock_users[key] == 0:
+                del delivery_lock_users[key]
+                del delivery_locks[key]
+
+    await asyncio.gather(*[deliver(p.handle) for p in get_chat_participants(chat_name)])
 
 
-async def process_message(message):
+async def process_message(
+    message, chat_channel_data: ChatConnectionMapping | None = None
+):
     await message.delete()
 
-    sender_channel = message.channel
-    chat_channel_data: ChatConnectionMapping = read_chat_connection_from_channel(
-        sender_channel.guild.id, str(sender_channel.id)
-    )
+    if chat_channel_data is None:
+        sender_channel = message.channel
+        chat_channel_data = read_chat_connection_from_channel(
+            sender_channel.guild.id, str(sender_channel.id)
+        )
     if chat_channel_data is None:
         return
     await process_message_data(
@@ -1307,10 +1441,9 @@ async def process_message(message):
 async def auto_respond_if_needed(
     chat_channel_data: ChatConnectionMapping, message: discord.Message
 ):
-    chat_state = get_chat_state(chat_channel_data.chat_name)
-    for participant in get_participants(chat_state):
-        handle = handles.get_handle(participant.handle)
-        if handle.auto_respond_message:
+    for participant in get_chat_participants(chat_channel_data.chat_name):
+        auto_respond_message = handles.get_auto_respond_message(participant.handle)
+        if auto_respond_message is not None:
             actor = actors.read_actor(participant.actor_id)
             chat_channel_data_2: ChatConnectionMapping = (
                 read_chat_connection_from_channel(
@@ -1322,44 +1455,34 @@ async def auto_respond_if_needed(
                 await process_message_data(
                     chat_channel_data_2,
                     posting.MessageData(
-                        content=handle.auto_respond_message,
+                        content=auto_respond_message,
                         created_at=message.created_at,
                     ),
                 )
                 break
 
 
+@metrics.timed("chats.process_message_data")
 async def process_message_data(
     chat_channel_data: ChatConnectionMapping, msg_data: posting.MessageData
 ):
     poster_id = chat_channel_data.handle
     chat_name = chat_channel_data.chat_name
 
-    # With timestamps from discord, we must apply the DST diff compared to the python env timestamps
-    post_time = PostTimestamp.from_datetime(msg_data.created_at, dst_diff=2)
+    post_time = PostTimestamp.from_datetime(msg_data.created_at)
     full_post = channels.record_new_post(
         chat_channel_data.chat_name, poster_id, post_time
     )
-    tasks = create_reposting_tasks(chat_name, msg_data, poster_id, full_post)
-
-    await asyncio.gather(*tasks)
+    await fan_out_message(chat_name, msg_data, poster_id, full_post)
 
-    # Write to the persistent log:
+    # Write to the persistent log, once however many got the message:
     # TODO: also add header if it is the first message after someone disconnected
     poster_id = poster_id if full_post else None
     post = posting.create_post(msg_data, poster_id, attachments_supported=False)
     entry = ChatLogEntry(post, full_post)
-    get_chat_state(chat_name)
     write_new_chat_log_entry(chat_name, entry)
 
 
-async def repost_string_buffer(channel, string_buffer: str):
-    if string_buffer != "":
-        await channel.send(string_buffer)
-        string_buffer = ""
-    return string_buffer
-
-
 def get_archived_alert(handle_id: str):
     return f"```Cannot connect to any of the recipients from {handle_id}. This chat is archived in read-only form.```"
 
@@ -1376,59 +1499,137 @@ def get_reopened_chat_alert(chat_name: str):
     return f"```====== re-opened chat {chat_name} ======```"
 
 
+class HistoryReplay:
+    """A participant's view of a chat log, as posts keyed by their log index"""
+
+    def __init__(self, participant: ChatParticipant):
+        self.participant = participant
+        self.any_history = False
+        # The entry that denoted the last time the session was closed
+        self.last_close_index: int | None = None
+
+    def posts(self, entries: Iterable[tuple[int, ChatLogEntry]]):
+        for index, entry in entries:
+            if (
+                entry.closed_handle_id is not None
+                and entry.closed_handle_id == self.participant.handle
+                and self.any_history
+            ):
+                # This entry denotes the point where closed_handle_id stopped listening
+                # and there has been history before this point.
+                # We don't need to remember every time someone has closed a chat,
+                # just the last one:
+                self.last_close_index = index
+                yield index, get_last_session_closed_alert()
+            elif entry.archived_handle_id is not None:
+                if entry.archived_handle_id != self.participant.handle:
+                    if self.any_history:
+                        # This entry denotes the point where connection was lost to
+                        # another participant
+                        yield (
+                            index,
+                            get_other_unreachable_alert(entry.archived_handle_id),
+                        )
+                else:
+                    # This denotes the point where connection was lost to us
+                    # We shall not read any histoy past this point
+                    return
+            elif entry.message is not None:
+                self.any_history = True
+                yield index, entry.message
+
+
+def last_history_messages(replay: HistoryReplay, entries, count: int):
+    """The last `count` messages of the packed history, and how many came
+    before them"""
+    tail: deque[tuple[int, str, bool]] = deque()
+    # The dropped messages since the start of the last dropped post
+    dropped_post: list[tuple[int, str, bool]] = []
+    earlier = 0
+    for message in posting.pack_posts(replay.posts(entries)):
+        tail.append(message)
+        if len(tail) > count:
+            dropped = tail.popleft()
+            earlier += 1
+            _index, _message, continued = dropped
+            dropped_post = [*dropped_post, dropped] if continued else [dropped]
+    # Load earlier shows the posts from before the first one shown here, so the
+    # tail has to start at the start of a post
+    if len(tail) > 0 and tail[0][2]:
+        if any(not continued for _index, _message, continued in tail):
+            # The rest of the split post is shown with the earlier history
+            while tail[0][2]:
+                tail.popleft()
+                earlier += 1
+        else:
+            # The whole tail is one post, show all of it
+            tail.extendleft(reversed(dropped_post))
+            earlier -= len(dropped_post)
+    return [(index, message) for index, message, _continued in tail], earlier
+
+
+def get_earlier_history_note(earlier: int):
+    return f"```{earlier} earlier message{'s' if earlier != 1 else ''} not shown```"
+
+
 async def repost_message_history(channel, chat_state, participant: ChatParticipant):
-    any_history = False
-    index_to_remove: int = -1
-    # each entry is a ChatLogEntry
-    string_buffer = ""
-    for index, entry in get_chat_log_iterable(chat_state, participant.chat_name):
-        if (
-            entry.closed_handle_id is not None
-            and entry.closed_handle_id == participant.handle
-            and any_history
-        ):
-            # This entry denotes the point where closed_handle_id stopped listening
-            # and there has been history before this point.
-            # Empty the current buffer:
-            string_buffer = await repost_string_buffer(channel, string_buffer)
-            # Print delimiter:
-            await channel.send(get_last_session_closed_alert())
-            # We don't need to remember every time someone has closed a chat, just the last one:
-            index_to_remove = index
-        elif entry.archived_handle_id is not None:
-            if entry.archived_handle_id != participant.handle and any_history:
-                # This entry denotes the point where connection was lost to another participant
-                # Empty the current buffer:
-                string_buffer = await repost_string_buffer(channel, string_buffer)
-                # Print delimiter:
-                await channel.send(
-                    get_other_unreachable_alert(entry.archived_handle_id)
-                )
-            elif entry.archived_handle_id == participant.handle:
-                # This denotes the point where connection was lost to us
-                # We shall not read any histoy past this point
-                break
-        elif entry.message is not None:
-            any_history = True
-            if entry.header:
-                # Send the buffer we have built up so far
-                string_buffer = await repost_string_buffer(channel, string_buffer)
-            if string_buffer == "":
-                string_buffer = entry.message
-            else:
-                string_buffer += f"\n{entry.message}"
-    # Finish by sending anything that is left over
-    await repost_string_buffer(channel, string_buffer)
+    replay = HistoryReplay(participant)
+    entries = get_chat_log_iterable(chat_state, participant.chat_name)
+    messages, earlier = last_history_messages(
+        replay, entries, max(1, config.CHAT_HISTORY_MESSAGES)
+    )
+    if earlier > 0:
+        await channel.send(
+            get_earlier_history_note(earlier),
+            view=LoadEarlierView(
+                participant.chat_name, participant.handle, messages[0][0]
+            ),
+        )
+    for _index, message in messages:
+        await channel.send(message)
     if participant.session_status in [
         session_status_open_archive,
         session_status_closed_archive,
     ]:
         await channel.send(get_archived_alert(participant.handle))
-    elif any_history:
+    elif replay.any_history:
         await channel.send(get_reopened_chat_alert(participant.channel_name))
 
     # Remove the entry that denoted last time session was closed
     # TODO: chat_log_length_at_last_close could also be tracked on a participant level
     # would probably be cleaner
-    if index_to_remove != -1:
-        remove_entry_from_chat_log(participant.chat_name, index_to_remove)
+    if replay.last_close_index is not None:
+        remove_entry_from_chat_log(participant.chat_name, replay.last_close_index)
+
+
+async def send_earlier_history(
+    interaction: Interaction, chat_name: str, handle_id: str, before: int
+):
+    """Shows the history from before log index `before` to the one who clicked
+    Load earlier, a page at a time"""
+    await interaction.response.defer(ephemeral=True)
+    chat_state = get_chat_state(chat_name)
+    participant = read_participant(chat_state, handle_id)
+    if participant is None:
+        await interaction.followup.send("This chat is gone.", ephemeral=True)
+        return
+    replay = HistoryReplay(participant)
+    entries = (
+        (index, entry)
+        for index, entry in get_chat_log_iterable(chat_state, chat_name)
+        if index < before
+    )
+    messages, earlier = last_history_messages(
+        replay, entries, max(1, config.CHAT_HISTORY_MESSAGES)
+    )
+    if len(messages) == 0:
+        await interaction.followup.send("There is no earlier history.", ephemeral=True)
+        return
+    if earlier > 0:
+        await interaction.followup.send(
+            get_earlier_history_note(earlier),
+            view=LoadEarlierView(chat_name, handle_id, messages[0][0]),
+            ephemeral=True,
+        )
+    for _index, message in messages:
+        await interaction.followup.send(message, ephemeral=True)
@@ -11,6 +11,33 @@ class Config(BaseSettings):
 
     HOST: str = "127.0.0.1"
     PORT: int = 5000
+    # 0 serves the API from the bot's own event loop. Otherwise the API is run
+    # by this many separate processes that talk to the bot over API_SOCKET.
+    API_WORKERS: int = 0
+    API_SOCKET: str = "config/api.sock"
+    # Set by the bot for the worker processes it starts
+    API_WORKER: bool = False
+    # With API workers, /metrics only has the metrics of the worker that
+    # answers. The bot process then serves its own on this port. 0 turns it off.
+    METRICS_PORT: int = 0
+    # Log (with a stack trace) when the event loop is blocked for longer than
+    # this many seconds. 0 turns the loop monitor off.
+    LOOP_LAG_THRESHOLD: float = 0.25
+    # App commands slower than this many seconds go to the slow command log
+    SLOW_COMMAND_THRESHOLD: float = 1.0
+    # Hidden channels kept ready in each chats category, so that opening a chat
+    # session does not have to create one. 0 (the default) turns the pool off.
+    CHAT_CHANNEL_POOL_SIZE: int = 0
+    # Messages of history posted when a chat session is opened. Anything earlier
+    # is behind a "Load earlier" button.
+    CHAT_HISTORY_MESSAGES: int = 10
+    # When a player is at their limit of open chat sessions and needs another
+    # one, close the session that has been quiet the longest instead of leaving
+    # the new chat unread
+    CHAT_EVICT_LEAST_RECENT: bool = False
+    # Seconds before an alert rule (see alerts.py) can alert again for the same
+    # player, unless the rule sets its own cooldown
+    ALERT_COOLDOWN: float = 60
 
     DISCORD_TOKEN: str
     APPLICATION_ID: int
@@ -20,6 +47,12 @@ class Config(BaseSettings):
     GM_ROLE_NAME: str
     MAIN_SHOP_NAME: str
     FILE_LOGGING: bool
+    # Each log file under config/logs is rotated when it grows past
+    # LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files (gzipped if
+    # LOG_COMPRESS is set)
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT: int = 10
+    LOG_COMPRESS: bool = False
     CLEAR_ALL: bool = False
     DESTROY_ALL: bool = False
     SKIP_CHANNELS: bool = False
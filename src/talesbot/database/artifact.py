@@ -1,6 +1,6 @@
 from collections.abc import Sequence
 
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
@@ -44,12 +44,35 @@ async def create(
     return artifact, page
 
 
-async def access(session: AsyncSession, name: str, password: str | None = None):
+async def access(
+    session: AsyncSession, name: str, password: str | None = None
+) -> tuple[Artifact, int] | None:
+    """Look up an artifact and count its pages without loading any content"""
+    row = (
+        await session.execute(
+            select(Artifact, func.count(ArtifactContent.id))
+            .outerjoin(Artifact.content)
+            .where(Artifact.name == name)
+            .where(Artifact.password == password)
+            .group_by(Artifact.id)
+        )
+    ).first()
+    if row is None:
+        return None
+    artifact, page_count = row
+    return artifact, page_count
+
+
+async def get_page(
+    session: AsyncSession, artifact_id: int, index: int
+) -> ArtifactContent | None:
+    """Fetch the page at position `index`, in page order"""
     return await session.scalar(
-        select(Artifact)
-        .where(Artifact.name == name)
-        .where(Artifact.password == password)
-        .options(joinedload(Artifact.content))
+        select(ArtifactContent)
+        .where(ArtifactContent.artifact_id == artifact_id)
+        .order_by(ArtifactContent.page)
+        .offset(index)
+        .limit(1)
     )
 
 
@@ -0,0 +1,85 @@
+### Module dispatch.py
+# Messages posted in the same channel (or chat) are processed one at a time, in
+# the order they came in, so that headers and reposts cannot overtake each
+# other. Different channels are processed in parallel. Each channel has a
+# bounded queue, and on_message waits for room in it, so a flooding channel
+# only slows down itself.
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+default_queue_size = 100
+
+
+@dataclass
+class Job:
+    handler: Callable[[], Awaitable[None]]
+    kind: str
+    # The handler runs in the context of whoever submitted it
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+    enqueued: float = field(default_factory=time.monotonic)
+    done: asyncio.Future[None] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+class ChannelDispatcher:
+    def __init__(self, max_queue_size: int = default_queue_size):
+        self.max_queue_size = max_queue_size
+        # key -> jobs waiting for the key's worker, which only runs while there
+        # is something in the queue
+        self.queues: dict[str, asyncio.Queue[Job]] = {}
+        self.workers: set[asyncio.Task] = set()
+
+    async def run(
+        self, key: str, handler: Callable[[], Awaitable[None]], kind: str = "channel"
+    ):
+        """Runs `handler` after everything submitted earlier for `key`, and
+        returns (or raises) when it is done"""
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue(self.max_queue_size)
+            self.queues[key] = queue
+            worker = asyncio.create_task(self._work(key, queue))
+            self.workers.add(worker)
+            worker.add_done_callback(self.workers.discard)
+        job = Job(handler, kind)
+        await queue.put(job)
+        await job.done
+
+    async def _work(self, key: str, queue: asyncio.Queue[Job]):
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+                metrics.dispatch_wait_seconds.observe(
+                    time.monotonic() - job.enqueued, job.kind
+                )
+                if job.done.done():
+                    # The submitter was cancelled
+                    continue
+                try:
+                    await asyncio.create_task(job.handler(), context=job.context)
+                except Exception as e:
+                    if not job.done.done():
+                        job.done.set_exception(e)
+                else:
+                    if not job.done.done():
+                        job.done.set_result(None)
+        finally:
+            # Nothing can be added between the check above and this
+            del self.queues[key]
+
+    def queued(self) -> int:
+        return sum(queue.qsize() for queue in self.queues.values())
+
+
+dispatcher = ChannelDispatcher()
+metrics.queue_depth.set_function(dispatcher.queued, "messages")
@@ -75,3 +75,9 @@ class NotRegisterdError(ReportError):
             f"User {user.name if isinstance(user, Member) else user} "
             "is not registerd as a player"
         )
+
+
+class BatchTransferError(ReportError):
+    def __init__(self, index: int) -> None:
+        self.index = index
+        super().__init__(f"Transfer {index} in batch failed, no transfers were made")
@@ -0,0 +1,99 @@
+### Module events.py
+# In-process publish/subscribe for game events (transactions, orders, chats,
+# network state), used to push updates to API clients instead of having them
+# poll. Publishing never blocks: every subscriber has a bounded buffer and
+# events that do not fit are dropped and counted.
+
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+default_buffer_size = 1000
+
+
+class Subscription:
+    def __init__(self, types: set[str] | None = None, max_buffer=default_buffer_size):
+        self.types = types
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(max_buffer)
+        self.dropped = 0
+
+    def push(self, event: dict[str, Any]):
+        if self.types is not None and event["type"] not in self.types:
+            return
+        if self.queue.full():
+            # Slow subscriber: throw away the oldest event to make room
+            self.queue.get_nowait()
+            self.dropped += 1
+            bus.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float | None = None) -> dict[str, Any] | None:
+        """Next event, or None if nothing happened within `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except TimeoutError:
+            return None
+
+
+class EventBus:
+    def __init__(self):
+        self.subscriptions: set[Subscription] = set()
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event_type: str, **data: Any):
+        self.published += 1
+        if not self.subscriptions:
+            return
+        event = {"type": event_type, "time": time.time(), **data}
+        for subscription in self.subscriptions:
+            subscription.push(event)
+
+    def subscribe(
+        self, types: set[str] | None = None, max_buffer=default_buffer_size
+    ) -> Subscription:
+        subscription = Subscription(types, max_buffer)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+
+bus = EventBus()
+metrics.queue_depth.set_function(
+    lambda: sum(s.queue.qsize() for s in bus.subscriptions), "events"
+)
+
+
+def publish(event_type: str, **data: Any):
+    bus.publish(event_type, **data)
+
+
+async def listen(
+    types: set[str] | None = None, heartbeat: float = 15
+) -> AsyncIterator[dict[str, Any] | None]:
+    """Yields events as they are published, and None every `heartbeat` seconds
+    without any events. If events were dropped since the last one yielded,
+    a "dropped" event with the count comes first."""
+    subscription = bus.subscribe(types)
+    reported_drops = 0
+    try:
+        while True:
+            event = await subscription.get(heartbeat)
+            if subscription.dropped != reported_drops:
+                yield {
+                    "type": "dropped",
+                    "time": time.time(),
+                    "count": subscription.dropped - reported_drops,
+                }
+                reported_drops = subscription.dropped
+            yield event
+    finally:
+        bus.unsubscribe(subscription)
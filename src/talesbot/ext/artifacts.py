@@ -48,23 +48,27 @@ class ArtifactsCog(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         member = cast(Member, interaction.user)
         async with SessionM() as session:
-            a = await artifact.access(session, name, password)
+            found = await artifact.access(session, name, password)
 
-            if a is None:
+            if found is None:
                 await self.log_connect_attempt(member, name, password)
                 raise ArtifactNotFoundError(name)
 
-            async with asyncio.TaskGroup() as tg:
-                tg.create_task(
-                    self.log_connect_attempt(member, name, password, a.announcement)
-                )
-                tg.create_task(
-                    interaction.followup.send(
-                        content=a.content[0].content,
-                        view=ArtifactView(a),
-                        ephemeral=True,
-                    )
+            a, page_count = found
+            first_page = await artifact.get_page(session, a.id, 0)
+
+        content = first_page.content if first_page is not None else "[no more pages]"
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(
+                self.log_connect_attempt(member, name, password, a.announcement)
+            )
+            tg.create_task(
+                interaction.followup.send(
+                    content=content,
+                    view=ArtifactView(a.id, page_count, page_content=content),
+                    ephemeral=True,
                 )
+            )
 
     async def log_connect_attempt(
         self,
@@ -0,0 +1,192 @@
+from discord import Interaction, app_commands
+from discord.ext import commands
+from talesbot import chats, checks, gm
+from talesbot.config import config_dir
+from talesbot.storage import ConfigObj
+
+
+class ChatsCog(commands.Cog, name="chats"):
+    """Commands related to chats.
+    These are private conversations between two or more handles."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._last_member = None
+
+    # TODO: swallow messages (and post alerts) when trying to use commands in chat channel
+
+    # Commands related to chats
+    # These only work in cmd_line channels
+
+    @app_commands.command(
+        name="chat",
+        description="Open a chat session with another user.",
+        # 		help=(
+        # 			'Open a chat session between you (using your current handle) and another user. ' +
+        # 			'If you have never had a chat between those two handles before, one will be created. ' +
+        # 			'All your active chats are shown in your personal chat_hub channel, where you can open and ' +
+        # 			'close the connections as needed.\n' +
+        # 			'You can close a chat and re-open it and all the chat history will be stored, except for file attachments. ' +
+        # 			'Note: you cannot change your handle in an existing chat, so make sure to start the chat from the correct one! ' +
+        # 			'If you switch handles and open a new chat, the other person can see that two handles have tried to contact them, ' +
+        # 			'but they will not see that they belong to the same person.'
+        # 		)
+    )
+    async def chat_command(self, interaction: Interaction, handle: str):
+        if handle is None:
+            response = 'Error: you must say who you want to chat with. Example: "/chat shadow_weaver"'
+            await interaction.response.send_message(response, ephemeral=True)
+        else:
+            await interaction.response.defer(ephemeral=True)
+            handle = handle.lower()
+            response = await chats.create_chat_from_command(
+                str(interaction.user.id), handle
+            )
+            if response is not None:
+                await interaction.followup.send(response, ephemeral=True)
+            else:
+                await interaction.followup.send(
+                    "Unknown error. Contact system admin.", ephemeral=True
+                )
+
+    @app_commands.command(
+        name="chat_other",
+        description="Admin only. Open a chat session for someone else.",
+    )
+    @checks.is_gm
+    async def chat_other_command(
+        self, interaction: Interaction, from_handle: str, to_handle: str
+    ):
+        if from_handle is None:
+            await interaction.response.send_message(
+                "Error: you must give two handles to start a chat.", ephemeral=True
+            )
+            return
+        elif to_handle is None:
+            report = f"Error: you must give the second handle that should chat with {from_handle}."
+            await interaction.response.send_message(report, ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        from_handle = from_handle.lower()
+        to_handle = to_handle.lower()
+        report = await chats.create_2party_chat_from_handle_id(from_handle, to_handle)
+        if report is not None:
+            await interaction.followup.send(report, ephemeral=True)
+        else:
+            await interaction.followup.send(
+                "Unknown error. Contact system admin.", ephemeral=True
+            )
+
+    @app_commands.command(
+        name="gm_chat",
+        description="GM only. Open a chat session from the shared GM account.",
+    )
+    @checks.is_gm
+    async def gm_chat_command(self, interaction: Interaction, other_handle: str):
+        if other_handle is None:
+            report = "Error: you must give the handle to chat with."
+            await interaction.response.send_message(report, ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        my_handle = gm.get_gm_active_handle()
+        other_handle = other_handle.lower()
+        report = await chats.create_2party_chat_from_handle_id(my_handle, other_handle)
+        if report is not None:
+            await interaction.followup.send(report, ephemeral=True)
+        else:
+            await interaction.followup.send(
+                "Unknown error. Contact system admin.", ephemeral=True
+            )
+
+    @app_commands.command(
+        name="close_chat",
+        description="Close a chat session from your end.",
+        # 		help=(
+        # 			'Close a chat session from your end. This will not affect how the other participant sees the chat. ' +
+        # 			f'You can re-open the chat at any time using \"/chat\", or by clicking the {emoji_open} in your chat_hub.'
+        # 			)
+    )
+    async def close_chat_command(self, interaction: Interaction, handle: str):
+        if handle is None:
+            response = 'Error: you must say which chat you want to close. Example: "/close_chat shadow_weaver"'
+            await interaction.response.send_message(response, ephemeral=True)
+        else:
+            await interaction.response.defer(ephemeral=True)
+            handle = handle.lower()
+            response = await chats.close_chat_session_from_command(
+                interaction.user.id, handle
+            )
+            if response is not None:
+                await interaction.followup.send(response, ephemeral=True)
+            else:
+                await interaction.followup.send(
+                    "Unknown error. Contact system admin.", ephemeral=True
+                )
+
+    @app_commands.command(
+        name="close_chat_other",
+        description="Admin-only. Close a chat session for someone else.",
+    )
+    @checks.is_gm
+    async def close_chat_other_command(
+        self, interaction: Interaction, my_handle: str, other_handle: str
+    ):
+        await interaction.response.defer(ephemeral=True)
+        my_handle = my_handle.lower()
+        other_handle = other_handle.lower()
+        report = await chats.close_2party_chat_session_from_handle_id(
+            my_handle, other_handle
+        )
+        if report is not None:
+            await interaction.followup.send(report, ephemeral=True)
+        else:
+            await interaction.followup.send(
+                "Unknown error. Contact system admin.", ephemeral=True
+            )
+
+    @app_commands.command(
+        name="chat_room",
+        description="Open a chat room with several other users.",
+    )
+    @app_commands.describe(
+        room="Name of the room",
+        handles=(
+            "Handles to add to the room, separated by spaces (not needed to re-open it)"
+        ),
+    )
+    async def chat_room_command(
+        self, interaction: Interaction, room: str, handles: str = ""
+    ):
+        await interaction.response.defer(ephemeral=True)
+        response = await chats.create_chat_room_from_command(
+            str(interaction.user.id), room, handles.split()
+        )
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(
+        name="close_chat_room",
+        description="Close a chat room session from your end.",
+    )
+    async def close_chat_room_command(self, interaction: Interaction, room: str):
+        await interaction.response.defer(ephemeral=True)
+        response = await chats.close_chat_room_session_from_command(
+            interaction.user.id, room
+        )
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(
+        name="clear_all_chats",
+        description="Admin-only. Delete all chats and chat channels for all users.",
+    )
+    @checks.is_gm
+    async def clear_all_chats_command(self, interaction: Interaction):
+        await interaction.response.defer(ephemeral=True)
+        await chats.init(clear_all=True)
+        await interaction.followup.send("Done.", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(ChatsCog(bot))
+    chats.chats = ConfigObj(str(config_dir / chats.chats_dir / "chats.conf"))
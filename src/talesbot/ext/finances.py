@@ -0,0 +1,113 @@
+from discord import Interaction, app_commands
+from discord.ext import commands
+from talesbot import checks, finances, handles, players
+from talesbot.common import coin
+from talesbot.custom_types import Transaction
+
+
+class FinancesCog(commands.Cog, name="finances"):
+    """Commands related to finances.
+    Money is tracked separately for each handle (for more info, see \".help handles\")
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._last_member = None
+
+    # Commands related to money
+    # These only work in cmd_line channels
+
+    @app_commands.command(
+        name="create_money",
+        description="Admin-only. Creates new money and deposits them in a handle.",
+    )
+    @checks.is_gm
+    async def create_money_command(
+        self, interaction: Interaction, handle_id: str, amount: int
+    ):
+        if handle_id is None:
+            response = "Error: no handle specified."
+        elif amount <= 0:
+            response = f"Error: cannot create less than {coin} 1."
+        else:
+            handle = handles.get_handle(handle_id)
+            if finances.can_have_finances(handle.handle_type):
+                await finances.add_funds(handle, amount)
+                response = f"Added {amount} to the balance of {handle.handle_id}"
+            else:
+                response = f'Error: handle "{handle_id}" does not exist, or is not capable of having money.'
+        await interaction.response.send_message(response, ephemeral=True)
+
+    @app_commands.command(
+        name="set_money", description="Admin-only. Sets the balance of an account."
+    )
+    @checks.is_gm
+    async def set_money_command(
+        self, interaction: Interaction, handle_id: str, amount: int
+    ):
+        if handle_id is None:
+            response = "Error: no handle specified."
+        elif amount < 0:
+            response = "Error: you must set a new balance."
+        else:
+            handle = handles.get_handle(handle_id)
+            if finances.can_have_finances(handle.handle_type):
+                await finances.overwrite_balance(handle, amount)
+                response = f"Set the balance of {handle.handle_id} to {amount}"
+            else:
+                response = f'Error: handle "{handle_id}" does not exist, or is not capable of having money'
+        await interaction.response.send_message(response, ephemeral=True)
+
+    # TODO: move some of this error handling into try_to_pay_from_command
+    @app_commands.command(
+        name="pay",
+        description=f"Pay money ({coin}) to another handle. The money will be paid from your current handle.",
+        #        help=(f'Pay money ({coin}) to another handle.\nThe money will be paid from your current handle. ' +
+        #            f'Minimum transfer is {coin} 1.' +
+        #            'Use /balance or check your personal finance channel to see if you have enough.\n' +
+        #            f'Example: \"/pay shadow_weaver 10\" to pay {coin} 10 to shadow_weaver.\n' +
+        #            'Note: this command is also used to transfer money between two handles you control.')
+    )
+    async def pay_money_command(
+        self, interaction: Interaction, target_handle: str, amount: int
+    ):
+        await interaction.response.defer(ephemeral=True)
+        if target_handle is None:
+            response = 'Error: no recipient specified. Use "/pay <recipient> <amount>", e.g. "/pay shadow_weaver 500".'
+        elif amount <= 0:
+            response = f'Error: cannot transfer less than {coin} 1. Use "/pay <recipient> <amount>", e.g. "/pay {target_handle} 500".'
+        else:
+            player_id = players.get_player_id(str(interaction.user.id))
+            transaction: Transaction = await finances.try_to_pay_from_actor(
+                player_id, target_handle, amount
+            )
+            response = transaction.report
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(
+        name="balance", description="Show current balance (money) on all your handles."
+    )
+    async def show_balance_command(self, interaction: Interaction):
+        player_id = players.get_player_id(str(interaction.user.id))
+        response = finances.get_all_handles_balance_report(player_id)
+        await interaction.response.send_message(response, ephemeral=True)
+
+    @app_commands.command(
+        name="collect",
+        description="Collect all your funds to the same handle. All money will end up at your current handle.",
+    )
+    async def collect_command(self, interaction: Interaction):
+        await interaction.response.defer(ephemeral=True)
+        player_id = players.get_player_id(str(interaction.user.id))
+        # await interaction.response.send_message('Collecting all funds to the account of the current handle...', ephemeral=True)
+        report = await finances.collect_all_funds(player_id)
+        if report is not None:
+            await interaction.followup.send(report, ephemeral=True)
+        else:
+            await interaction.followup.send(
+                "Unknown error. Contact system admin.", ephemeral=True
+            )
+
+
+async def setup(bot):
+    await bot.add_cog(FinancesCog(bot))
@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import time
 
 import discord
 from discord import Interaction, TextStyle, app_commands, ui, utils
@@ -6,6 +8,9 @@ from discord.app_commands.errors import MissingRole, NoPrivateMessage
 from discord.ext import commands
 
 from talesbot import (
+    alerts,
+    archive,
+    chats,
     gm,
     handles,
     player_setup,
@@ -17,6 +22,9 @@ from ..errors import ReportError
 
 logger = logging.getLogger(__name__)
 
+# Most followups that /gm said sends
+archive_message_limit = 5
+
 
 class ArtifactCreateModal(ui.Modal, title="Create Artifact"):
     name = ui.TextInput(label="Code name", required=True)
@@ -84,6 +92,72 @@ class GmCog(commands.GroupCog, group_name="gm"):
             ephemeral=True,
         )
 
+    @app_commands.command(
+        description="Show what a handle wrote between two times (e.g. 2024-05-18 20:30)"
+    )
+    async def said(
+        self,
+        interaction: Interaction,
+        handle: str,
+        start: str,
+        end: str | None = None,
+    ):
+        start_time = archive.parse_time(start)
+        end_time = archive.parse_time(end) if end is not None else time.time()
+        await interaction.response.defer(ephemeral=True)
+        found = await asyncio.to_thread(
+            archive.search, start_time, end_time, handle=handle.lower()
+        )
+        if len(found) == 0:
+            await interaction.followup.send(
+                f"Found nothing from {handle} in the archive for that time.",
+                ephemeral=True,
+            )
+            return
+
+        chunks = [""]
+        for message in found:
+            line = message.to_string() + "\n"
+            if chunks[-1] != "" and len(chunks[-1]) + len(line) > 1900:
+                chunks.append("")
+            chunks[-1] += line[:1900]
+        shown = chunks[:archive_message_limit]
+        for chunk in shown:
+            await interaction.followup.send(f"```\n{chunk}```", ephemeral=True)
+        if len(chunks) > len(shown):
+            await interaction.followup.send(
+                f"Showing the first {len(shown)} pages of {len(chunks)}, "
+                "/api/archive has all of it.",
+                ephemeral=True,
+            )
+
+    @app_commands.command(description="Search the chat logs")
+    async def chat_search(self, interaction: Interaction, query: str):
+        await interaction.response.defer(ephemeral=True)
+        found = await chats.search_chat_logs(query)
+        if len(found) == 0:
+            await interaction.followup.send(
+                f'No chat logs match "{query}".', ephemeral=True
+            )
+            return
+        lines = [
+            f"{rank}. **{chat_name}**: {snippet}"
+            for rank, (chat_name, snippet) in enumerate(found, start=1)
+        ]
+        await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
+    @app_commands.command(description="Reload the alert rules from alerts.conf")
+    async def reload_alerts(self, interaction: Interaction):
+        rules = alerts.load()
+        lines = [
+            f"{rule.name}: {len(rule.phrases)} phrases to {', '.join(rule.channels)}"
+            for rule in rules
+        ]
+        await interaction.response.send_message(
+            (f"Loaded {len(rules)} alert rules.\n" + "\n".join(lines))[:2000],
+            ephemeral=True,
+        )
+
     scenario_g = app_commands.Group(name="scenario", description="Manage scenarios")
 
     @scenario_g.command(name="run", description="Run a scenario")
@@ -0,0 +1,116 @@
+from discord import Interaction, app_commands
+from discord.ext import commands
+from talesbot import actors, checks, handles
+
+
+class HandlesCog(commands.Cog, name="handles"):
+    """Commands related to handles.
+    Your handle is how you appear to other users in most other channels.
+    Each handle has its own separate finances (see \".help finances\").
+    These commands can also be used in your chat hub channel."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._last_member = None
+
+    # Commands related to handles
+    # These work in both cmd_line and chat_hub channels
+
+    @app_commands.command(name="show_handle", description="Show current handle")
+    async def handle_command(self, interaction: Interaction):
+        await self.handle_command_internal(interaction, None, burner=False)
+
+    @app_commands.command(
+        name="handle",
+        description="Switch to another handle. It will be created if not exists already.",
+    )
+    async def switch_handle_command(self, interaction: Interaction, handle_name: str):
+        await self.handle_command_internal(interaction, handle_name, burner=False)
+
+    @app_commands.command(description="Show current handle for the gm user")
+    @checks.is_gm
+    async def show_gm_handle(self, interaction: Interaction):
+        await self.handle_command_internal(
+            interaction, None, burner=False, use_gm_actor=True
+        )
+
+    @app_commands.command(description="Switch handle for gm user")
+    @checks.is_gm
+    async def gm_handle(self, interaction: Interaction, handle_name: str):
+        await self.handle_command_internal(
+            interaction, handle_name, burner=False, use_gm_actor=True
+        )
+
+    @app_commands.command(
+        name="burner",
+        description="Create a new burner handle or switch to existing burner.",
+    )
+    async def create_burner_command(self, ctx, burner_name: str):
+        await self.handle_command_internal(ctx, burner_name, burner=True)
+
+    async def handle_command_internal(
+        self,
+        interaction: Interaction,
+        new_handle: str | None = None,
+        burner: bool = False,
+        use_gm_actor: bool = False,
+    ):
+        # Note: this command may edit handles but may also be read-only.
+        # The below function will claim handles semaphore if editing is required.
+        await interaction.response.defer(ephemeral=True)
+        response = await handles.process_handle_command(
+            interaction.user.id, new_handle, burner=burner, use_gm_actor=use_gm_actor
+        )
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(name="handles", description="Show all your handles.")
+    async def handles_command(self, interaction: Interaction):
+        await interaction.response.defer(ephemeral=True)
+        response = await handles.get_full_handles_report(interaction.user.id)
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(
+        name="show_handles", description="Show all handles for another player."
+    )
+    @checks.is_gm
+    async def show_handles_command(self, interaction: Interaction, handle_id: str):
+        await interaction.response.defer(ephemeral=True)
+        response = await handles.get_full_handles_report_for_handle(handle_id)
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(name="burn", description="Destroy a burner account forever.")
+    async def burn_command(self, interaction: Interaction, burner_name: str):
+        await interaction.response.defer(ephemeral=True)
+        async with handles.semaphore():
+            response = await handles.process_burn_command(
+                interaction.user.id, burner_name
+            )
+        await interaction.followup.send(response, ephemeral=True)
+
+    @app_commands.command(
+        name="clear_all_handles",
+        description="Admin-only. Remove all handles and reset all users",
+        #        help='Admin-only. Remove all handles (including all financial info) and reset all users to their original handle uXXXX.'
+    )
+    @checks.is_gm
+    async def clear_handles_command(self, interaction: Interaction):
+        await interaction.response.defer(ephemeral=True)
+        async with handles.semaphore():
+            await handles.clear_all_handles()
+            await actors.init(clear_all=False)
+        await interaction.followup.send("Done.", ephemeral=True)
+
+    @app_commands.command(
+        name="remove_handle",
+        description="Admin-only. Remove a handle (including all financial info) without a trace.",
+    )
+    @checks.is_gm
+    async def remove_handle_command(self, interaction: Interaction, handle_id: str):
+        await interaction.response.defer(ephemeral=True)
+        async with handles.semaphore():
+            report = await handles.process_remove_handle_command(handle_id)
+        await interaction.followup.send(report, ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(HandlesCog(bot))
@@ -1,133 +1,26 @@
 from copy import deepcopy
 
 import simplejson
-from configobj import ConfigObj
-from discord import Interaction, app_commands
-from discord.ext import commands
 
-from talesbot import checks
-
-from .errors import InsufficientBalanceError, InvalidAmountError, InvalidPartiesError
+from .errors import (
+    BatchTransferError,
+    InsufficientBalanceError,
+    InvalidAmountError,
+    InvalidPartiesError,
+)
 
 from .utils import fmt_handle, fmt_money
 
-from . import actors, handles, players
+from . import actors, events, handles, metrics
 from .common import coin, transaction_collected, transaction_collector
 from .config import config_dir
 from .custom_types import Handle, HandleTypes, PostTimestamp, Transaction, TransTypes
+from .storage import ConfigObj
 
 ### Module finances.py
 # This module tracks and handles money and transactions between handles
 
 
-class FinancesCog(commands.Cog, name="finances"):
-    """Commands related to finances.
-    Money is tracked separately for each handle (for more info, see \".help handles\")
-    """
-
-    def __init__(self, bot):
-        self.bot = bot
-        self._last_member = None
-
-    # Commands related to money
-    # These only work in cmd_line channels
-
-    @app_commands.command(
-        name="create_money",
-        description="Admin-only. Creates new money and deposits them in a handle.",
-    )
-    @checks.is_gm
-    async def create_money_command(
-        self, interaction: Interaction, handle_id: str, amount: int
-    ):
-        if handle_id is None:
-            response = "Error: no handle specified."
-        elif amount <= 0:
-            response = f"Error: cannot create less than {coin} 1."
-        else:
-            handle = handles.get_handle(handle_id)
-            if can_have_finances(handle.handle_type):
-                await add_funds(handle, amount)
-                response = f"Added {amount} to the balance of {handle.handle_id}"
-            else:
-                response = f'Error: handle "{handle_id}" does not exist, or is not capable of having money.'
-        await interaction.response.send_message(response, ephemeral=True)
-
-    @app_commands.command(
-        name="set_money", description="Admin-only. Sets the balance of an account."
-    )
-    @checks.is_gm
-    async def set_money_command(
-        self, interaction: Interaction, handle_id: str, amount: int
-    ):
-        if handle_id is None:
-            response = "Error: no handle specified."
-        elif amount < 0:
-            response = "Error: you must set a new balance."
-        else:
-            handle = handles.get_handle(handle_id)
-            if can_have_finances(handle.handle_type):
-                await overwrite_balance(handle, amount)
-                response = f"Set the balance of {handle.handle_id} to {amount}"
-            else:
-                response = f'Error: handle "{handle_id}" does not exist, or is not capable of having money'
-        await interaction.response.send_message(response, ephemeral=True)
-
-    # TODO: move some of this error handling into try_to_pay_from_command
-    @app_commands.command(
-        name="pay",
-        description=f"Pay money ({coin}) to another handle. The money will be paid from your current handle.",
-        #        help=(f'Pay money ({coin}) to another handle.\nThe money will be paid from your current handle. ' +
-        #            f'Minimum transfer is {coin} 1.' +
-        #            'Use /balance or check your personal finance channel to see if you have enough.\n' +
-        #            f'Example: \"/pay shadow_weaver 10\" to pay {coin} 10 to shadow_weaver.\n' +
-        #            'Note: this command is also used to transfer money between two handles you control.')
-    )
-    async def pay_money_command(
-        self, interaction: Interaction, target_handle: str, amount: int
-    ):
-        await interaction.response.defer(ephemeral=True)
-        if target_handle is None:
-            response = 'Error: no recipient specified. Use "/pay <recipient> <amount>", e.g. "/pay shadow_weaver 500".'
-        elif amount <= 0:
-            response = f'Error: cannot transfer less than {coin} 1. Use "/pay <recipient> <amount>", e.g. "/pay {target_handle} 500".'
-        else:
-            player_id = players.get_player_id(str(interaction.user.id))
-            transaction: Transaction = await try_to_pay_from_actor(
-                player_id, target_handle, amount
-            )
-            response = transaction.report
-        await interaction.followup.send(response, ephemeral=True)
-
-    @app_commands.command(
-        name="balance", description="Show current balance (money) on all your handles."
-    )
-    async def show_balance_command(self, interaction: Interaction):
-        player_id = players.get_player_id(str(interaction.user.id))
-        response = get_all_handles_balance_report(player_id)
-        await interaction.response.send_message(response, ephemeral=True)
-
-    @app_commands.command(
-        name="collect",
-        description="Collect all your funds to the same handle. All money will end up at your current handle.",
-    )
-    async def collect_command(self, interaction: Interaction):
-        await interaction.response.defer(ephemeral=True)
-        player_id = players.get_player_id(str(interaction.user.id))
-        # await interaction.response.send_message('Collecting all funds to the account of the current handle...', ephemeral=True)
-        report = await collect_all_funds(player_id)
-        if report is not None:
-            await interaction.followup.send(report, ephemeral=True)
-        else:
-            await interaction.followup.send(
-                "Unknown error. Contact system admin.", ephemeral=True
-            )
-
-
-async def setup(bot):
-    await bot.add_cog(FinancesCog(bot))
-
-
 class InternalTransRecord:
     def __init__(
         self,
@@ -190,6 +83,11 @@ highest_transaction_index = "___highest"
 
 system_fake_handle = "[system]"
 
+# Balances are read far more often than they are written (statements, reactions,
+# API polling), so the last known balance of each handle is kept in memory.
+# All balance writes go through set_current_balance_handle_id.
+balance_cache: dict[str, int] = {}
+
 
 def init_finances():
     for handle in handles.get_all_handles():
@@ -210,6 +108,7 @@ def init_finances_for_handle(handle: Handle, overwrite: bool = True):
     if highest_transaction_index not in finances_conf[transactions_index]:
         finances_conf[transactions_index][highest_transaction_index] = "0"
     finances_conf.write()
+    balance_cache[handle.handle_id] = int(finances_conf[balance_index])
 
 
 async def deinit_finances_for_handle(handle: Handle, record: bool):
@@ -219,6 +118,7 @@ async def deinit_finances_for_handle(handle: Handle, record: bool):
         for entry in finances_conf:
             del finances_conf[entry]
         finances_conf.write()
+    balance_cache.pop(handle.handle_id, None)
     if record:
         await actors.refresh_financial_statement(handle.actor_id)
 
@@ -228,11 +128,35 @@ def get_current_balance(handle: Handle):
 
 
 def get_current_balance_handle_id(handle_id: str):
+    if handle_id in balance_cache:
+        return balance_cache[handle_id]
+    balance = read_balance_handle_id(handle_id)
+    balance_cache[handle_id] = balance
+    return balance
+
+
+def read_balance_handle_id(handle_id: str) -> int:
+    """The balance on disk, without the cache. For the API worker processes,
+    whose balances would go stale as the bot process changes them."""
     file_name = str(config_dir / finances_conf_dir / f"{handle_id}.conf")
     finances_conf = ConfigObj(file_name)
     return int(finances_conf[balance_index])
 
 
+def get_current_balances(
+    handle_ids: list[str], cached: bool = True
+) -> dict[str, int | None]:
+    read = get_current_balance_handle_id if cached else read_balance_handle_id
+    balances: dict[str, int | None] = {}
+    for handle_id in handle_ids:
+        try:
+            balances[handle_id] = read(handle_id)
+        except KeyError:
+            # No finances for this handle
+            balances[handle_id] = None
+    return balances
+
+
 def set_current_balance(handle: Handle, balance: int):
     set_current_balance_handle_id(handle.handle_id, balance)
 
@@ -242,6 +166,7 @@ def set_current_balance_handle_id(handle_id: str, balance: int):
     finances_conf = ConfigObj(file_name)
     finances_conf[balance_index] = str(balance)
     finances_conf.write()
+    balance_cache[handle_id] = balance
 
 
 async def transfer_funds(
@@ -251,6 +176,55 @@ async def transfer_funds(
     allow_partial=False,
     operation=TransTypes.Transfer,
 ):
+    transaction = move_funds(
+        sender_handle, receiver_handle, amount, allow_partial, operation
+    )
+    await record_transaction(transaction)
+    return transaction
+
+
+async def transfer_funds_batch(
+    transfers: list[tuple[str | None, str | None, int, bool]],
+    atomic: bool = False,
+) -> list[Transaction | Exception]:
+    """Apply (sender, receiver, amount, allow_partial) transfers in order.
+
+    If atomic, either all transfers are applied or none, and the failure is
+    raised as a BatchTransferError. Otherwise every transfer is tried and the
+    result list holds either the transaction or the error for each item.
+    """
+    # All balance changes happen without awaiting, so no other task can
+    # observe or interleave with a half-applied batch
+    results: list[Transaction | Exception] = []
+    snapshot = get_current_balances(
+        [h for (s, r, _a, _p) in transfers for h in (s, r) if h is not None]
+    )
+    for index, (sender, receiver, amount, allow_partial) in enumerate(transfers):
+        try:
+            results.append(move_funds(sender, receiver, amount, allow_partial))
+        except Exception as e:
+            if not atomic:
+                results.append(e)
+                continue
+            for handle_id, balance in snapshot.items():
+                if balance is not None and balance_cache[handle_id] != balance:
+                    set_current_balance_handle_id(handle_id, balance)
+            raise BatchTransferError(index) from e
+
+    for result in results:
+        if isinstance(result, Transaction):
+            await record_transaction(result)
+    return results
+
+
+def move_funds(
+    sender_handle: str | None,
+    receiver_handle: str | None,
+    amount: int,
+    allow_partial=False,
+    operation=TransTypes.Transfer,
+):
+    """Update the balances for a transfer, without recording it anywhere"""
     if sender_handle == receiver_handle:
         raise InvalidPartiesError(sender_handle, receiver_handle)
 
@@ -304,8 +278,6 @@ async def transfer_funds(
             f"from {transaction.payer} to {transaction.recip}."
         )
 
-    await record_transaction(transaction)
-
     return transaction
 
 
@@ -535,6 +507,7 @@ def find_transaction_parties(transaction: Transaction):
                 transaction.recip_actor = recip_handle.actor_id
 
 
+@metrics.timed("finances.try_to_pay")
 async def try_to_pay(transaction: Transaction, from_reaction: bool = False):
     if transaction.payer == transaction.recip:
         # Cannot transfer to yourself, and cannot transfer to unknown messages
@@ -581,6 +554,13 @@ async def try_to_pay(transaction: Transaction, from_reaction: bool = False):
 
 async def record_transaction(transaction: Transaction):
     record_transaction_internal(transaction)
+    events.publish(
+        "transaction",
+        payer=transaction.payer,
+        recip=transaction.recip,
+        amount=int(transaction.amount),
+        cause=TransTypes(transaction.cause).name.lower(),
+    )
     if int(transaction.amount) == 0:
         # No need to write anything for 0-transactions, should they occur
         return
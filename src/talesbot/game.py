@@ -4,8 +4,7 @@ import asyncio
 import logging
 from enum import Enum
 
-from . import channels, chats, handles, player_setup, players
-from .common import gm_announcements_name
+from . import alerts, channels, chats, events, handles, player_setup, players
 
 # Game-wide state. Only put general info here; anything specific should go in players / shops / groups / scenarios etc.
 
@@ -29,6 +28,7 @@ def get_network_status():
 def set_network_status(new: NetworkState):
     global network_status
     network_status = new
+    events.publish("network", status=new.value)
 
 
 def can_process_messages():
@@ -90,6 +90,7 @@ def is_handle_reserved(handle_id: str):
 def init():
     for handle in player_setup.get_all_reserved():
         reserved_handles.add(handle)
+    alerts.init()
     # TODO: purge landig page, send welcome message
 
 
@@ -116,19 +117,30 @@ def is_2party_chat_possible(handle_a: str, handle_b: str):
 
 
 async def check_alerts(message_string: str, channel, user_id: str):
-    if "welcome the tree of light" in message_string:
-        alerts_channels = channels.get_discord_channels_from_name(gm_announcements_name)
+    rules = alerts.matcher.find(message_string)
+    if len(rules) == 0:
+        return
+    sender = players.get_player_id(user_id)
+    handle = handles.get_active_handle_id(sender)
+    # A channel gets the message once, even if several of its rules matched
+    channel_names: dict[str, str] = {}
+    for rule in rules:
+        if alerts.matcher.take_cooldown(rule, sender):
+            channel_names.update(dict.fromkeys(rule.channels, rule.name))
+    send_tasks = []
+    for channel_name, rule_name in channel_names.items():
+        alerts_channels = channels.get_discord_channels_from_name(channel_name)
         if not alerts_channels:
-            logger.warning("Could not send gm announcement - no channels found")
-        sender = players.get_player_id(user_id)
-        handle = handles.get_active_handle_id(sender)
-        send_tasks = (
+            logger.warning(
+                f"Could not send alert {rule_name} - no channels named {channel_name}"
+            )
+        send_tasks.extend(
             asyncio.create_task(
                 _send_alert_msg(alerts_channel, sender, handle, channel, message_string)
             )
             for alerts_channel in alerts_channels
         )
-        await asyncio.gather(*send_tasks)
+    await asyncio.gather(*send_tasks)
 
 
 async def _send_alert_msg(
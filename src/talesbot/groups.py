@@ -13,13 +13,13 @@ from typing import Dict, List, cast
 
 import discord
 import simplejson
-from configobj import ConfigObj
 
 # Custom imports
 from . import channels, common, handles, players, server
 from .common import group_role_start, highest_ever_index
 from .config import config_dir
 from .custom_types import Handle, HandleTypes
+from .storage import ConfigObj
 
 # TODO: show members?
 
@@ -2,16 +2,11 @@ import asyncio
 import re
 from enum import Enum
 
-from configobj import ConfigObj
-from discord import Interaction, app_commands
-from discord.ext import commands
-
-from talesbot import checks
-
-from . import actors, chats, finances, game, gm, players
+from . import chats, finances, game, gm, players
 from .common import coin
 from .config import config_dir
 from .custom_types import ActionResult, Handle, HandleTypes
+from .storage import ConfigObj
 
 ### Module handles.py
 # This module tracks and handles state related to handles, e.g. in-game names/accounts that
@@ -20,117 +15,6 @@ from .custom_types import ActionResult, Handle, HandleTypes
 # TODO: use the same semaphore for handles and /join
 
 
-class HandlesCog(commands.Cog, name="handles"):
-    """Commands related to handles.
-    Your handle is how you appear to other users in most other channels.
-    Each handle has its own separate finances (see \".help finances\").
-    These commands can also be used in your chat hub channel."""
-
-    def __init__(self, bot):
-        self.bot = bot
-        self._last_member = None
-
-    # Commands related to handles
-    # These work in both cmd_line and chat_hub channels
-
-    @app_commands.command(name="show_handle", description="Show current handle")
-    async def handle_command(self, interaction: Interaction):
-        await self.handle_command_internal(interaction, None, burner=False)
-
-    @app_commands.command(
-        name="handle",
-        description="Switch to another handle. It will be created if not exists already.",
-    )
-    async def switch_handle_command(self, interaction: Interaction, handle_name: str):
-        await self.handle_command_internal(interaction, handle_name, burner=False)
-
-    @app_commands.command(description="Show current handle for the gm user")
-    @checks.is_gm
-    async def show_gm_handle(self, interaction: Interaction):
-        await self.handle_command_internal(
-            interaction, None, burner=False, use_gm_actor=True
-        )
-
-    @app_commands.command(description="Switch handle for gm user")
-    @checks.is_gm
-    async def gm_handle(self, interaction: Interaction, handle_name: str):
-        await self.handle_command_internal(
-            interaction, handle_name, burner=False, use_gm_actor=True
-        )
-
-    @app_commands.command(
-        name="burner",
-        description="Create a new burner handle or switch to existing burner.",
-    )
-    async def create_burner_command(self, ctx, burner_name: str):
-        await self.handle_command_internal(ctx, burner_name, burner=True)
-
-    async def handle_command_internal(
-        self,
-        interaction: Interaction,
-        new_handle: str | None = None,
-        burner: bool = False,
-        use_gm_actor: bool = False,
-    ):
-        # Note: this command may edit handles but may also be read-only.
-        # The below function will claim handles semaphore if editing is required.
-        await interaction.response.defer(ephemeral=True)
-        response = await process_handle_command(
-            interaction.user.id, new_handle, burner=burner, use_gm_actor=use_gm_actor
-        )
-        await interaction.followup.send(response, ephemeral=True)
-
-    @app_commands.command(name="handles", description="Show all your handles.")
-    async def handles_command(self, interaction: Interaction):
-        await interaction.response.defer(ephemeral=True)
-        response = await get_full_handles_report(interaction.user.id)
-        await interaction.followup.send(response, ephemeral=True)
-
-    @app_commands.command(
-        name="show_handles", description="Show all handles for another player."
-    )
-    @checks.is_gm
-    async def show_handles_command(self, interaction: Interaction, handle_id: str):
-        await interaction.response.defer(ephemeral=True)
-        response = await get_full_handles_report_for_handle(handle_id)
-        await interaction.followup.send(response, ephemeral=True)
-
-    @app_commands.command(name="burn", description="Destroy a burner account forever.")
-    async def burn_command(self, interaction: Interaction, burner_name: str):
-        await interaction.response.defer(ephemeral=True)
-        async with semaphore():
-            response = await process_burn_command(interaction.user.id, burner_name)
-        await interaction.followup.send(response, ephemeral=True)
-
-    @app_commands.command(
-        name="clear_all_handles",
-        description="Admin-only. Remove all handles and reset all users",
-        #        help='Admin-only. Remove all handles (including all financial info) and reset all users to their original handle uXXXX.'
-    )
-    @checks.is_gm
-    async def clear_handles_command(self, interaction: Interaction):
-        await interaction.response.defer(ephemeral=True)
-        async with semaphore():
-            await clear_all_handles()
-            await actors.init(clear_all=False)
-        await interaction.followup.send("Done.", ephemeral=True)
-
-    @app_commands.command(
-        name="remove_handle",
-        description="Admin-only. Remove a handle (including all financial info) without a trace.",
-    )
-    @checks.is_gm
-    async def remove_handle_command(self, interaction: Interaction, handle_id: str):
-        await interaction.response.defer(ephemeral=True)
-        async with semaphore():
-            report = await process_remove_handle_command(handle_id)
-        await interaction.followup.send(report, ephemeral=True)
-
-
-async def setup(bot):
-    await bot.add_cog(HandlesCog(bot))
-
-
 handles_semaphore = asyncio.Semaphore(1)
 
 
@@ -151,6 +35,12 @@ last_regular_index = "___last_regular"
 handles_index = "___all_handles"
 
 
+# handle -> its auto-respond message, for the handles that have one. Kept up to
+# date by store_handle and clear_handle, so that chats can look for
+# auto-responders on every message without reading any handles.
+auto_responders: dict[str, str] = {}
+
+
 def get_handles_confobj():
     handles = ConfigObj(str(config_dir / handles_conf_dir / "__handles.conf"))
     if handles_to_actors not in handles:
@@ -198,6 +88,21 @@ async def init(clear_all: bool = False):
     handles.write()
     if clear_all:
         await clear_all_handles()
+    auto_responders.clear()
+    for actor_id in handles[actors_index]:
+        for handle in get_handles_for_actor(actor_id, include_burnt=True):
+            register_auto_responder(handle)
+
+
+def register_auto_responder(handle: Handle):
+    if handle.auto_respond_message:
+        auto_responders[handle.handle_id] = handle.auto_respond_message
+    else:
+        auto_responders.pop(handle.handle_id, None)
+
+
+def get_auto_respond_message(handle_id: str) -> str | None:
+    return auto_responders.get(handle_id)
 
 
 async def clear_all_handles():
@@ -221,6 +126,7 @@ async def clear_all_handles_for_actor(actor_id: str):
 # TODO: remove old chats?
 async def clear_handle(handle: Handle):
     await finances.deinit_finances_for_handle(handle, record=False)
+    auto_responders.pop(handle.handle_id, None)
     handles = get_handles_confobj()
     if handle.handle_id in handles[handles_to_actors]:
         del handles[handles_to_actors][handle.handle_id]
@@ -244,6 +150,8 @@ async def init_handles_for_actor(
         handles.write()
         file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
         actor_handles_conf = ConfigObj(file_name)
+        for handle_id in actor_handles_conf.get(handles_index, {}):
+            auto_responders.pop(handle_id, None)
         for entry in actor_handles_conf:
             del actor_handles_conf[entry]
         actor_handles_conf[handles_index] = {}
@@ -264,6 +172,7 @@ def store_handle(handle: Handle):
     actor_handles_conf = ConfigObj(file_name)
     actor_handles_conf[handles_index][handle.handle_id] = handle.to_string()
     actor_handles_conf.write()
+    register_auto_responder(handle)
 
 
 async def create_handle(
@@ -0,0 +1,139 @@
+### Module ipc.py
+# Local IPC between the bot process and separate API worker processes.
+# Each request and response is a single line of JSON over a unix socket, so
+# anything that needs the bot's state or Discord connection can be run by the
+# bot process on behalf of a worker. Workers keep their connections open and
+# send one request after another over them. Stream requests get one response
+# line per item until either side closes the connection.
+
+import asyncio
+import contextlib
+import logging
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+import simplejson
+
+logger = logging.getLogger(__name__)
+
+# Batch requests can be large, the default 64 KiB line limit is not enough
+line_limit = 16 * 1024 * 1024
+
+type Handler = Callable[[dict[str, Any]], Awaitable[Any]]
+type StreamHandler = Callable[[dict[str, Any]], AsyncIterator[Any]]
+
+
+class IpcError(Exception):
+    """The bot process failed to handle a request"""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        # Set when the handler failed with an HTTP error
+        self.status_code = status_code
+
+
+def _encode(obj: Any) -> bytes:
+    return simplejson.dumps(obj).encode() + b"\n"
+
+
+async def serve(
+    path: str,
+    handlers: dict[str, Handler],
+    stream_handlers: dict[str, StreamHandler] | None = None,
+) -> asyncio.Server:
+    if stream_handlers is None:
+        stream_handlers = {}
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                request = simplejson.loads(line)
+                if request["op"] in stream_handlers:
+                    # The connection belongs to the stream from now on
+                    items = stream_handlers[request["op"]](request["args"])
+                    async with contextlib.aclosing(items):
+                        async for item in items:
+                            writer.write(_encode({"ok": True, "result": item}))
+                            await writer.drain()
+                    break
+                try:
+                    handler = handlers[request["op"]]
+                    response = {"ok": True, "result": await handler(request["args"])}
+                except Exception as e:
+                    status_code = getattr(e, "status_code", None)
+                    if status_code is None:
+                        logger.exception(f"Failed IPC request {request.get('op')}")
+                    response = {
+                        "ok": False,
+                        "error": str(getattr(e, "detail", e)),
+                        "status_code": status_code,
+                    }
+                writer.write(_encode(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(on_connection, path=path, limit=line_limit)
+
+
+type Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class Client:
+    """Calls the bot process over a few connections that are kept open. A
+    connection carries one call at a time, so that its responses cannot get
+    mixed up, and goes back to the pool when the call is done."""
+
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self.slots = asyncio.Semaphore(size)
+        self.idle: list[Connection] = []
+
+    async def call(self, op: str, args: dict[str, Any] | None = None) -> Any:
+        async with self.slots:
+            if self.idle:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=line_limit
+                )
+            try:
+                writer.write(
+                    _encode({"op": op, "args": args if args is not None else {}})
+                )
+                await writer.drain()
+                line = await reader.readline()
+            except BaseException:
+                # Half a call, the connection cannot be used again
+                writer.close()
+                raise
+            if not line:
+                writer.close()
+                raise IpcError(f"Bot process closed the connection during {op}")
+            self.idle.append((reader, writer))
+
+        response = simplejson.loads(line)
+        if not response["ok"]:
+            raise IpcError(response["error"], response.get("status_code"))
+        return response["result"]
+
+
+async def stream(
+    path: str, op: str, args: dict[str, Any] | None = None
+) -> AsyncIterator[Any]:
+    reader, writer = await asyncio.open_unix_connection(path, limit=line_limit)
+    try:
+        writer.write(_encode({"op": op, "args": args if args is not None else {}}))
+        await writer.drain()
+        while line := await reader.readline():
+            response = simplejson.loads(line)
+            if not response["ok"]:
+                raise IpcError(response["error"])
+            yield response["result"]
+    finally:
+        writer.close()
@@ -1,7 +1,48 @@
+import atexit
+import copy
+import gzip
 import logging
 import logging.config
+import logging.handlers
+import os
+import shutil
 from typing import Any
 
+from .archive import ArchiveHandler
+from .config import config
+
+
+class ExcludeFilter(logging.Filter):
+    """The opposite of logging.Filter: drops records from the logger `name`
+    and its children"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not super().filter(record)
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that can gzip the files it rotates out"""
+
+    def __init__(self, filename: str, compress: bool = False, **kwargs):
+        super().__init__(filename, **kwargs)
+        if compress:
+            self.namer = compressed_name
+            self.rotator = compress_file
+
+
+def compressed_name(name: str) -> str:
+    return f"{name}.gz"
+
+
+def compress_file(source: str, dest: str):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+# Everything logged under talesbot goes through a single QueueHandler, and a
+# QueueListener thread does the formatting, writing and rotating. That keeps
+# file I/O (and gzipping rotated files) off the event loop.
 LOGGING_CONFIG: dict[str, Any] = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -16,41 +57,111 @@ LOGGING_CONFIG: dict[str, Any] = {
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
         "messages": {
-            "format": "%(message)s",
+            "format": "%(asctime)s.%(msecs)03d : %(message)s",
+            "datefmt": "%Y-%m-%d %H:%M:%S",
+        },
+    },
+    "filters": {
+        # The listener hands every record to every handler, so the handlers
+        # pick out their own loggers
+        "not_messages": {
+            "()": ExcludeFilter,
+            "name": "talesbot.messages",
         },
+        "messages": {"name": "talesbot.messages"},
+        "slow_commands": {"name": "talesbot.slow_commands"},
     },
     "handlers": {
         "default": {
             "formatter": "console",
             "class": "logging.StreamHandler",
             "stream": "ext://sys.stderr",
+            "filters": ["not_messages"],
         },
-        "file": {
-            "formatter": "full",
-            "class": "logging.handlers.RotatingFileHandler",
-            "filename": "config/logs/app.log",
-        },
-        "messages": {
-            "formatter": "messages",
-            "class": "logging.handlers.RotatingFileHandler",
-            "filename": "config/logs/messages.log",
+        "queue": {
+            "class": "logging.handlers.QueueHandler",
+            "handlers": ["default"],
+            "respect_handler_level": True,
         },
     },
     "loggers": {
         "talesbot": {
-            "handlers": ["default", "file"],
+            "handlers": ["queue"],
             "level": "DEBUG",
             "propagate": False,
         },
         "talesbot.messages": {
-            "handlers": ["messages"],
+            "handlers": ["queue"],
             "level": "INFO",
             "propagate": False,
         },
+        # Propagates to talesbot, so slow commands are in app.log too
+        "talesbot.slow_commands": {
+            "level": "INFO",
+        },
         # "discord.client": {"handlers": ["default"], "level": "DEBUG"},
     },
 }
 
+FILE_HANDLERS: dict[str, dict[str, Any]] = {
+    "file": {
+        "formatter": "full",
+        "filename": "config/logs/app.log",
+        "filters": ["not_messages"],
+    },
+    "messages": {
+        "formatter": "messages",
+        "filename": "config/logs/messages.log",
+        "filters": ["messages"],
+    },
+    "slow_commands": {
+        "formatter": "full",
+        "filename": "config/logs/slow_commands.log",
+        "filters": ["slow_commands"],
+    },
+}
+
+listener: logging.handlers.QueueListener | None = None
+
+
+def logging_config(console_level: str = "DEBUG") -> dict[str, Any]:
+    # dictConfig consumes parts of the dict it is given
+    result = copy.deepcopy(LOGGING_CONFIG)
+    handlers = result["handlers"]
+    handlers["default"]["level"] = console_level
+    if config.FILE_LOGGING:
+        for name, handler in FILE_HANDLERS.items():
+            handlers[name] = {
+                **copy.deepcopy(handler),
+                "()": RotatingFileHandler,
+                "maxBytes": config.LOG_MAX_BYTES,
+                "backupCount": config.LOG_BACKUP_COUNT,
+                "compress": config.LOG_COMPRESS,
+                "encoding": "utf-8",
+                "delay": True,
+            }
+        handlers["archive"] = {"()": ArchiveHandler, "filters": ["messages"]}
+        handlers["queue"]["handlers"] = ["default", *FILE_HANDLERS, "archive"]
+    return result
+
+
+def init_loggers(console_level: str = "DEBUG"):
+    global listener
+    stop_loggers()
+    logging.config.dictConfig(logging_config(console_level))
+    queue_handler = logging.getHandlerByName("queue")
+    assert isinstance(queue_handler, logging.handlers.QueueHandler)
+    listener = queue_handler.listener
+    assert listener is not None
+    listener.start()
+
+
+def stop_loggers():
+    """Writes out whatever is still queued and stops the listener thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
 
-def init_loggers():
-    logging.config.dictConfig(LOGGING_CONFIG)
+atexit.register(stop_loggers)
@@ -0,0 +1,93 @@
+### Module loop_monitor.py
+# Measures event loop lag, and finds out what blocked the loop when it lags.
+# A task on the loop records a heartbeat every `interval` seconds, and a
+# watchdog thread checks that heartbeat. If it is overdue by more than
+# `threshold`, the loop thread is stuck in synchronous code (conf file I/O,
+# CSV parsing, ...), so the watchdog grabs that thread's current stack.
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+loop_lag_seconds = metrics.histogram(
+    "talesbot_loop_lag_seconds",
+    "How late the event loop was in running a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+loop_blocked = metrics.counter(
+    "talesbot_loop_blocked_total",
+    "Times the event loop was blocked past the threshold, by blocking call site",
+    ["site"],
+)
+
+
+def _call_site(stack: traceback.StackSummary) -> str:
+    # The innermost frame in our own code is the call that blocks; anything
+    # below it is library code doing what it was asked to
+    for frame in reversed(stack):
+        filename = frame.filename.replace("\\", "/")
+        if "/talesbot/" in filename:
+            module = filename.rsplit("/talesbot/", 1)[-1]
+            return f"{module}:{frame.lineno} {frame.name}"
+    if len(stack) > 0:
+        return f"{stack[-1].filename}:{stack[-1].lineno} {stack[-1].name}"
+    return "unknown"
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.loop_thread_id: int | None = None
+        # Call site of the current stall, set by the watchdog thread
+        self.stall_site: str | None = None
+        self.stopped = threading.Event()
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        watchdog = threading.Thread(
+            target=self.watch, name="loop-watchdog", daemon=True
+        )
+        watchdog.start()
+        try:
+            while True:
+                self.last_beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(time.monotonic() - self.last_beat - self.interval, 0)
+                loop_lag_seconds.observe(lag)
+                if lag > self.threshold:
+                    site = self.stall_site or "unknown"
+                    logger.warning(f"Event loop was blocked for {lag:.3f}s at {site}")
+                self.stall_site = None
+        finally:
+            self.stopped.set()
+
+    def watch(self):
+        reported_beat = None
+        while not self.stopped.wait(self.threshold / 2):
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue <= self.threshold or beat == reported_beat:
+                continue
+            # Only one stack per stall
+            reported_beat = beat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            site = _call_site(stack)
+            self.stall_site = site
+            loop_blocked.inc(site)
+            logger.warning(
+                f"Event loop blocked for more than {overdue:.3f}s at {site}:\n"
+                + "".join(stack.format())
+            )
@@ -0,0 +1,275 @@
+### Module metrics.py
+# Process-wide metrics, rendered in the Prometheus text format on /metrics.
+# Recording a value is a dict update (plus a bisect for histograms), so the
+# instrumentation stays on in production; the text is only built when scraped.
+
+import bisect
+import functools
+import time
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+
+import aiohttp
+
+type Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [
+        f'{name}="{_escape(str(value))}"'
+        for name, value in zip(names, values, strict=True)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels: Labels = tuple(labels)
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        """(metric name, rendered labels, value) for every sample"""
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in list(self.values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Metric):
+    """Either set directly, or computed by a function when scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self.values: dict[Labels, float] = {}
+        self.functions: dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+    def set_function(self, function: Callable[[], float], *label_values: str):
+        self.functions[label_values] = function
+
+    def samples(self):
+        values = dict(self.values)
+        for label_values, function in list(self.functions.items()):
+            values[label_values] = function()
+        for label_values, value in values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = default_buckets,
+    ):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: count per bucket (last one is +Inf), sum
+        self.counts: dict[Labels, list[int]] = {}
+        self.sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, *label_values: str):
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+            self.sums[label_values] = 0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def samples(self):
+        for label_values, counts in list(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float("inf")], counts, strict=True):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels((*self.labels, "le"), (*label_values, le))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, self.sums[label_values]
+            yield f"{self.name}_count", labels, cumulative
+
+
+registry: dict[str, Metric] = {}
+
+
+def _register[M: Metric](metric: M) -> M:
+    if metric.name in registry:
+        raise ValueError(f"Metric {metric.name} is already registered")
+    registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, doc: str, labels: Iterable[str] = ()) -> Counter:
+    return _register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: Iterable[str] = ()) -> Gauge:
+    return _register(Gauge(name, doc, labels))
+
+
+def histogram(
+    name: str,
+    doc: str,
+    labels: Iterable[str] = (),
+    buckets: Iterable[float] = default_buckets,
+) -> Histogram:
+    return _register(Histogram(name, doc, labels, buckets))
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry.values()) + "\n"
+
+
+handler_seconds = histogram(
+    "talesbot_handler_seconds", "Time spent in hot-path handlers", ["handler"]
+)
+discord_requests = counter(
+    "talesbot_discord_requests_total",
+    "Discord REST requests, by HTTP method and response status",
+    ["method", "status"],
+)
+discord_rate_limited = counter(
+    "talesbot_discord_rate_limited_total",
+    "Discord REST responses with status 429, by rate limit scope",
+    ["scope"],
+)
+storage_reads = counter(
+    "talesbot_storage_reads_total", "Conf files parsed, by file family", ["family"]
+)
+storage_read_bytes = counter(
+    "talesbot_storage_read_bytes_total", "Bytes of conf files parsed", ["family"]
+)
+storage_writes = counter(
+    "talesbot_storage_writes_total", "Conf files written, by file family", ["family"]
+)
+storage_written_bytes = counter(
+    "talesbot_storage_written_bytes_total", "Bytes of conf files written", ["family"]
+)
+queue_depth = gauge(
+    "talesbot_queue_depth", "Items waiting in internal queues", ["queue"]
+)
+dispatch_wait_seconds = histogram(
+    "talesbot_dispatch_wait_seconds",
+    "Time messages wait in their channel's queue before being processed",
+    ["kind"],
+)
+command_seconds = histogram(
+    "talesbot_command_seconds", "Wall time of app commands", ["command"]
+)
+command_ack_seconds = histogram(
+    "talesbot_command_ack_seconds",
+    "Time until an app command responded to or deferred the interaction",
+    ["command"],
+)
+command_rest_calls = counter(
+    "talesbot_command_rest_calls_total",
+    "Discord REST requests made by app commands",
+    ["command"],
+)
+command_storage_ops = counter(
+    "talesbot_command_storage_ops_total",
+    "Conf file reads and writes made by app commands",
+    ["command", "op"],
+)
+command_missed_deadline = counter(
+    "talesbot_command_missed_deadline_total",
+    "App commands that did not acknowledge the interaction in time",
+    ["command"],
+)
+
+
+class CommandStats:
+    """Work done on behalf of one app command, collected through
+    `current_command` by the code that does the work"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Seconds from start until the interaction callback (response or defer)
+        self.acked: float | None = None
+        self.ack_status: int | None = None
+        self.rest_calls = 0
+        self.storage_reads = 0
+        self.storage_writes = 0
+
+
+current_command: ContextVar[CommandStats | None] = ContextVar(
+    "current_command", default=None
+)
+
+
+def timed(handler: str):
+    """Records the duration of every call to the decorated coroutine function"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                handler_seconds.observe(time.perf_counter() - start, handler)
+
+        return wrapper
+
+    return decorator
+
+
+def discord_trace_config() -> aiohttp.TraceConfig:
+    """Counts the requests that discord.py makes, including the rate limited
+    ones it retries by itself"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_end(session, context, params: aiohttp.TraceRequestEndParams):
+        status = params.response.status
+        scope = params.response.headers.get("X-RateLimit-Scope", "unknown")
+        record_discord_request(params.method, params.url.path, status, scope)
+
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+def record_discord_request(method: str, path: str, status: int, scope="unknown"):
+    discord_requests.inc(method, str(status))
+    stats = current_command.get()
+    if stats is not None:
+        stats.rest_calls += 1
+        if stats.acked is None and path.endswith("/callback"):
+            stats.acked = time.perf_counter() - stats.start
+            stats.ack_status = status
+    if status == 429:
+        discord_rate_limited.inc(scope)
@@ -3,7 +3,6 @@ from typing import List
 from warnings import deprecated
 
 import simplejson
-from configobj import ConfigObj
 
 from . import actors, channels, finances, groups, handles, reactions, shops
 from .common import coin, emoji_accept
@@ -11,6 +10,7 @@ from .config import config_dir
 from .custom_types import ActionResult, Actor, Handle, HandleTypes, PlayerData
 from .known_handles import KnownHandle, read_known_handles
 from .shops import Shop
+from .storage import ConfigObj
 
 # Known_handles is meant to be read-only during the event
 # It can be edited manually
@@ -3,7 +3,6 @@ import logging
 from typing import List, cast
 
 import discord
-from configobj import ConfigObj
 
 from talesbot import gm
 
@@ -16,6 +15,7 @@ from .common import (
 from .config import config_dir
 from .custom_types import Handle, PlayerData
 from .groups import Group
+from .storage import ConfigObj
 
 players_conf_dir = "players"
 user_id_mappings_index = "___user_id_to_player_id"
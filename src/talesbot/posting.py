@@ -1,5 +1,6 @@
 import asyncio
 import re
+from collections.abc import Iterable, Iterator
 
 import discord
 
@@ -82,6 +83,48 @@ def create_post(
     return content
 
 
+# Discord's limit on the length of a message
+max_message_length = 2000
+
+
+def split_post(post: str, limit: int = max_message_length) -> list[str]:
+    """Splits a post that is too long for one message, at a line break or
+    space if there is one"""
+    parts = []
+    while len(post) > limit:
+        cut = post.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = post.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(post[:cut])
+        post = post[cut:].lstrip("\n")
+    parts.append(post)
+    return parts
+
+
+def pack_posts(
+    posts: Iterable[tuple[int, str]], limit: int = max_message_length
+) -> Iterator[tuple[int, str, bool]]:
+    """Joins posts with line breaks into as few messages as possible. Each
+    message comes with the key (e.g. log index) of the first post in it, and
+    whether it starts with the rest of a post split over several messages."""
+    key = -1
+    message = ""
+    continued = False
+    for post_key, post in posts:
+        for part_index, part in enumerate(split_post(post, limit)):
+            if message == "":
+                key, message, continued = post_key, part, part_index > 0
+            elif len(message) + 1 + len(part) <= limit:
+                message += "\n" + part
+            else:
+                yield key, message, continued
+                key, message, continued = post_key, part, part_index > 0
+    if message != "":
+        yield key, message, continued
+
+
 # TODO: pass in "full_post : bool" instead of checking sender == None
 async def repost_message_to_channel(
     channel, msg_data: MessageData, sender: str | None, recip: str | None = None
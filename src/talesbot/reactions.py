@@ -11,6 +11,7 @@ from . import (
     custom_types,
     finances,
     game,
+    metrics,
     players,
     posting,
     shops,
@@ -171,6 +172,7 @@ def clear_reaction_semaphores():
         del reactions_semaphores[sem_id]
 
 
+@metrics.timed("reactions.process_reaction_add")
 async def process_reaction_add(message_id: int, user_id: int, channel, emoji):
     if not game.can_process_reactions() and not channels.is_chat_hub(channel.name):
         # Remove the reaction
@@ -10,10 +10,10 @@ from enum import Enum
 from typing import List
 
 import simplejson
-from configobj import ConfigObj
 
 from . import game, groups, handles, players
 from .config import config_dir
+from .storage import ConfigObj
 
 logger = logging.getLogger(__name__)
 
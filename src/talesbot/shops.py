@@ -9,14 +9,19 @@ from typing import Dict, List, cast
 
 import discord
 import simplejson
-from configobj import ConfigObj
-from discord import Interaction, app_commands
-from discord.ext import commands
-
-from talesbot import checks
 
 # Custom imports
-from . import actors, channels, common, finances, handles, players, server
+from . import (
+    actors,
+    channels,
+    common,
+    events,
+    finances,
+    handles,
+    metrics,
+    players,
+    server,
+)
 from .common import (
     coin,
     emoji_accept,
@@ -36,6 +41,7 @@ from .custom_types import (
     TransTypes,
 )
 from .errors import NotRegisterdError
+from .storage import ConfigObj
 
 logger = logging.getLogger(__name__)
 
@@ -56,263 +62,6 @@ type GuildChannel = (
 # TODO: change so that a shop does not have to have an owner to function
 
 
-class ShoppingCog(commands.Cog, name="shopping"):
-    """Commands related to buying and ordering at stores and restaurants.
-    If you work at a store/restaurant, see \".help employee\" instead."""
-
-    def __init__(self, bot):
-        self.bot = bot
-
-    @app_commands.command(
-        description="Order a product from a shop",
-    )
-    async def order(
-        self,
-        interaction: discord.Interaction,
-        product_name: str,
-        shop_name: str = "trinity_taskbar",
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await order_product_from_command(
-            str(interaction.user.id), shop_name, product_name
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(
-        description="Admin-only. Order a product from a shop for someone else.",
-    )
-    @checks.is_gm
-    async def order_other(
-        self,
-        interaction: Interaction,
-        buyer: str,
-        product_name: str,
-        shop_name: str = "trinity_taskbar",
-    ):
-        await interaction.response.defer(ephemeral=True)
-        buyer_handle: Handle = handles.get_handle(buyer)
-        report = await order_product_for_buyer(shop_name, product_name, buyer_handle)
-        if report is None:
-            report = "Unknown error. Contact system admin"
-        await interaction.followup.send(report, ephemeral=True)
-
-
-class EmployeeCog(commands.GroupCog, group_name="shop"):
-    """Commands related to working at a store or restaurant."""
-
-    def __init__(self, bot):
-        self.bot = bot
-
-    # Commands related to managing a shop
-    # These only work in cmd_line channels
-
-    @app_commands.command(
-        description="Create a new shop, run by a certain player.",
-    )
-    @checks.is_gm
-    async def create(self, interaction: Interaction, shop_name: str, player_id: str):
-        await interaction.response.defer(ephemeral=True)
-        async with handles.semaphore():
-            result: ActionResult = await create_shop(
-                shop_name, player_id, is_owner=True
-            )
-            report = (
-                result.report
-                if result.report is not None
-                else "Unknown error. Contact system admin."
-            )
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(description="Add a new employee to your shop.")
-    async def employ(
-        self, interaction: Interaction, handle_id: str, shop_name: str = None
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await process_employ_command(
-            str(interaction.user.id), handle_id, shop_name
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(
-        description="Shop owner only: remove an employee from your shop."
-    )
-    async def fire(
-        self, interaction: Interaction, handle_id: str, shop_name: str = None
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await process_fire_command(
-            str(interaction.user.id), handle_id, shop_name
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    product_g = app_commands.Group(name="product", description="Manage store products")
-
-    @product_g.command(
-        name="add",
-        description="Add a new product to the shop.",
-    )
-    async def add_product(
-        self,
-        interaction: Interaction,
-        product_name: str,
-        description: str | None = None,
-        price: int = 0,
-        symbol: str | None = None,
-        shop_name: str | None = None,
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await add_product(
-            str(interaction.user.id),
-            product_name,
-            description,
-            price,
-            symbol,
-            shop_name,
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @product_g.command(
-        name="edit",
-        description="Edit one of the shop's existing products. Don't forget to re-publish menu after changes.",
-    )
-    async def edit_product(
-        self,
-        interaction: Interaction,
-        product_name: str,
-        key: str | None = None,
-        value: str | None = None,
-        shop_name: str | None = None,
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await edit_product_from_command(
-            str(interaction.user.id), product_name, key, value, shop_name
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @product_g.command(
-        name="remove",
-        description="Delete a product from the shop.",
-    )
-    async def remove_product(
-        self, interaction: Interaction, product_name: str, shop_name: str = None
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await remove_product(str(interaction.user.id), product_name, shop_name)
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @product_g.command(
-        name="stock",
-        description="Set a product to be in stock / out of stock. Value can be either True or False",
-    )
-    async def stock_product(
-        self,
-        interaction: Interaction,
-        product_name: str,
-        value: bool = True,
-        shop_name: str | None = None,
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await edit_product_from_command(
-            str(interaction.user.id), product_name, "in_stock", str(value), shop_name
-        )
-        if report is None:
-            report = "Unknown error. Contact system admin."
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(
-        description="Publish the current catalogue/menu",
-    )
-    async def publish_menu(
-        self,
-        interaction: Interaction,
-        product_name: str | None = None,
-        shop_name: str | None = None,
-    ):
-        await interaction.response.defer(ephemeral=True)
-        if product_name is not None:
-            report = await _update_storefront_channel(
-                str(interaction.user.id), product_name, shop_name
-            )
-        else:
-            report = await update_storefront(str(interaction.user.id), shop_name)
-        if report is None:
-            report = "Command finished without any output."
-
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(
-        description="Shop owner only: clear your shop's orders.",
-    )
-    async def clear_orders(
-        self, interaction: Interaction, shop_name: str | None = None
-    ):
-        await interaction.response.defer(ephemeral=True)
-        await reinitialize(str(interaction.user.id), shop_name)
-        report = await update_storefront(str(interaction.user.id), shop_name)
-        await interaction.followup.send(report, ephemeral=True)
-
-    @app_commands.command(
-        description="Set which handle should get your tips. If no handle is given you will not be shown at all.",
-    )
-    async def set_tips(
-        self,
-        interaction: Interaction,
-        handle_id: str | None = None,
-        shop_name: str | None = None,
-    ):
-        await interaction.response.defer(ephemeral=True)
-        report = await set_tips_for_user(str(interaction.user.id), handle_id, shop_name)
-        if report is None:
-            report = "Unknown error. Contact system admin"
-        await interaction.followup.send(report, ephemeral=True)
-
-    @edit_product.autocomplete("product_name")
-    @remove_product.autocomplete("product_name")
-    @stock_product.autocomplete("product_name")
-    @publish_menu.autocomplete("product_name")
-    async def autocomplete_product_name(
-        self, interaction: Interaction, current: str
-    ) -> list[app_commands.Choice[str]]:
-        return [
-            app_commands.Choice(name=product.name, value=cast(str, product.product_id))
-            for product in get_all_products("trinity_taskbar")
-            if current.lower() in product.name.lower()
-        ]
-
-    @add_product.autocomplete("shop_name")
-    @edit_product.autocomplete("shop_name")
-    @remove_product.autocomplete("shop_name")
-    @stock_product.autocomplete("shop_name")
-    @publish_menu.autocomplete("shop_name")
-    @clear_orders.autocomplete("shop_name")
-    @set_tips.autocomplete("shop_name")
-    async def autocomplete_shop_name(
-        self, interaction: Interaction, current: str
-    ) -> list[app_commands.Choice[str]]:
-        return [
-            app_commands.Choice(name=id, value=id)
-            for id in get_all_shop_ids()
-            if current.lower() in id.lower()
-        ]
-
-
-async def setup(bot: commands.Bot):
-    await bot.add_cog(ShoppingCog(bot))
-    await bot.add_cog(EmployeeCog(bot))
-
-
 emoji_shopping = "🛒"
 emoji_ramen = "🍜"
 
@@ -1988,6 +1737,7 @@ def clear_order_semaphores_for_shop(shop_id: str):
             del delivery_ids_semaphores[sem_id]
 
 
+@metrics.timed("shops.order_product")
 async def order_product(shop: Shop, product: Product, buyer_handle: Handle):
     result = ActionResult()
     if not product.in_stock:
@@ -2067,6 +1817,19 @@ async def place_order_in_flow(
         await add_gui_reactions_to_order(message, OrderStatus.Active)
         order.order_flow_msg_id = message.id
     store_active_order(shop.shop_id, order)
+    publish_order_event(shop, order, OrderStatus.Active)
+
+
+def publish_order_event(shop: Shop, order: Order, status: OrderStatus):
+    events.publish(
+        "order",
+        shop=shop.shop_id,
+        order_id=order.order_id,
+        delivery_id=order.delivery_id,
+        items=order.items_ordered,
+        price=order.price_total,
+        status=status.name.lower(),
+    )
 
 
 async def add_to_active_order(
@@ -2109,6 +1872,7 @@ async def lock_active_order(shop: Shop, order: Order):
         order.order_flow_msg_id = message.id
 
     store_locked_order(shop.shop_id, order)
+    publish_order_event(shop, order, OrderStatus.Locked)
 
 
 async def deliver_order(shop: Shop, order: Order, status: OrderStatus):
@@ -2129,6 +1893,7 @@ async def deliver_order(shop: Shop, order: Order, status: OrderStatus):
     content = generate_order_message(order, OrderStatus.Delivered)
     await order_flow_message.edit(content=content)
     await add_gui_reactions_to_order(order_flow_message, OrderStatus.Delivered)
+    publish_order_event(shop, order, OrderStatus.Delivered)
     # No need to store the order now -- we hereby lose track of it in the backend
     # (The last message is left in the discord channel, but will disappear on the next clear_orders)
 
@@ -0,0 +1,61 @@
+### Module storage.py
+# ConfigObj as used for all conf files under config/, counting every parse and
+# write per file family: the directory under config/ (finances, chats, ...) or,
+# for files directly in config/, the file name itself.
+
+import contextlib
+import functools
+import os
+from pathlib import PurePath
+
+import configobj
+
+from . import metrics
+from .config import config_dir
+
+
+@functools.lru_cache(maxsize=4096)
+def file_family(path: str) -> str:
+    parent = PurePath(path).parent.name
+    if parent in ("", config_dir.name):
+        return PurePath(path).stem
+    return parent
+
+
+class ConfigObj(configobj.ConfigObj):
+    def __init__(self, infile=None, *args, **kwargs):
+        super().__init__(infile, *args, **kwargs)
+        if isinstance(infile, str):
+            family = file_family(infile)
+            metrics.storage_reads.inc(family)
+            stats = metrics.current_command.get()
+            if stats is not None:
+                stats.storage_reads += 1
+            # Nothing on disk if an empty conf was created
+            with contextlib.suppress(OSError):
+                metrics.storage_read_bytes.inc(family, amount=os.path.getsize(infile))
+
+    def write(self, outfile=None, section=None):
+        if outfile is None and section is None and self.filename is not None:
+            # Written next to the file and then moved over it, so that the API
+            # worker processes never read a file that is half written
+            filename = self.filename
+            self.filename = f"{filename}.tmp"
+            try:
+                result = super().write()
+            finally:
+                self.filename = filename
+            os.replace(f"{filename}.tmp", filename)
+        else:
+            result = super().write(outfile, section)
+        if outfile is None and section is None and self.filename is not None:
+            family = file_family(self.filename)
+            metrics.storage_writes.inc(family)
+            stats = metrics.current_command.get()
+            if stats is not None:
+                stats.storage_writes += 1
+            with contextlib.suppress(OSError):
+                metrics.storage_written_bytes.inc(
+                    family, amount=os.path.getsize(self.filename)
+                )
+        return result
@@ -1,7 +1,12 @@
+from collections import OrderedDict
+
 import discord
 from discord import Interaction, ui
 
-from ..database.models import Artifact
+from ..database import SessionM, artifact
+
+# Pages are fetched on demand, so only keep the most recently shown ones around
+page_cache_size = 5
 
 
 class NextButton(ui.Button["ArtifactView"]):
@@ -14,11 +19,9 @@ class NextButton(ui.Button["ArtifactView"]):
         view.page = min(view.page + 1, view.last_page)
         view.update_button_state()
 
-        content_page = view.artifact.content[view.page]
-        if content_page is not None:
-            await interaction.response.edit_message(
-                content=content_page.content, view=view
-            )
+        content = await view.get_page_content(view.page)
+        if content is not None:
+            await interaction.response.edit_message(content=content, view=view)
         else:
             await interaction.response.edit_message(
                 content="[no more pages]", view=None
@@ -35,11 +38,9 @@ class PrevButton(ui.Button["ArtifactView"]):
         view.page = max(view.page - 1, 0)
         view.update_button_state()
 
-        content_page = view.artifact.content[view.page]
-        if content_page is not None:
-            await interaction.response.edit_message(
-                content=content_page.content, view=view
-            )
+        content = await view.get_page_content(view.page)
+        if content is not None:
+            await interaction.response.edit_message(content=content, view=view)
         else:
             await interaction.response.edit_message(
                 content="[no more pages]", view=None
@@ -49,21 +50,45 @@ class PrevButton(ui.Button["ArtifactView"]):
 class ArtifactView(
     ui.View,
 ):
-    def __init__(self, artifact: Artifact, page: int = 0) -> None:
+    def __init__(
+        self,
+        artifact_id: int,
+        page_count: int,
+        page: int = 0,
+        page_content: str | None = None,
+    ) -> None:
         super().__init__(timeout=100)
-        self.artifact = artifact
+        self.artifact_id = artifact_id
         self.page: int = page
-        self.last_page = len(self.artifact.content) - 1
+        self.last_page = page_count - 1
+        self.pages: OrderedDict[int, str] = OrderedDict()
+        if page_content is not None:
+            self.pages[page] = page_content
 
         self.next = NextButton()
         self.prev = PrevButton()
 
-        if len(self.artifact.content) > 1:
+        if page_count > 1:
             self.add_item(self.prev)
             self.add_item(self.next)
 
         self.update_button_state()
 
+    async def get_page_content(self, page: int) -> str | None:
+        if page in self.pages:
+            self.pages.move_to_end(page)
+            return self.pages[page]
+
+        async with SessionM() as session:
+            content_page = await artifact.get_page(session, self.artifact_id, page)
+        if content_page is None:
+            return None
+
+        self.pages[page] = content_page.content
+        if len(self.pages) > page_cache_size:
+            self.pages.popitem(last=False)
+        return content_page.content
+
     def update_button_state(self):
         self.next.disabled = self.page == self.last_page
         self.next.style = (
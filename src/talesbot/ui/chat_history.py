@@ -0,0 +1,41 @@
+import discord
+from discord import ui
+
+
+class LoadEarlierButton(
+    ui.DynamicItem[ui.Button],
+    template=r"load_earlier:(?P<before>[0-9]+):(?P<handle_id>[^:]+):(?P<chat_name>.+)",
+):
+    """Button for showing the part of a chat's history that was left out when
+    the chat session was opened. Everything it needs is in its custom_id, so
+    it keeps working after a restart without keeping a view per message."""
+
+    def __init__(self, chat_name: str, handle_id: str, before: int):
+        super().__init__(
+            ui.Button(
+                label="Load earlier",
+                style=discord.ButtonStyle.secondary,
+                custom_id=f"load_earlier:{before}:{handle_id}:{chat_name}",
+            )
+        )
+        self.chat_name = chat_name
+        self.handle_id = handle_id
+        # Log index of the first entry that has already been shown
+        self.before = before
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item, match):
+        return cls(match["chat_name"], match["handle_id"], int(match["before"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        from talesbot import chats  # Avoid dependency cycle
+
+        await chats.send_earlier_history(
+            interaction, self.chat_name, self.handle_id, self.before
+        )
+
+
+class LoadEarlierView(ui.View):
+    def __init__(self, chat_name: str, handle_id: str, before: int):
+        super().__init__(timeout=None)
+        self.add_item(LoadEarlierButton(chat_name, handle_id, before))